@@ -1,20 +1,80 @@
-from sim.Environment import Environment
-from sim.LoadBalancer import LoadBalancer
-from sim.Source import Source, ArrivalSchedule, ExponentialSource
+from sim.Replication import Scenario, runScenario, runReplications
+from concurrent.futures import ProcessPoolExecutor
 import math
+import os
 import numpy as np
 
-def costCalculate(stopTime, nServers, arrivalsPerSecond, requestTypes, processCost = 1, cancelCost = -10, serverCost = -300):
-    env = Environment(stopTime=stopTime)
-    loadBalancer = LoadBalancer(nServers=nServers, environment=env)
-    source = ExponentialSource(arrivalsPerSecond, requestTypes, loadBalancer, env)
-    env.run(debug=False)
-    nCancelled = len(env.log['requestCancelled']) if 'requestCancelled' in env.log.keys() else 0
-    cost = len(env.log['requestProcessed']) * processCost + nCancelled * cancelCost + stopTime/60/60*nServers*serverCost
-    return cost
-
-def binaryServerSearch(arrivalsPerSecond, searchSpace=[10,40], processCost = 1, cancelCost = -10, serverCost = -300, requestTypes = [(0.5,1,0.1,10), (0.5,2,0.2,10)], simDuration=3*60*60):
-    stopTime = simDuration
+DEFAULT_REQUEST_TYPES = [(0.5,1,0.1,10), (0.5,2,0.2,10)]
+INVERSE_GOLDEN_RATIO = (math.sqrt(5) - 1)/2
+
+def costCalculate(stopTime, nServers, arrivalsPerSecond, requestTypes, processCost = 1, cancelCost = -10, serverCost = -300, seed = None):
+    scenario = Scenario(arrivalsPerSecond, nServers, requestTypes, seed=seed, stopTime=stopTime, processCost=processCost, cancelCost=cancelCost, serverCost=serverCost)
+    return runScenario(scenario)['cost']
+
+class CostCache:
+    """
+    Memoizes simulated costs by (arrivalsPerSecond, nServers, requestTypes, duration, seed) and evaluates the missing
+    points of a probe concurrently. Share one cache over a sweep so no point is simulated twice.
+    """
+    def __init__(self, requestTypes = DEFAULT_REQUEST_TYPES, simDuration = 3*60*60, seed = None, processCost = 1, cancelCost = -10, serverCost = -300, nWorkers = None):
+        """
+        Parameters
+        ----------
+        seed : int, optional
+            Seed used for every simulation, a fixed seed gives common random numbers over the compared server counts
+        nWorkers : int, optional
+            Number of worker processes, all cores by default
+        """
+        self.requestTypes = requestTypes
+        self.simDuration = simDuration
+        self.seed = seed
+        self.processCost, self.cancelCost, self.serverCost = processCost, cancelCost, serverCost
+        self.nWorkers = nWorkers or os.cpu_count() or 1
+        self.cache = {}
+        self.simulatedSeconds = 0 #total simulated time, a measure of the cost of a search
+        self.executor = None
+
+    def key(self, arrivalsPerSecond, nServers):
+        return (arrivalsPerSecond, nServers, tuple(tuple(requestType) for requestType in self.requestTypes), self.simDuration, self.seed)
+
+    def costs(self, arrivalsPerSecond, nServersList):
+        """
+        Get the costs for the given numbers of servers, the points that are not cached are simulated concurrently
+        """
+        missing = sorted({n for n in nServersList if self.key(arrivalsPerSecond, n) not in self.cache})
+        if missing:
+            scenarios = [Scenario(arrivalsPerSecond, n, self.requestTypes, seed=self.seed, stopTime=self.simDuration, processCost=self.processCost, cancelCost=self.cancelCost, serverCost=self.serverCost) for n in missing]
+            if self.executor is None and self.nWorkers > 1 and len(scenarios) > 1:
+                self.executor = ProcessPoolExecutor(max_workers=self.nWorkers)
+            results = runReplications(scenarios, nWorkers=1, executor=self.executor if len(scenarios) > 1 else None)
+            for n, result in zip(missing, results):
+                self.cache[self.key(arrivalsPerSecond, n)] = result['cost']
+            self.simulatedSeconds += len(missing)*self.simDuration
+        return [self.cache[self.key(arrivalsPerSecond, n)] for n in nServersList]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _bestOf(arrivalsPerSecond, left, right, cache: CostCache):
+    candidates = list(range(left, right + 1))
+    costs = cache.costs(arrivalsPerSecond, candidates)
+    return candidates[int(np.argmax(costs))]
+
+def binaryServerSearch(arrivalsPerSecond, searchSpace=[10,40], processCost = 1, cancelCost = -10, serverCost = -300, requestTypes = DEFAULT_REQUEST_TYPES, simDuration=3*60*60, seed = None, cache: CostCache = None):
+    """
+    Find the number of servers with the maximal reward by bisection on the sign of the cost difference of two
+    neighbouring server counts, both probes of an iteration are simulated concurrently
+    """
+    ownCache = cache is None
+    cache = CostCache(requestTypes, simDuration, seed, processCost, cancelCost, serverCost) if ownCache else cache
     left = searchSpace[0]
     right = searchSpace[1]
     dif = right-left
@@ -22,15 +82,53 @@ def binaryServerSearch(arrivalsPerSecond, searchSpace=[10,40], processCost = 1,
         mid = (left+right)/2
         left_temp = math.floor(mid)
         right_temp = left_temp+1
-        cost_left = costCalculate(stopTime=stopTime,nServers=left_temp,arrivalsPerSecond=arrivalsPerSecond,requestTypes=requestTypes, processCost=processCost,cancelCost=cancelCost,serverCost=serverCost)
-        cost_right = costCalculate(stopTime=stopTime,nServers=right_temp,arrivalsPerSecond=arrivalsPerSecond,requestTypes=requestTypes, processCost=processCost,cancelCost=cancelCost,serverCost=serverCost)
+        cost_left, cost_right = cache.costs(arrivalsPerSecond, [left_temp, right_temp])
         if (cost_left>cost_right):
             right = right_temp
         else:
             left = left_temp
         dif = right-left
-    cost_middle = costCalculate(stopTime=stopTime,nServers=left+1,arrivalsPerSecond=arrivalsPerSecond,requestTypes=requestTypes)
-    cost_list = [cost_left,cost_middle,cost_right]
-    n_star = left+int(np.where(cost_list==np.max(cost_list))[0][0])
+    n_star = _bestOf(arrivalsPerSecond, left, right, cache) #the remaining points are mostly cached already
+    if ownCache: cache.close()
+    return n_star
+
+def goldenSectionServerSearch(arrivalsPerSecond, searchSpace=[10,40], processCost = 1, cancelCost = -10, serverCost = -300, requestTypes = DEFAULT_REQUEST_TYPES, simDuration=3*60*60, seed = None, cache: CostCache = None):
+    """
+    Integer golden-section search for the number of servers with the maximal reward, assuming the reward is unimodal in
+    the number of servers. Every step reuses one of the two inner probes, so only one new point is simulated per step.
+    """
+    ownCache = cache is None
+    cache = CostCache(requestTypes, simDuration, seed, processCost, cancelCost, serverCost) if ownCache else cache
+    left, right = searchSpace[0], searchSpace[1]
+    innerLeft = right - round(INVERSE_GOLDEN_RATIO*(right - left))
+    innerRight = left + round(INVERSE_GOLDEN_RATIO*(right - left))
+    while right - left > 3:
+        if innerLeft >= innerRight: #rounding can make the inner points collide
+            innerRight = innerLeft + 1
+        cost_left, cost_right = cache.costs(arrivalsPerSecond, [innerLeft, innerRight])
+        if cost_left > cost_right:
+            right = innerRight - 1
+            innerRight = innerLeft
+            innerLeft = right - round(INVERSE_GOLDEN_RATIO*(right - left))
+        else:
+            left = innerLeft + 1
+            innerLeft = innerRight
+            innerRight = left + round(INVERSE_GOLDEN_RATIO*(right - left))
+    n_star = _bestOf(arrivalsPerSecond, left, right, cache)
+    if ownCache: cache.close()
     return n_star
 
+def serverSearchSweep(arrivalsPerSecondList, searchSpace=[10,40], method = 'binary', cache: CostCache = None, **cacheKwargs):
+    """
+    Run a server search for every arrival rate with one shared cost cache
+
+    Returns
+    -------
+    ({arrivalsPerSecond: optimal number of servers}, simulated hours)
+    """
+    search = {'binary': binaryServerSearch, 'golden': goldenSectionServerSearch}[method]
+    ownCache = cache is None
+    cache = CostCache(**cacheKwargs) if ownCache else cache
+    optima = {arrivalsPerSecond: search(arrivalsPerSecond, searchSpace, cache=cache) for arrivalsPerSecond in arrivalsPerSecondList}
+    if ownCache: cache.close()
+    return optima, cache.simulatedSeconds/60/60
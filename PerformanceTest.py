@@ -10,7 +10,7 @@ import argparse
 
 
 
-def main():
+def main(instrumentation = None):
     stopTime = 12*60*60
     env = Environment(stopTime=stopTime, usePrio = True)
 
@@ -23,7 +23,25 @@ def main():
     schedule = [11,12,14,16,14,12,13,15,17,16,14,12] #12 periods
     periodLength = 0.5*60*60 #half an hour per period -> schedule repeated two times in 12 hours
     arrivalSchedule = ArrivalSchedule(periodLength,arrivalSchedule=schedule, environment=env, loadBalancer=loadBalancer, source=source)
-    env.run(debug=False)
+    env.run(debug=False, instrumentation=instrumentation)
+
+def measureRequestMemory(nRequests = 100000, recycleRequests = False):
+    """
+    Memory per in-flight request in bytes: a Request waiting in a server queue together with its pending deadline event
+    """
+    import tracemalloc
+    from sim.Server import Server
+    from sim.Request import Request
+    env = Environment(stopTime=1, logMode="metrics", recycleRequests=recycleRequests)
+    server = Server(environment=env)
+    server.assignRequest(Request.create(0, 1, 10, env)) #keep the server busy, the other requests stay in flight
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for i in range(nRequests):
+        server.assignRequest(Request.create(0, 1, 10, env))
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before)/nRequests
 
 def printProfile(f):
     import pstats
@@ -33,11 +51,23 @@ def printProfile(f):
 if __name__=="__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--f", help="increase output verbosity")
+    parser.add_argument("--memory", action="store_true", help="report the memory per in-flight request")
+    parser.add_argument("--instrument", action="store_true", help="count and time the event callbacks instead of profiling")
     args = parser.parse_args()
 
     filename = None
 
-    if args.f:
+    if args.memory:
+        print(f"Memory per in-flight request: {measureRequestMemory():.0f} bytes")
+
+    elif args.instrument:
+        from sim.Instrumentation import Instrumentation, printProgress
+        instrumentation = Instrumentation(timingEvery=16, depthEvery=1000, progress=printProgress)
+        main(instrumentation)
+        print()
+        instrumentation.printSummary()
+
+    elif args.f:
         if args.f == '-1':
             import os
             print("yes")
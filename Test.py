@@ -1,3 +1,4 @@
+import functools
 import unittest
 from sim.Event import Event
 from sim.Environment import Environment
@@ -42,6 +43,29 @@ class  EnvironmentTest(unittest.TestCase):
         self.assertEqual(a[0],1)
         self.assertEqual(a[1],2)
     
+    def testInstrumentation(self):
+        from sim.Instrumentation import Instrumentation
+        def makeEnvironment(order):
+            env = Environment(stopTime=10)
+            for t in range(1, 6):
+                env.scheduleEvent(Event(t, functools.partial(order.append, t), "tick"))
+            env.scheduleEvent(Event(2.5, functools.partial(order.append, 2.5), "other"))
+            def onItem(payload): order.append(payload)
+            env.addStream(((t, -t) for t in (1.5, 3.5)), onItem)
+            return env
+        plainOrder, instrumentedOrder, progressCalls = [], [], []
+        makeEnvironment(plainOrder).run(debug=False)
+        instrumentation = Instrumentation(timingEvery=2, depthEvery=1, progress=lambda env, instrumentation: progressCalls.append(env.currentTime))
+        env = makeEnvironment(instrumentedOrder).run(debug=False, instrumentation=instrumentation)
+        self.assertListEqual(instrumentedOrder, plainOrder) #instrumentation does not change the run
+        self.assertEqual(env.handledEvents, 8)
+        self.assertEqual(instrumentation.counts, {'tick': 5, 'other': 1, 'EnvironmentTest.testInstrumentation.<locals>.makeEnvironment.<locals>.onItem': 2})
+        self.assertEqual(sum(timing[1] for timing in instrumentation.timings.values()), 4) #every second event is timed
+        times, depths = instrumentation.queueDepths()
+        self.assertListEqual(depths.tolist(), [5, 5, 4, 3, 2, 2, 1, 0])
+        self.assertEqual(progressCalls, [5]) #throttled, only the final call for a short run
+        self.assertEqual(sorted(row['count'] for row in instrumentation.summary()), [1, 2, 5])
+    
     def testLogData(self):
         env = Environment(stopTime=10)
         e1 = Event(3, lambda: env.logData("test", 2))
@@ -49,8 +73,27 @@ class  EnvironmentTest(unittest.TestCase):
         e2 = Event(2, lambda: env.logData("test", 1))
         env.scheduleEvent(e2)
         env.run()
-        self.assertListEqual(env.log["test"], [1,2]) #test correct order
-        self.assertListEqual(env.logTime["test"], [2,3]) #test correct timestamps
+        self.assertListEqual(env.log["test"].tolist(), [1,2]) #test correct order
+        self.assertListEqual(env.logTime["test"].tolist(), [2,3]) #test correct timestamps
+
+    def testLogColumn(self):
+        import numpy as np
+        env = Environment(stopTime=10)
+        for i in range(1000):
+            env.logData('test', i)
+        self.assertEqual(len(env.log['test']), 1000)
+        self.assertEqual(env.log['test'][-1], 999)
+        self.assertListEqual(list(env.log['test'][:3]), [0,1,2])
+        self.assertEqual(np.sum(env.log['test']), sum(range(1000)))
+        periodLog = env.getPeriodLog()['test']
+        self.assertTrue(np.shares_memory(periodLog, env.log['test'].buffer)) #zero-copy view
+        self.assertEqual(env.log['test'].values.dtype, np.int64) #ints stay ints, e.g. server counts
+        for i in range(2000):
+            env.logData('test', 0.5)
+        self.assertEqual(env.log['test'].values.dtype, np.float64) #a float upcasts the column
+        self.assertListEqual(env.log['test'][998:1001].tolist(), [998.0, 999.0, 0.5])
+        env.logData('label', 'text') #non-numeric data falls back to an object column
+        self.assertEqual(env.log['label'][0], 'text')
 
     def testLogPeriod(self):
         import numpy as np
@@ -81,6 +124,368 @@ class  EnvironmentTest(unittest.TestCase):
         self.assertEqual(np.mean(context['test']), np.mean(data))
 
 
+class PeriodMetricTest(unittest.TestCase):
+    def testMetricsMatchRawLog(self):
+        import numpy as np
+        from sim.GELoadBalancer import aggregatePeriodContext
+        agg = {'a': np.mean, 'b': np.sum, 'c': np.max, 'd': np.median}
+        envFull = Environment(stopTime=10)
+        envMetrics = Environment(stopTime=10, logMode="metrics")
+        envMetrics.registerMetric('a', 'mean')
+        envMetrics.registerMetric('c', 'max')
+        for period in range(3):
+            for i in range(50*(period+1)):
+                for env in (envFull, envMetrics):
+                    env.logData('a', i % 7)
+                    env.logData('b')
+                    env.logData('c', i)
+            fullContext = {key: agg[key](vals) for key, vals in envFull.getPeriodLog().items()}
+            metricsContext = envMetrics.getPeriodMetrics(['a', 'b', 'c'])
+            for key in ['a', 'b', 'c']:
+                self.assertAlmostEqual(fullContext[key], metricsContext[key])
+            envFull.resetPeriod()
+            envMetrics.resetPeriod()
+        self.assertEqual(len(envMetrics.log), 0) #no raw values are stored
+        self.assertEqual(envMetrics.lastLogValue('c'), 149)
+        context = aggregatePeriodContext(envMetrics, agg) #empty period
+        self.assertDictEqual(context, {'a': 0, 'b': 0, 'c': 0, 'd': 0})
+
+    def testUnknownAggregation(self):
+        env = Environment(stopTime=10)
+        self.assertRaises(ValueError, env.registerMetric, 'a', 'median')
+
+class TimeWeightedMetricTest(unittest.TestCase):
+    def testExactTimeAverage(self):
+        env = Environment(stopTime=20)
+        for time, delta in ((1, 2), (3, -1), (6, 3), (12, -4)):
+            env.scheduleEvent(Event(time, functools.partial(env.changeLevel, 'level', delta), "change"))
+        env.scheduleEvent(Event(8, env.resetPeriod, "period"))
+        env.run(debug=False, until=7.5)
+        self.assertAlmostEqual(env.getPeriodMetrics(['level'])['level'], (2*2 + 1*3 + 4*1.5)/7.5)
+        env.run(debug=False, until=10)
+        self.assertAlmostEqual(env.getPeriodMetrics(['level'])['level'], 4) #constant since before the period start
+        env.run(debug=False, until=16)
+        self.assertAlmostEqual(env.getPeriodMetrics(['level'])['level'], (4*4 + 0*4)/8)
+        self.assertEqual(env.lastLogValue('level'), 0)
+        self.assertNotIn('level', env.log) #nothing is logged per change
+
+    def testServerLevels(self):
+        from sim.LoadBalancer import LoadBalancer
+        from sim.Source import ExponentialSource
+        env = Environment(stopTime=200, logMode="metrics", seed=4)
+        loadBalancer = LoadBalancer(4, env)
+        ExponentialSource(3, [(0.5,1,0.1,10), (0.5,2,0.2,10)], loadBalancer, env)
+        env.scheduleEvent(Event(50, functools.partial(loadBalancer._setNumberOfServers, 8), "scale"))
+        env.run(debug=False)
+        levels = env.getPeriodMetrics(['numberBusy', 'numberOfServers', 'totalInQueue'])
+        self.assertAlmostEqual(levels['numberBusy'], loadBalancer.getBusyTime()/200) #utilization
+        self.assertAlmostEqual(levels['numberOfServers'], (4*50 + 8*150)/200)
+        self.assertGreater(levels['totalInQueue'], 0)
+
+class DatasetTest(unittest.TestCase):
+    def testPeriodDataset(self):
+        import os, tempfile
+        import numpy as np
+        from sim.Dataset import PeriodDatasetWriter, loadPeriodDataset
+        from sim.LoadBalancer import LoadBalancer
+        from sim.Replication import computeReward
+        from sim.Source import ExponentialSource
+        env = Environment(stopTime=500, logMode="metrics", seed=8)
+        for key in ('arrivalEvent', 'requestProcessed', 'requestCancelled'):
+            env.registerMetric(key, 'sum')
+        loadBalancer = LoadBalancer(4, env)
+        source = ExponentialSource(3, [(0.5,1,0.1,10), (0.5,2,0.2,10)], loadBalancer, env)
+        EventClock(100, env.resetPeriod, env)
+        with tempfile.TemporaryDirectory() as directory:
+            keys = ['arrivalEvent', 'requestProcessed', 'requestCancelled', 'numberOfServers', 'totalInQueue']
+            with PeriodDatasetWriter(directory, keys, rewards=(1, -10, -300), extraColumns=optimalServers, chunkRows=2, format='npz').attach(env):
+                env.run(debug=False)
+            self.assertEqual(len([name for name in os.listdir(directory) if name.endswith('.npz')]), 3)
+            data = loadPeriodDataset(directory, ['periodIndex', 'arrivalEvent', 'requestProcessed', 'requestCancelled', 'reward', 'optimalServers'])
+            self.assertIsInstance(data['reward'], np.memmap)
+            self.assertListEqual(data['periodIndex'].tolist(), [0, 1, 2, 3, 4])
+            self.assertEqual(data['arrivalEvent'].sum(), source.requestId)
+            self.assertAlmostEqual(data['reward'][0], computeReward(data['requestProcessed'][0], data['requestCancelled'][0], 4, 100))
+            self.assertTrue(np.all(data['optimalServers'] == 3))
+            self.assertListEqual(loadPeriodDataset(directory, ['arrivalEvent'])['arrivalEvent'].tolist(), data['arrivalEvent'].tolist()) #from the cache
+            everything = loadPeriodDataset(directory, mmap=False)
+            self.assertTrue(np.all(everything['numberOfServers'] == 4))
+            self.assertTrue(np.all(everything['endTime'] - everything['startTime'] == 100))
+            writer = PeriodDatasetWriter(directory, keys, chunkRows=1, format='npz', mode='a') #continue the dataset
+            writer.onPeriodEnd(env)
+            self.assertEqual(len(loadPeriodDataset(directory, ['arrivalEvent'])['arrivalEvent']), 6)
+            self.assertTrue(np.isnan(loadPeriodDataset(directory, ['reward'])['reward'][-1])) #a column the new chunk does not have
+            everything = loadPeriodDataset(directory) #all columns are cached once, then read from the cache
+            cachePath = everything['reward'].filename
+            modified = os.stat(cachePath).st_mtime_ns
+            self.assertListEqual(list(loadPeriodDataset(directory)), list(everything))
+            self.assertEqual(os.stat(cachePath).st_mtime_ns, modified)
+            writer = PeriodDatasetWriter(directory, ['arrivalEvent'], chunkRows=1, format='npz') #rewrite with as many chunks
+            for i in range(4):
+                writer.onPeriodEnd(env)
+            self.assertListEqual(list(loadPeriodDataset(directory)), ['periodIndex', 'startTime', 'endTime', 'arrivalEvent'])
+            del data, everything
+
+class LindleyEngineTest(unittest.TestCase):
+    def testCrossCheck(self):
+        import numpy as np
+        from sim.LindleyEngine import generateArrivals, crossCheck
+        rng = np.random.default_rng(0)
+        arrivals = generateArrivals(6, [(0.5,1,0.1,10),(0.5,2,0.2,10)], 0, 600, rng)
+        for nServers in (3, 10): #overloaded and stable
+            engineSummary, eventSummary = crossCheck(*arrivals, nServers=nServers, stopTime=550, rng=rng)
+            for key in ('arrivalEvent', 'requestProcessed', 'requestCancelled'):
+                self.assertEqual(engineSummary[key], eventSummary[key])
+            for key in ('requestWaitingTime', 'totalTimeInSystem'):
+                self.assertAlmostEqual(engineSummary[key], eventSummary[key])
+
+class ReplicationTest(unittest.TestCase):
+    def testParallelMatchesSerial(self):
+        from sim.Replication import Scenario, runReplications
+        scenarios = [Scenario(arrivalsPerSecond=5, nServers=n, seed=n, stopTime=120) for n in (4, 8)]
+        serial = runReplications(scenarios, nWorkers=1)
+        parallel = runReplications(scenarios, nWorkers=2)
+        for a, b in zip(serial, parallel):
+            self.assertEqual(a['cost'], b['cost'])
+            self.assertEqual(a['nServers'], b['nServers'])
+        self.assertGreater(serial[0]['arrivals'], 0)
+
+    def testCommonRandomNumbers(self):
+        from sim.Replication import Scenario, runReplications
+        results = runReplications([Scenario(arrivalsPerSecond=5, nServers=n, seed=3, stopTime=120, antithetic=antithetic) for n in (4, 8, 8) for antithetic in (False, True)], nWorkers=1)
+        self.assertEqual(results[0]['arrivals'], results[2]['arrivals']) #same arrival stream for a different number of servers
+        self.assertEqual(results[2], {**results[4], 'wallTime': results[2]['wallTime']}) #same seed, same run
+        self.assertNotEqual(results[0]['arrivals'], results[1]['arrivals']) #antithetic run
+
+def runWithServers(nServers, env, loadBalancer): #continuation for runForks, module level so it can be pickled
+    loadBalancer._setNumberOfServers(nServers)
+    env.run(debug=False)
+    return env.getPeriodMetrics(["requestProcessed", "requestCancelled"])
+
+def optimalServers(env): #extra dataset column, module level so it can be pickled
+    return {'optimalServers': 3}
+
+class SnapshotTest(unittest.TestCase):
+    def makeSimulation(self):
+        from sim.LoadBalancer import LoadBalancerShortestQueue
+        from sim.Source import ArrivalSchedule
+        env = Environment(stopTime=400, logMode="metrics", seed=5)
+        loadBalancer = LoadBalancerShortestQueue(3, env)
+        source = Source(4, [(0.5,1,0.1,10), (0.5,2,0.2,20)], loadBalancer, env)
+        ArrivalSchedule(100, [4, 6], env, source, loadBalancer)
+        return env, loadBalancer
+
+    def testForkContinuesIdentically(self):
+        import random
+        env, loadBalancer = self.makeSimulation()
+        env.run(debug=False, until=200) #pause at a period boundary
+        self.assertEqual(env.currentTime, 200)
+        snapshot = env.snapshot(loadBalancer)
+        fork, forkLoadBalancer = env.fork(loadBalancer)
+        self.assertIsNot(forkLoadBalancer, loadBalancer)
+        self.assertIs(forkLoadBalancer.environment, fork)
+        randomState = random.random()
+        env.run(debug=False)
+        fork.run(debug=False)
+        restored, _ = Environment.restore(snapshot)
+        self.assertEqual(random.random(), randomState) #the global random state is part of the snapshot
+        restored.run(debug=False)
+        metrics = env.getPeriodMetrics(["arrivalEvent", "requestProcessed", "requestCancelled"])
+        self.assertGreater(metrics["arrivalEvent"], 0)
+        self.assertEqual(fork.getPeriodMetrics(list(metrics)), metrics)
+        self.assertEqual(restored.getPeriodMetrics(list(metrics)), metrics)
+        self.assertEqual(fork.periodIndex, env.periodIndex)
+
+    def testGeneratorStreamError(self):
+        env, loadBalancer = self.makeSimulation()
+        env.addStream(((t, None) for t in range(1000, 2000)), print)
+        with self.assertRaisesRegex(TypeError, "Stream .* generator"):
+            env.snapshot(loadBalancer)
+
+    def testRunForks(self):
+        from sim.Replication import runForks
+        env, loadBalancer = self.makeSimulation()
+        env.run(debug=False, until=100)
+        continuations = [functools.partial(runWithServers, n) for n in (1, 4)]
+        serial = runForks(env, continuations, (loadBalancer,), nWorkers=1)
+        self.assertListEqual(runForks(env, continuations, (loadBalancer,), nWorkers=2), serial)
+        self.assertLess(serial[0]["requestProcessed"], serial[1]["requestProcessed"])
+        self.assertEqual(env.currentTime, 100) #the prefix itself is not changed
+
+class ModelOptimumTest(unittest.TestCase):
+    def testMatchesLoop(self):
+        import numpy as np
+        from sim.GELoadBalancer import modelOptimum
+        class Linear: #sklearn style linear model
+            def __init__(self, coef, intercept): self.coef_, self.intercept_ = np.array([coef]), np.array([intercept])
+            def predict(self, X): return X @ self.coef_.T + self.intercept_
+        class Quadratic(Linear):
+            def predict(self, X): return super().predict(X) - 0.7*X[:, -1:]**2
+            def polynomialInN(self, x): return (float(self.intercept_[0] + self.coef_[0, :-1] @ x), float(self.coef_[0, -1]), -0.7)
+        class Bumpy: #only predict, optimum found by search
+            def predict(self, X): return np.sin(X[:, -1]/37.0) + X[:, 0]
+        x = np.array([2.0, -1.0])
+        models = [Linear([1, 2, 5], 3), Linear([1, 2, -5], 3), Linear([1, 2, 0], 3), Quadratic([1, 2, 30.1], 3), Quadratic([1, 2, -30], 3), Bumpy()]
+        for model in models:
+            for nServerRange in ((1, 40), (10, 45), (1, 10000)):
+                candidates = np.arange(*nServerRange)
+                rewards = [model.predict(np.append(x, n)[None, :])[0] for n in candidates]
+                self.assertEqual(modelOptimum(model, x, nServerRange), candidates[int(np.argmax(rewards))])
+
+class OnlineModelTest(unittest.TestCase):
+    def testTrainingBuffer(self):
+        from sim.Models import TrainingBuffer
+        buffer = TrainingBuffer(window=50, forgetting=0.5, capacity=8)
+        for i in range(1000):
+            buffer.addFeatures([i, -i])
+            self.assertEqual(len(buffer.X), min(i, 50) + 1) #features are one row ahead of the targets
+            buffer.addTarget(2*i)
+        X, y, sampleWeight = buffer.trainingData()
+        self.assertListEqual(X[:, 0].tolist(), list(range(950, 1000)))
+        self.assertListEqual(y.tolist(), [2*i for i in range(950, 1000)])
+        self.assertEqual(sampleWeight[-1], 1)
+        self.assertEqual(sampleWeight[-2], 0.5)
+        self.assertLessEqual(len(buffer.targets), 128) #compacted instead of grown
+
+    def testRecursiveLeastSquares(self):
+        import numpy as np
+        from sim.Models import RecursiveLeastSquares
+        rng = np.random.default_rng(0)
+        X = rng.normal(size=(200, 3))
+        y = 1.5 + X @ np.array([2.0, -1.0, 0.5]) + rng.normal(scale=0.1, size=200)
+        model = RecursiveLeastSquares().fit(X[:100], y[:100]).partial_fit(X[100:], y[100:])
+        solution = np.linalg.lstsq(np.hstack([np.ones((200, 1)), X]), y, rcond=None)[0]
+        self.assertTrue(np.allclose(np.append(model.intercept_, model.coef_), solution, atol=1e-4))
+        self.assertGreater(model.score(X, y), 0.99)
+
+    def testGreedyEpsilonWithRecursiveLeastSquares(self):
+        from sim.GELoadBalancer import GreedyEpsilonLoadBalancer
+        from sim.Models import RecursiveLeastSquares
+        from sim.Source import ExponentialSource
+        env = Environment(stopTime=20*60, seed=5)
+        loadBalancer = GreedyEpsilonLoadBalancer(nServers=5, environment=env, model=RecursiveLeastSquares(), nServerRange=(1, 10), periodLength=60, window=10)
+        ExponentialSource(3, [(0.5,1,0.1,10), (0.5,2,0.2,10)], loadBalancer, env)
+        EventClock(60, loadBalancer.onPeriodEnd, env)
+        env.run(debug=False)
+        self.assertEqual(len(loadBalancer.y), 10)
+        self.assertEqual(len(loadBalancer.X), 11)
+        self.assertEqual(len(loadBalancer.model.coef_), loadBalancer.X.shape[1])
+
+class BanditTest(unittest.TestCase):
+    def testPosteriorFindsOptimum(self):
+        import numpy as np
+        from sim.Models import BayesianLinearReward
+        rng = np.random.default_rng(1)
+        model = BayesianLinearReward((1, 40), nKnots=14, loadIndex=0, rewardScale=1000)
+        def reward(x): #optimum at 2*x[0] servers, steep drop below it
+            return 1000 - 30*x[1] - 300*max(0, 2*x[0] - x[1])
+        for _ in range(300):
+            x = np.array([rng.uniform(5, 15), rng.integers(1, 40)])
+            model.update(x, reward(x) + rng.normal(scale=5))
+        candidates = np.arange(1, 40)
+        for load in (6.0, 12.0): #the optimum moves with the load
+            X = np.column_stack([np.full(len(candidates), load), candidates])
+            self.assertLessEqual(abs(candidates[np.argmax(model.predict(X))] - 2*load), 3)
+            self.assertLessEqual(abs(candidates[np.argmax(model.predict(X, model.sampleWeights(rng)))] - 2*load), 3)
+        self.assertLess(model.predictiveStd(np.array([[8.0, 16]]))[0], 50)
+
+    def testBanditLoadBalancer(self):
+        from sim.BanditLoadBalancer import BanditLoadBalancer
+        from sim.Source import ExponentialSource
+        for method in ('thompson', 'ucb'):
+            env = Environment(stopTime=10*60, seed=6)
+            loadBalancer = BanditLoadBalancer(nServers=5, environment=env, method=method, nServerRange=(1, 10), periodLength=60)
+            ExponentialSource(3, [(0.5,1,0.1,10), (0.5,2,0.2,10)], loadBalancer, env)
+            EventClock(60, loadBalancer.onPeriodEnd, env)
+            env.run(debug=False)
+            self.assertEqual(len(env.log['banditAction']), 10)
+            self.assertTrue(all(1 <= n < 10 for n in env.log['banditAction']))
+        self.assertRaises(ValueError, BanditLoadBalancer, 5, Environment(stopTime=10), 'greedy')
+
+class RolloutTest(unittest.TestCase):
+    def testRolloutLoadBalancer(self):
+        from sim.RolloutLoadBalancer import RolloutLoadBalancer
+        from sim.Source import ArrivalSchedule
+        env = Environment(stopTime=900, seed=2)
+        loadBalancer = RolloutLoadBalancer(8, env, periodLength=300, nWorkers=1, candidatesPerWorker=10)
+        self.assertListEqual(loadBalancer.getCandidates(), list(range(3, 13)))
+        source = Source(8, [(0.5,1,0.1,10), (0.5,2,0.2,20)], loadBalancer, env)
+        ArrivalSchedule(300, [8, 4, 8], env, source, loadBalancer)
+        env.run(debug=False)
+        low, high = env.log['rolloutAction'] #decided for the periods with 4 and 8 arrivals per second
+        self.assertLess(low, high)
+        self.assertGreaterEqual(high, 12) #about 12 servers busy at 8 arrivals per second
+        self.assertEqual(len(env.log['reward']), 3) #no rollouts at the period end at stopTime
+
+    def testTimeBudget(self):
+        from sim.RolloutLoadBalancer import RolloutLoadBalancer
+        env = Environment(stopTime=600, seed=2)
+        loadBalancer = RolloutLoadBalancer(8, env, periodLength=300, timeBudget=0, nWorkers=1)
+        env.run(debug=False, until=300)
+        loadBalancer.onPeriodEnd()
+        self.assertEqual(loadBalancer.nServers, 8) #no rollout finished a step, keep the number of servers
+
+    def testUnevenRollouts(self):
+        from sim.RolloutLoadBalancer import compareRollouts
+        fullRollout = [(15*(k + 1), 100 if k == 2 else 2000, 10) for k in range(20)] #ran the whole 300s horizon
+        cutRollout = [(15*(k + 1), 150, 0) for k in range(3)] #stopped by the budget after 45s
+        candidateRewards, duration = compareRollouts([5, 9, 12], [fullRollout, cutRollout, []], (1, -10, -300))
+        self.assertEqual(duration, 45) #both are compared over the first 45s, the one without a step is left out
+        self.assertListEqual([n for _, n in candidateRewards], [5, 9])
+        self.assertAlmostEqual(candidateRewards[0][0], 100 - 100 - 45/3600*5*300)
+        self.assertEqual(max(candidateRewards)[1], 9) #extrapolating each rollout on its own length would pick 5
+
+class ServerSearchTest(unittest.TestCase):
+    def testSearchesFindOptimum(self):
+        from BinarySearch import CostCache, binaryServerSearch, goldenSectionServerSearch
+        class QuadraticCostCache(CostCache): #known unimodal cost instead of simulations
+            def costs(self, arrivalsPerSecond, nServersList):
+                for n in nServersList:
+                    if n not in self.cache: self.cache[n] = -(n - arrivalsPerSecond)**2
+                return [self.cache[n] for n in nServersList]
+        for optimum in (11, 23, 39):
+            for search in (binaryServerSearch, goldenSectionServerSearch):
+                cache = QuadraticCostCache(nWorkers=1)
+                self.assertEqual(search(optimum, [10, 40], cache=cache), optimum)
+                self.assertLess(len(cache.cache), 11) #fewer simulations than the two probes per iteration before
+
+class BenchmarkTest(unittest.TestCase):
+    def testBenchmarksRun(self):
+        from benchmarks import runBenchmarks
+        queueResult, scenarioResult = runBenchmarks(['eventQueue/heap', 'scenario/rate5_servers3'], scale=0.01, isolate=False)
+        self.assertEqual(queueResult['events'], 4000)
+        self.assertIsNone(queueResult['simulatedHours'])
+        self.assertGreater(scenarioResult['events'], 5*36) #at least the arrivals of 36 simulated seconds
+        self.assertAlmostEqual(scenarioResult['simulatedHours'], 0.01)
+        self.assertGreater(scenarioResult['eventsPerSecond'], 0)
+
+    def testLoadBalancerBenchmarksRun(self):
+        from benchmarks import runBenchmarks
+        names = [f'loadBalancer/{name}' for name in ('LoadBalancer/reroute', 'GreedyEpsilonLoadBalancer', 'BanditLoadBalancer', 'RolloutLoadBalancer')]
+        for result in runBenchmarks(names, scale=0.1, isolate=False): #past the first scaling event or period end
+            self.assertGreater(result['events'], 20*360)
+
+class EventQueueTest(unittest.TestCase):
+    def testBackendsOrdering(self):
+        import random
+        from sim.EventQueue import EVENT_QUEUES
+        rng = random.Random(1)
+        specs = [(rng.choice([0.5, 1.0, 1.5, 2.0]), rng.choice([2, 9]), i) for i in range(200)] #many equal keys
+        orders = {}
+        for name in EVENT_QUEUES.keys():
+            env = Environment(stopTime=10, queue=name)
+            order = []
+            for time, prio, i in specs:
+                env.scheduleEvent(Event(time, lambda i=i: order.append(i), prio=prio))
+            env.run(debug=False)
+            orders[name] = order
+        expected = [i for _, _, i in sorted(specs, key=lambda s: (s[0], s[1], s[2]))] #FIFO for equal (time, prio)
+        for name, order in orders.items():
+            self.assertListEqual(order, expected, name)
+
+    def testUnknownBackend(self):
+        self.assertRaises(ValueError, Environment, 10, queue="unknown")
+
 class EventClockTest(unittest.TestCase):
     def testEventClock(self):
         def add(a,b):
@@ -122,6 +527,158 @@ class SourceTest(unittest.TestCase):
         #print(nArrival/nSamples)
         #self.assertAlmostEqual(arrivalsPerSecond * stopTime, nArrival, delta=15) #test sample prob of arrival approximately equal to provided requestProb
 
+    def testGeometricSkip(self):
+        import numpy as np
+        class RecordingLoadBalancer:
+            def __init__(self, env): self.env, self.times = env, []
+            def handleRequestArrival(self, request): self.times.append(self.env.currentTime)
+        def arrivalTimes(geometricSkip, requestProb, seed):
+            env = Environment(stopTime=10, seed=seed)
+            loadBalancer = RecordingLoadBalancer(env)
+            source = Source(10, [(0.5,1,0.1,10),(0.5,2,0.2,10)], loadBalancer, env, requestProb=requestProb, geometricSkip=geometricSkip)
+            env.scheduleEvent(Event(3.33, lambda: source.setArrivalsPerSecond(25), "rateChange"))
+            env.run(debug=False)
+            return np.array(loadBalancer.times), len(env.eventQueue)
+        ticks, _ = arrivalTimes(False, 1.0, 0) #with requestProb 1 every tick is an arrival: both modes give the same lattice
+        skips, _ = arrivalTimes(True, 1.0, 0)
+        self.assertEqual(len(ticks), len(skips))
+        self.assertTrue(np.allclose(ticks, skips))
+        counts = {mode: [len(arrivalTimes(mode, 0.5, seed)[0]) for seed in range(40)] for mode in (False, True)}
+        self.assertAlmostEqual(np.mean(counts[True]), 3.33*10 + 6.67*25, delta=5) #same mean
+        self.assertAlmostEqual(np.mean(counts[True]), np.mean(counts[False]), delta=6)
+        self.assertAlmostEqual(np.var(counts[True]), np.var(counts[False]), delta=60) #binomial variance ~100
+
+    def testBatchedSource(self):
+        import numpy as np
+        from sim.Source import BatchedSource
+        class RecordingLoadBalancer:
+            def __init__(self, env): self.env, self.requests = env, []
+            def handleRequestArrival(self, request):
+                self.requests.append((self.env.currentTime, request.type, request.processingTime, request.timeRequirement))
+        env = Environment(stopTime=100, seed=2)
+        loadBalancer = RecordingLoadBalancer(env)
+        requestTypes = [(0.2,1,0.1,10), (0.5,2,0.2,20), (0.3,3,0.3,30)]
+        source = BatchedSource(20, requestTypes, loadBalancer, env, periodLength=25)
+        self.assertEqual(len(env.eventQueue), 2) #the period clock and the next arrival, not every arrival of the period
+        self.assertEqual((source.arrivalTimes.dtype, source.types.dtype), (np.float64, np.int64)) #unboxed arrays, not lists
+        env.scheduleEvent(Event(30, lambda: source.setArrivalsPerSecond(40), "rateChange")) #used from the next period on
+        env.run(debug=False)
+        times, types, processingTimes, timeLimits = (np.array(column) for column in zip(*loadBalancer.requests))
+        self.assertTrue(np.all(np.diff(times) >= 0))
+        self.assertAlmostEqual(np.sum(times < 25)/25, 20, delta=3) #the first period has arrivals too
+        self.assertAlmostEqual(np.sum(times >= 50)/50, 40, delta=3)
+        for i, (prob, mean, _, timeLimit) in enumerate(requestTypes):
+            self.assertAlmostEqual(np.mean(types == i), prob, delta=0.03)
+            self.assertAlmostEqual(np.mean(processingTimes[types == i]), mean, delta=0.05)
+            self.assertTrue(np.all(timeLimits[types == i] == timeLimit))
+
+    def testStreams(self):
+        from sim.Source import ExponentialSource, BatchedSource
+        class RecordingLoadBalancer:
+            def __init__(self, env): self.env, self.requests = env, []
+            def handleRequestArrival(self, request): self.requests.append((self.env.currentTime, request.type, request.processingTime))
+        makeSources = {
+            'source': lambda lb, env, useStream: Source(10, [(0.5,1,0.1,10),(0.5,2,0.2,10)], lb, env, geometricSkip=True, useStream=useStream),
+            'exponential': lambda lb, env, useStream: ExponentialSource(10, [(0.5,1,0.1,10),(0.5,2,0.2,10)], lb, env, useStream=useStream),
+            'batched': lambda lb, env, useStream: BatchedSource(10, [(0.2,1,0.1,10),(0.3,2,0.2,10),(0.5,3,0.3,10)], lb, env, periodLength=4, useStream=useStream),
+        }
+        for name, makeSource in makeSources.items():
+            results = {}
+            for useStream in (False, True):
+                env = Environment(stopTime=20, seed=7)
+                loadBalancer = RecordingLoadBalancer(env)
+                source = makeSource(loadBalancer, env, useStream)
+                env.scheduleEvent(Event(7.77, lambda: source.setArrivalsPerSecond(20), "rateChange"))
+                queueSize = len(env.eventQueue)
+                env.run(debug=False)
+                results[useStream] = loadBalancer.requests
+                if useStream: self.assertLessEqual(queueSize, 2) #no arrival events
+            self.assertGreater(len(results[True]), 100)
+            self.assertEqual(results[False], results[True], name) #same arrivals as with events
+
+    def testGeneratorStream(self):
+        env = Environment(stopTime=10)
+        order = []
+        env.scheduleEvent(Event(2, lambda: order.append('event'), "event"))
+        env.addStream(((t, t) for t in (1, 2, 3, 11)), order.append)
+        env.run(debug=False)
+        self.assertListEqual(order, [1, 'event', 2, 3]) #items after events of the same time, nothing after stopTime
+
+    def testNHPPSource(self):
+        import numpy as np
+        from sim.Source import NHPPSource, PiecewiseLinearRate, DecisionSchedule
+        rate = PiecewiseLinearRate.fromSchedule([10, 40, 20], 100)
+        self.assertAlmostEqual(rate(50), 10)
+        self.assertAlmostEqual(rate(100), 25)
+        self.assertAlmostEqual(rate(350), 10) #repeats after the schedule
+        self.assertAlmostEqual(rate.maxRate(0, 120), 31)
+        self.assertAlmostEqual(rate.maxRate(420, 480), 40) #the peak inside the interval, after the repeat
+        class RecordingLoadBalancer:
+            def __init__(self): self.times, self.periods = [], 0
+            def handleRequestArrival(self, request): self.times.append(env.currentTime)
+            def onPeriodEnd(self): self.periods += 1
+        env = Environment(stopTime=600, seed=3)
+        loadBalancer = RecordingLoadBalancer()
+        NHPPSource(rate, [(1, 1, 0.1, 10)], loadBalancer, env, blockLength=30)
+        DecisionSchedule(120, env, loadBalancer) #decisions independent of the rate steps
+        env.run(debug=False)
+        times = np.array(loadBalancer.times)
+        self.assertEqual(loadBalancer.periods, 5)
+        self.assertTrue(np.all(np.diff(times) >= 0))
+        grid = np.linspace(0, 600, 6001)
+        for start in range(0, 600, 150): #counts match the integral of the rate
+            inWindow = (grid >= start) & (grid <= start + 150)
+            expected = np.trapz(rate(grid[inWindow]), grid[inWindow])
+            self.assertAlmostEqual(np.sum((times >= start) & (times < start + 150)), expected, delta=4*np.sqrt(expected))
+
+    def testNHPPSourceRateDropsToZero(self):
+        import numpy as np
+        from sim.Source import NHPPSource, PiecewiseLinearRate
+        for rate, stopTime in ((PiecewiseLinearRate([0, 100], [5, 0]), 500), (PiecewiseLinearRate.fromSchedule([5, 0], 100, 'step', repeat=False), np.inf)):
+            env = Environment(stopTime=stopTime, seed=3)
+            loadBalancer = TestLoadBalancer()
+            source = NHPPSource(rate, [(1, 1, 0.1, 10)], loadBalancer, env, blockLength=30)
+            env.run(debug=False) #the stream ends instead of generating empty blocks forever
+            self.assertGreater(source.requestId, 0)
+            self.assertLessEqual(source.blockStart, 150)
+
+    def testTraceSource(self):
+        import os, tempfile
+        import numpy as np
+        from sim.Trace import convertCsv, openTrace, TraceSource
+        class RecordingLoadBalancer:
+            def __init__(self): self.requests = []
+            def handleRequestArrival(self, request):
+                self.requests.append((env.currentTime, request.type, request.processingTime, request.timeRequirement))
+        with tempfile.TemporaryDirectory() as directory:
+            csvPath, tracePath = os.path.join(directory, 'trace.csv'), os.path.join(directory, 'trace.npy')
+            with open(csvPath, 'w') as file:
+                file.write('deadline,timestamp,type,processingTime\n')
+                for i in range(100):
+                    file.write(f'{10 + i},{2*i},{i % 3},{0.5*i}\n')
+            self.assertEqual(convertCsv(csvPath, tracePath, {'time': 'timestamp', 'timeLimit': 'deadline'}, chunkSize=30), 100)
+            self.assertEqual(openTrace(tracePath)['processingTime'][99], 49.5)
+            env = Environment(stopTime=1000)
+            loadBalancer = RecordingLoadBalancer()
+            source = TraceSource(tracePath, loadBalancer, env, timeScale=0.5, startTime=50, endTime=150, chunkSize=7)
+            restored = TraceSource.__new__(TraceSource) #pickles by path and position
+            restored.__setstate__(source.__getstate__())
+            self.assertListEqual(restored.arrivalTimes, source.arrivalTimes)
+            env.run(debug=False)
+            del source, restored #release the memory maps before the directory is removed
+        times, types, processingTimes, timeLimits = (np.array(column) for column in zip(*loadBalancer.requests))
+        indices = np.arange(25, 75) #trace times 50, 52, ..., 148
+        self.assertTrue(np.allclose(times, (2*indices - 50)*0.5))
+        self.assertTrue(np.all(types == indices % 3))
+        self.assertTrue(np.allclose(processingTimes, 0.5*indices))
+        self.assertTrue(np.allclose(timeLimits, 10 + indices))
+        with tempfile.TemporaryDirectory() as directory:
+            csvPath = os.path.join(directory, 'trace.csv')
+            with open(csvPath, 'w') as file:
+                file.write('time,type,processingTime,timeLimit\n2,0,1,1\n1,0,1,1\n')
+            with self.assertRaises(ValueError): #arrivals must be in time order
+                convertCsv(csvPath, os.path.join(directory, 'trace.npy'))
+
     #def testRequestTypeSampling(self):
 class QueueTest(unittest.TestCase):
     def testPushPull(self):
@@ -191,6 +748,73 @@ class ServerTest(unittest.TestCase):
         self.assertEqual(len(server.queue), 0)
         self.assertEqual(len(env.log["requestProcessed"]), 10)
 
+class ShortestQueueTest(unittest.TestCase):
+    def testIndexedMinHeap(self):
+        import random
+        from sim.IndexedHeap import IndexedMinHeap
+        rng = random.Random(2)
+        keys = [rng.randint(0, 5) for _ in range(20)]
+        heap = IndexedMinHeap(keys)
+        for _ in range(2000):
+            action = rng.random()
+            if action < 0.1: keys.append(rng.randint(0, 5)); heap.append(keys[-1])
+            elif action < 0.2 and len(keys) > 1: keys.pop(); heap.pop()
+            else:
+                item = rng.randrange(len(keys))
+                keys[item] = max(0, keys[item] + rng.choice([-1, 1]))
+                heap.update(item, keys[item])
+            self.assertEqual(heap.min(), keys.index(min(keys))) #first item with the smallest key
+
+    def testAssignsToLeastLoaded(self):
+        from sim.LoadBalancer import LoadBalancerShortestQueue
+        from sim.Source import ExponentialSource
+        env = Environment(stopTime=300, seed=1)
+        loadBalancer = LoadBalancerShortestQueue(nServers=6, environment=env)
+        ExponentialSource(5, [(0.5,1,0.1,10), (0.5,2,0.2,10)], loadBalancer, env)
+        assign = loadBalancer.handleRequestArrival
+        def checkedAssign(request):
+            loads = [server.load for server in loadBalancer.serverList]
+            self.assertIs(loadBalancer.serverList[loadBalancer.loadIndex.min()], loadBalancer.serverList[loads.index(min(loads))])
+            assign(request)
+        loadBalancer.handleRequestArrival = checkedAssign
+        env.scheduleEvent(Event(100, lambda: loadBalancer._setNumberOfServers(9), "scaleUp"))
+        env.scheduleEvent(Event(200, lambda: loadBalancer._setNumberOfServers(4), "scaleDown"))
+        env.run(debug=False)
+        self.assertEqual(len(loadBalancer.loadIndex), 4)
+        self.assertGreater(len(env.log["requestProcessed"]), 0)
+
+class ServerPoolTest(unittest.TestCase):
+    def testDrainAndReuse(self):
+        from sim.LoadBalancer import LoadBalancer
+        from sim.Source import ExponentialSource
+        for drainMode in ('drain', 'reroute'):
+            env = Environment(stopTime=300, seed=4)
+            loadBalancer = LoadBalancer(nServers=4, environment=env, drainMode=drainMode)
+            ExponentialSource(6, [(0.5,1,0.1,10), (0.5,2,0.2,10)], loadBalancer, env)
+            removed = []
+            def scaleDown():
+                removed.extend(loadBalancer.serverList[1:])
+                loadBalancer._setNumberOfServers(1)
+                if drainMode == 'reroute':
+                    self.assertTrue(all(len(server.queue) == 0 for server in removed)) #queues are routed to the remaining server
+            env.scheduleEvent(Event(100, scaleDown, "scaleDown"))
+            env.scheduleEvent(Event(200, lambda: loadBalancer._setNumberOfServers(5), "scaleUp"))
+            env.run(debug=False)
+            servers = loadBalancer.serverList + loadBalancer.drainingServers + loadBalancer.serverPool
+            self.assertEqual(len(servers), 5)
+            self.assertEqual(len({server.id for server in servers}), 5) #unique ids
+            self.assertTrue(all(any(server is other for other in loadBalancer.serverList) for server in removed)) #removed servers are reused
+            self.assertLessEqual(loadBalancer.getBusyTime(), 4*100 + 3*10 + 100 + 5*100) #draining servers finish within the deadline
+
+    def testBusyTime(self):
+        env = Environment(stopTime=10)
+        server = Server(environment=env)
+        for i in range(3):
+            env.scheduleEvent(Event(i*0.5, lambda: server.assignRequest(Request(0, 1, 10, env)), "assignToServer"))
+        env.scheduleEvent(Event(5, lambda: server.assignRequest(Request(0, 1, 10, env)), "assignToServer"))
+        env.run(debug=False)
+        self.assertAlmostEqual(server.getBusyTime(), 4)
+
 class RequestTest(unittest.TestCase):
     def testCancel(self):
         env = Environment(stopTime=10)
@@ -211,6 +835,52 @@ class RequestTest(unittest.TestCase):
         self.assertFalse(req.isCancelled)
         self.assertTrue(req.isProcessed)
 
+    def testDeadlineCancelledOnFinish(self):
+        env = Environment(stopTime=20)
+        server = Server(environment = env)
+        req = Request(0, 1, 10, env)
+        server.assignRequest(req)
+        self.assertEqual(len(env.eventQueue), 2) #deadline and finish
+        env.run(debug=False)
+        self.assertTrue(req.isProcessed)
+        self.assertTrue(req.deadlineEvent.isCancelled)
+        self.assertFalse(req.deadlineEvent.isTriggered)
+
+    def testCancelInService(self):
+        env = Environment(stopTime=20)
+        server = Server(environment = env)
+        req = Request(0, 5, 2, env) #deadline passes while being processed
+        server.assignRequest(req)
+        env.run(debug=False)
+        self.assertTrue(req.isCancelled)
+        self.assertFalse(req.isProcessed)
+        self.assertFalse(req.finishEvent.isTriggered)
+        self.assertNotIn('requestProcessed', env.log.keys())
+        self.assertIsNone(server.nowServing)
+
+    def testRequestRecycling(self):
+        env = Environment(stopTime=20, recycleRequests=True)
+        server = Server(environment = env)
+        req = Request.create(0, 1, 10, env)
+        firstId = req.id
+        server.assignRequest(req)
+        env.run(debug=False)
+        self.assertEqual(len(env.requestPool), 1) #finished request was handed back
+        reused = Request.create(1, 2, 10, env)
+        self.assertIs(reused, req)
+        self.assertNotEqual(reused.id, firstId)
+        self.assertFalse(reused.isProcessed)
+        self.assertEqual(reused.type, 1)
+
+    def testHeapCompaction(self):
+        from sim.EventQueue import COMPACT_MIN_CANCELLED
+        env = Environment(stopTime=10)
+        events = [Event(1, lambda: None) for _ in range(2*COMPACT_MIN_CANCELLED)]
+        for e in events: env.scheduleEvent(e)
+        for e in events[:-10]: env.cancelEvent(e)
+        self.assertEqual(len(env.eventQueue), 10)
+        self.assertLess(len(env.eventQueue.heap), 2*COMPACT_MIN_CANCELLED)
+
     
 if __name__ == '__main__':
     unittest.main()
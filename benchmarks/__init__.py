@@ -0,0 +1,8 @@
+"""
+Benchmark suite of the simulator, run it with
+
+    python -m benchmarks [--quick] [--filter source] [--out results.json] [--compare baseline.json]
+
+The results are written as JSON, compare runs of different commits on the same machine.
+"""
+from benchmarks.suite import BENCHMARKS, runBenchmark, runBenchmarks
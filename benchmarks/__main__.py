@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+from benchmarks.suite import BENCHMARKS, runBenchmarks
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def formatValue(value, digits = 3):
+    if value is None: return '-'
+    return f"{value:.{digits}g}" if isinstance(value, float) else str(value)
+
+
+def printResults(results, baseline = None):
+    baseline = {result['name']: result for result in (baseline or [])}
+    print(f"{'benchmark':48} {'wall s':>9} {'events/s':>10} {'s/sim h':>9} {'RSS MB':>8}" + (f" {'speedup':>8}" if baseline else ''))
+    for result in results:
+        line = f"{result['name']:48} {formatValue(result['wallTime']):>9} {formatValue(result['eventsPerSecond']):>10} {formatValue(result['wallTimePerSimulatedHour']):>9} {formatValue(result['peakRssMB']):>8}"
+        old = baseline.get(result['name'])
+        if old and old['eventsPerSecond'] and result['eventsPerSecond']: #throughput relative to the baseline
+            line += f" {result['eventsPerSecond']/old['eventsPerSecond']:>7.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Benchmarks of the simulator")
+    parser.add_argument("--filter", nargs='*', help="only run the benchmarks whose name contains one of these strings")
+    parser.add_argument("--scale", type=float, default=1.0, help="size of the benchmarks, 1 simulates one hour per simulation benchmark")
+    parser.add_argument("--quick", action="store_true", help="shorthand for --scale 0.1")
+    parser.add_argument("--out", help="JSON file for the results, by default benchmarks/results/<time>_<commit>.json")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare the throughput with")
+    parser.add_argument("--no-isolate", action="store_true", help="run all benchmarks in this process instead of a fresh process each")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks")
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(BENCHMARKS))
+        return
+    names = [name for name in BENCHMARKS if not args.filter or any(part in name for part in args.filter)]
+    scale = 0.1 if args.quick else args.scale
+    results = runBenchmarks(names, scale=scale, isolate=not args.no_isolate)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+    printResults(results, baseline)
+
+    commit = gitCommit()
+    now = datetime.now()
+    report = {
+        'timestamp': now.isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpuCount': os.cpu_count(),
+        'scale': scale,
+        'results': results,
+    }
+    out = args.out
+    if out is None:
+        os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+        out = os.path.join(RESULTS_DIRECTORY, f"{now.strftime('%Y%m%d_%H%M%S')}_{commit or 'nogit'}.json")
+    with open(out, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Benchmark cases of the simulator. Every case builds its own inputs, runs the measured part and returns what it did:
+{'events': handled events or operations, 'simulatedTime': simulated seconds (optional)}. runBenchmarks times the
+cases and adds the throughput, the wall time per simulated hour and the peak resident memory.
+"""
+import contextlib
+import io
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import resource #unix only
+except ImportError:
+    resource = None
+
+from sim.Environment import Environment
+from sim.Event import Event
+from sim.EventQueue import makeEventQueue
+from sim.LoadBalancer import LoadBalancer, LoadBalancerShortestQueue
+from sim.LoadBalancerRandom import LoadBalancerRandom
+from sim.Request import Request
+from sim.Server import Queue
+from sim.Source import Source, ExponentialSource, BatchedSource, NHPPSource, PiecewiseLinearRate, TestLoadBalancer, EventClock
+
+REQUEST_TYPES = [(0.5,1,0.1,10), (0.5,2,0.2,10)] #(prob, mu, sigma, cancelTime)
+HOUR = 60*60
+PERIOD_LENGTH = 5*60 #decision period of the load balancers that pick the number of servers
+
+
+class NullLoadBalancer(TestLoadBalancer):
+    """
+    Drops every request, so a source benchmark only measures the source
+    """
+    def handleRequestArrival(self, request):
+        request.cancelRequest() #its deadline event would otherwise stay in the queue
+        return
+
+
+def _doNothing():
+    return
+
+
+def eventQueueCase(backend):
+    def case(scale):
+        n = int(200_000*scale)
+        queue = makeEventQueue(backend)
+        events = [Event(t, _doNothing) for t in np.random.default_rng(0).uniform(0, n/10, n).tolist()]
+        startTime = time.perf_counter()
+        for event in events:
+            queue.push(event)
+        while queue.popUntil(np.inf) is not None:
+            pass
+        return {'events': 2*n, 'wallTime': time.perf_counter() - startTime} #a push and a pop per event
+    return case
+
+
+def queueCase(operation):
+    def case(scale):
+        n = int(100_000*scale)
+        env = Environment(stopTime=1, logMode="metrics")
+        queue = Queue(environment=env)
+        requests = [Request(0, 1, 10, env) for i in range(n)]
+        startTime = time.perf_counter()
+        for request in requests:
+            queue.push(request)
+        if operation == 'pull':
+            for i in range(n):
+                queue.pull()
+        else: #remove every other request (like cancellations), then pull the rest
+            for request in requests[::2]:
+                queue.remove(request.id)
+            while queue.size:
+                queue.pull()
+        return {'events': 2*n, 'wallTime': time.perf_counter() - startTime}
+    return case
+
+
+def sourceCase(makeSource):
+    def case(scale):
+        env = Environment(stopTime=HOUR*scale, logMode="metrics", seed=0)
+        makeSource(NullLoadBalancer(), env)
+        env.run(debug=False)
+        return {'events': env.handledEvents, 'simulatedTime': env.stopTime}
+    return case
+
+
+def traceSourceCase(scale):
+    from sim.Trace import TRACE_DTYPE, TraceSource
+    env = Environment(stopTime=HOUR*scale, logMode="metrics", seed=0)
+    n = int(60*env.stopTime) #50 arrivals per second, with room to spare
+    with tempfile.TemporaryDirectory() as directory:
+        tracePath = os.path.join(directory, 'trace.npy')
+        trace = np.lib.format.open_memmap(tracePath, mode='w+', dtype=TRACE_DTYPE, shape=(n,))
+        trace['time'] = np.cumsum(np.random.default_rng(0).exponential(1/50, n))
+        trace['processingTime'], trace['timeLimit'] = 1, 10
+        trace.flush()
+        del trace
+        source = TraceSource(tracePath, NullLoadBalancer(), env)
+        startTime = time.perf_counter()
+        env.run(debug=False)
+        wallTime = time.perf_counter() - startTime
+        del source
+    return {'events': env.handledEvents, 'simulatedTime': env.stopTime, 'wallTime': wallTime}
+
+
+SOURCES = {
+    'Source': lambda loadBalancer, env: Source(50, REQUEST_TYPES, loadBalancer, env),
+    'Source/geometricSkip': lambda loadBalancer, env: Source(50, REQUEST_TYPES, loadBalancer, env, geometricSkip=True),
+    'Source/stream': lambda loadBalancer, env: Source(50, REQUEST_TYPES, loadBalancer, env, geometricSkip=True, useStream=True),
+    'ExponentialSource': lambda loadBalancer, env: ExponentialSource(50, REQUEST_TYPES, loadBalancer, env),
+    'ExponentialSource/stream': lambda loadBalancer, env: ExponentialSource(50, REQUEST_TYPES, loadBalancer, env, useStream=True),
+    'BatchedSource': lambda loadBalancer, env: BatchedSource(50, REQUEST_TYPES, loadBalancer, env, periodLength=HOUR/2),
+    'NHPPSource': lambda loadBalancer, env: NHPPSource(PiecewiseLinearRate.fromSchedule([40, 60], HOUR/2), REQUEST_TYPES, loadBalancer, env),
+}
+
+
+def loadBalancerCase(loadBalancerClass, scaleEvery = None, **kwargs):
+    def case(scale):
+        env = Environment(stopTime=HOUR*scale, logMode="metrics", seed=0)
+        loadBalancer = loadBalancerClass(nServers=30, environment=env, **kwargs)
+        ExponentialSource(20, REQUEST_TYPES, loadBalancer, env, useStream=True)
+        if scaleEvery is not None: #alternate between 30 and 15 servers, the removed servers drain or reroute their queues
+            EventClock(scaleEvery, lambda: loadBalancer._setNumberOfServers(45 - loadBalancer.nServers), env)
+        env.run(debug=False)
+        return {'events': env.handledEvents, 'simulatedTime': env.stopTime}
+    return case
+
+
+def periodLoadBalancerCase(makeLoadBalancer):
+    """
+    A load balancer that picks the number of servers at every period end, through a full simulated run
+    """
+    def case(scale):
+        env = Environment(stopTime=HOUR*scale, logMode="metrics", seed=0)
+        loadBalancer = makeLoadBalancer(env)
+        ExponentialSource(20, REQUEST_TYPES, loadBalancer, env, useStream=True)
+        EventClock(PERIOD_LENGTH, loadBalancer.onPeriodEnd, env)
+        with contextlib.redirect_stdout(io.StringIO()): #the greedy-epsilon load balancers print every period
+            env.run(debug=False)
+        return {'events': env.handledEvents, 'simulatedTime': env.stopTime}
+    return case
+
+
+def _greedyEpsilon(env):
+    from sim.GELoadBalancer import GreedyEpsilonLoadBalancer
+    from sim.Models import RecursiveLeastSquares
+    return GreedyEpsilonLoadBalancer(30, env, RecursiveLeastSquares(), periodLength=PERIOD_LENGTH)
+
+
+def _bandit(env):
+    from sim.BanditLoadBalancer import BanditLoadBalancer
+    return BanditLoadBalancer(30, env, periodLength=PERIOD_LENGTH)
+
+
+def _rollout(env):
+    from sim.RolloutLoadBalancer import RolloutLoadBalancer
+    return RolloutLoadBalancer(30, env, periodLength=PERIOD_LENGTH, nWorkers=1, candidatesPerWorker=4, timeBudget=1.0)
+
+
+def greedyEpsilonCase(scale):
+    """
+    onPeriodEnd of GreedyEpsilonLoadBalancer with an online model, on a log with a period worth of values
+    """
+    from sim.GELoadBalancer import GreedyEpsilonLoadBalancer
+    from sim.Models import RecursiveLeastSquares
+    nPeriods = max(2, int(200*scale))
+    env = Environment(stopTime=np.inf, logMode="metrics", seed=0)
+    loadBalancer = GreedyEpsilonLoadBalancer(10, env, RecursiveLeastSquares(), eta=0.1, periodLength=60)
+    rng = np.random.default_rng(0)
+    wallTime = 0.0
+    with contextlib.redirect_stdout(io.StringIO()): #the load balancer prints every period
+        for period in range(nPeriods):
+            for key in loadBalancer.agg:
+                for value in rng.uniform(0, 10, 100):
+                    env.logData(key, value)
+            startTime = time.perf_counter()
+            loadBalancer.onPeriodEnd()
+            wallTime += time.perf_counter() - startTime
+    return {'events': nPeriods, 'wallTime': wallTime} #only the onPeriodEnd calls are timed
+
+
+def scenarioCase(arrivalsPerSecond, nServers):
+    def case(scale):
+        env = Environment(stopTime=HOUR*scale, logMode="metrics", seed=0)
+        loadBalancer = LoadBalancer(nServers=nServers, environment=env)
+        Source(arrivalsPerSecond, REQUEST_TYPES, loadBalancer, env, geometricSkip=True)
+        env.run(debug=False)
+        return {'events': env.handledEvents, 'simulatedTime': env.stopTime}
+    return case
+
+
+BENCHMARKS = {
+    **{f'eventQueue/{backend}': eventQueueCase(backend) for backend in ('heap', 'calendar', 'sorted')},
+    **{f'queue/{operation}': queueCase(operation) for operation in ('pull', 'remove')},
+    **{f'source/{name}': sourceCase(makeSource) for name, makeSource in SOURCES.items()},
+    'source/TraceSource': traceSourceCase,
+    'loadBalancer/LoadBalancer': loadBalancerCase(LoadBalancer),
+    'loadBalancer/LoadBalancer/drain': loadBalancerCase(LoadBalancer, scaleEvery=PERIOD_LENGTH),
+    'loadBalancer/LoadBalancer/reroute': loadBalancerCase(LoadBalancer, scaleEvery=PERIOD_LENGTH, drainMode='reroute'),
+    'loadBalancer/LoadBalancerShortestQueue': loadBalancerCase(LoadBalancerShortestQueue),
+    'loadBalancer/LoadBalancerRandom': loadBalancerCase(LoadBalancerRandom),
+    'loadBalancer/GreedyEpsilonLoadBalancer': periodLoadBalancerCase(_greedyEpsilon),
+    'loadBalancer/BanditLoadBalancer': periodLoadBalancerCase(_bandit),
+    'loadBalancer/RolloutLoadBalancer': periodLoadBalancerCase(_rollout),
+    'greedyEpsilon/onPeriodEnd': greedyEpsilonCase,
+    **{f'scenario/rate{rate}_servers{nServers}': scenarioCase(rate, nServers) for rate, nServers in ((5, 3), (5, 10), (14, 12), (14, 30), (50, 80))},
+}
+
+
+def peakRss():
+    """
+    Peak resident memory of this process in MB, None where the resource module is missing
+    """
+    if resource is None: return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss/2**20 if os.uname().sysname == 'Darwin' else maxrss/2**10 #bytes on macOS, kB on linux
+
+
+def runBenchmark(name, scale = 1.0):
+    """
+    Run one benchmark case and return its result dict
+    """
+    startTime = time.perf_counter()
+    result = BENCHMARKS[name](scale)
+    wallTime = result.pop('wallTime', time.perf_counter() - startTime)
+    simulatedHours = result.pop('simulatedTime', 0)/HOUR
+    return {
+        'name': name,
+        'wallTime': wallTime,
+        'events': result['events'],
+        'eventsPerSecond': result['events']/wallTime if wallTime > 0 else None,
+        'simulatedHours': simulatedHours or None,
+        'wallTimePerSimulatedHour': wallTime/simulatedHours if simulatedHours else None,
+        'peakRssMB': peakRss(),
+    }
+
+
+def runBenchmarks(names = None, scale = 1.0, isolate = True):
+    """
+    Run benchmark cases
+
+    Parameters
+    ----------
+    names : list[str], optional
+        Cases to run, all by default
+    scale : float
+        Size of the cases relative to the default (one simulated hour per simulation case)
+    isolate : bool
+        Run every case in a fresh forked process (where available), so the peak memory is that of the case alone and
+        the cases do not warm up each other's caches
+
+    Returns
+    -------
+    list of result dicts, see runBenchmark
+    """
+    names = list(BENCHMARKS) if names is None else list(names)
+    if isolate and 'fork' in multiprocessing.get_all_start_methods():
+        with multiprocessing.get_context('fork').Pool(1, maxtasksperchild=1) as pool:
+            return [pool.apply(runBenchmark, (name, scale)) for name in names]
+    return [runBenchmark(name, scale) for name in names]
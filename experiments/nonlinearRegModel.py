@@ -2,17 +2,30 @@ import numpy as np
 from sklearn.linear_model import LinearRegression
 
 class NonLinearReg():
+    """
+    Linear regression on the features and their squares
+    """
     def __init__(self):
         self.order = 2
         self.mod = LinearRegression()
 
+    def transform(self, X):
+        return np.hstack([X, X**2])
+
     def fit(self, X, y):
-        X = np.vstack([X, X**2], axis=0)
-        self.mod.fit(X,y)
+        self.mod.fit(self.transform(X),y)
         return self
 
     def predict(self, X):
-        return self.mod.predict(X)
+        return self.mod.predict(self.transform(X))
 
     def score(self, x, y):
-        return self.mod.score(x, y)
\ No newline at end of file
+        return self.mod.score(self.transform(x), y)
+
+    def polynomialInN(self, x):
+        """
+        Coefficients (c0, c1, c2) of the prediction for np.append(x, n) as a polynomial in n
+        """
+        coef, d = np.ravel(self.mod.coef_), len(x) + 1
+        c0 = np.ravel(self.mod.intercept_)[0] + coef[:d-1] @ x + coef[d:2*d-1] @ x**2
+        return (float(c0), float(coef[d-1]), float(coef[2*d-1]))
\ No newline at end of file
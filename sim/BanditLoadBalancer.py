@@ -0,0 +1,46 @@
+from sim.GELoadBalancer import GreedyEpsilonLoadBalancer
+from sim.Models import BayesianLinearReward
+import numpy as np
+
+BANDIT_METHODS = ('thompson', 'ucb')
+
+class BanditLoadBalancer(GreedyEpsilonLoadBalancer):
+    """
+    Contextual bandit load balancer: keeps a Bayesian linear model of the period reward over the same features as the
+    greedy-epsilon load balancer (the previous period context and the number of servers) and picks the number of servers
+    for the next period by Thompson sampling or LinUCB instead of uniform exploration. Exploration is concentrated on the
+    server counts that can still be optimal, so it needs far fewer periods to settle.
+    Plugs into ArrivalSchedule like the other load balancers, the decision is made in onPeriodEnd.
+    """
+    def __init__(self, nServers, environment, method='thompson', alpha=1.0, processReward=1, cancelReward=-10, serverReward=-300, nServerRange = (1,40), periodLength =1*60*60, nKnots=10, loadKey='arrivalEvent', priorStd=10.0, noiseStd=0.05, window=None):
+        """
+            method: 'thompson' (draw the weights from the posterior and take the best n) or 'ucb' (take the n with the
+                highest upper confidence bound mean + alpha*std of the expected reward)
+            alpha: width of the confidence bound for 'ucb'
+            nKnots: number of knots of the piecewise-linear reward model in the number of servers
+            loadKey: context key the reward curve in the number of servers scales with, None for a fixed curve
+            priorStd, noiseStd: standard deviation of the prior of the model weights and of the reward noise, relative to
+                the cost of the maximal number of servers
+        """
+        if method not in BANDIT_METHODS:
+            raise ValueError(f"Unknown method '{method}', choose from {BANDIT_METHODS}")
+        super().__init__(nServers, environment, None, processReward=processReward, cancelReward=cancelReward, serverReward=serverReward, eta=0, nServerRange=nServerRange, periodLength=periodLength, window=window)
+        self.agg['numberBusy'] = np.mean #time averaged number of busy servers (utilization), kept by the environment
+        contextKeys = list(self.agg.keys())
+        self.model = BayesianLinearReward(nServerRange, nKnots, loadIndex=None if loadKey is None else contextKeys.index(loadKey), rewardScale=abs(serverReward)*nServerRange[1]*periodLength/60/60, priorStd=priorStd, noiseStd=noiseStd)
+        self.model.initialize(len(contextKeys))
+        self.method = method
+        self.alpha = alpha
+
+    def getNextPeriodNumberOfServers(self, context):
+        candidates = np.arange(self.nServerRange[0], self.nServerRange[1])
+        X = np.empty((len(candidates), len(context) + 1))
+        X[:, :-1] = list(context.values())
+        X[:, -1] = candidates
+        if self.method == 'thompson':
+            score = self.model.predict(X, self.model.sampleWeights(self.explorationStream.generator))
+        else:
+            score = self.model.predict(X) + self.alpha*self.model.predictiveStd(X)
+        nServers = int(candidates[np.argmax(score)])
+        self.environment.logData("banditAction", nServers)
+        return nServers
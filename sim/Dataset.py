@@ -0,0 +1,208 @@
+from sim.Environment import Environment
+from sim.Replication import computeReward
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+try: #optional, parquet chunks when available
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('auto', 'npz', 'parquet')
+COLUMN_CACHE = 'columns' #subdirectory of the per-column .npy files the loader memory-maps
+MANIFEST = 'manifest.json' #stamp of the chunks and the columns in the column cache
+
+
+def _chunkPaths(path):
+    return sorted(glob.glob(os.path.join(path, 'chunk_*.npz')) + glob.glob(os.path.join(path, 'chunk_*.parquet')))
+
+
+class PeriodDatasetWriter:
+    """
+    Streams one row per period to a dataset directory while the simulation runs: the period metrics of the environment
+    (the registered metrics and the time averaged levels, like the agg keys of the greedy-epsilon load balancers and
+    numberOfServers), the reward of the period and extra columns. A row is added when the environment starts a new
+    period (see Environment.addPeriodListener) and every chunkRows rows are written as a compressed chunk file, .npz or
+    parquet when pyarrow is installed. The writer pickles with the environment, so a run restored from a snapshot
+    continues the dataset from the snapshot. Load the dataset with loadPeriodDataset.
+    """
+    def __init__(self, path, keys = None, rewards = None, extraColumns = None, chunkRows = 1024, format = 'auto', mode = 'w'):
+        """
+        Parameters
+        ----------
+        path : str
+            Directory of the dataset
+        keys : list[str], optional
+            Period metrics to write, all registered metrics and levels of the environment by default
+        rewards : tuple, optional
+            (processReward, cancelReward, serverReward) to add the column reward, computed like the load balancers do
+            from requestProcessed, requestCancelled and the time averaged numberOfServers
+        extraColumns : callable, optional
+            Called as extraColumns(environment) at the end of a period, returns {column: value}, e.g. the optimal
+            number of servers of the period. Must be picklable (no lambda) to snapshot the environment.
+        chunkRows : int
+            Rows per chunk file
+        format : str
+            'npz', 'parquet' or 'auto' (parquet when pyarrow is installed)
+        mode : str
+            'w' removes the chunks already in path, 'a' appends to them
+        """
+        if format not in FORMATS:
+            raise ValueError(f"Unknown format '{format}', choose from {FORMATS}")
+        if format == 'parquet' and pyarrow is None:
+            raise ImportError("pyarrow is needed for the parquet format")
+        if mode not in ('w', 'a'):
+            raise ValueError("mode must be 'w' or 'a'")
+        self.path = path
+        self.keys = keys
+        self.rewards = rewards
+        self.extraColumns = extraColumns
+        self.chunkRows = chunkRows
+        self.format = ('parquet' if pyarrow is not None else 'npz') if format == 'auto' else format
+        os.makedirs(path, exist_ok=True)
+        existing = _chunkPaths(path)
+        if mode == 'w':
+            for chunkPath in existing:
+                os.remove(chunkPath)
+            existing = []
+        self.nChunks = len(existing)
+        self.rows = [] #rows that are not written yet
+
+    def attach(self, environment: Environment):
+        environment.addPeriodListener(self.onPeriodEnd)
+        return self
+
+    def onPeriodEnd(self, environment: Environment):
+        metrics = environment.getPeriodMetrics(self.keys)
+        row = {'periodIndex': environment.periodIndex, 'startTime': environment.periodStartTime, 'endTime': environment.currentTime, **metrics}
+        if self.rewards is not None:
+            duration = environment.currentTime - environment.periodStartTime
+            nServers = environment.getPeriodMetrics(['numberOfServers'])['numberOfServers']
+            row['reward'] = computeReward(metrics.get('requestProcessed', 0), metrics.get('requestCancelled', 0), nServers, duration, *self.rewards)
+        if self.extraColumns is not None:
+            row.update(self.extraColumns(environment))
+        self.rows.append(row)
+        if len(self.rows) >= self.chunkRows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending rows as a chunk, columns missing in a row are nan
+        """
+        if not self.rows: return
+        columns = list(dict.fromkeys(key for row in self.rows for key in row)) #in order of appearance
+        data = {column: np.array([row.get(column, np.nan) for row in self.rows], dtype=np.int64 if column == 'periodIndex' else np.float64) for column in columns}
+        chunkPath = os.path.join(self.path, f"chunk_{self.nChunks:06d}.{self.format}")
+        if self.format == 'parquet':
+            pyarrow.parquet.write_table(pyarrow.table(data), chunkPath)
+        else:
+            np.savez_compressed(chunkPath, **data)
+        self.nChunks += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _readChunk(chunkPath, columns):
+    """
+    (number of rows, {column: values}) of the requested columns the chunk has
+    """
+    if chunkPath.endswith('.parquet'):
+        if pyarrow is None:
+            raise ImportError(f"pyarrow is needed to read {chunkPath}")
+        metadata = pyarrow.parquet.read_metadata(chunkPath)
+        names = metadata.schema.names if columns is None else [column for column in columns if column in metadata.schema.names]
+        table = pyarrow.parquet.read_table(chunkPath, columns=names, memory_map=True)
+        return metadata.num_rows, {name: table.column(name).to_numpy() for name in names}
+    with np.load(chunkPath) as chunk: #only the requested members of the npz are decompressed
+        names = chunk.files if columns is None else [column for column in columns if column in chunk.files]
+        return len(chunk['periodIndex']), {name: chunk[name] for name in names}
+
+
+def _datasetStamp(chunkPaths):
+    """
+    Digest of the names, sizes and modification times of the chunks, changes when chunks are added or rewritten
+    """
+    digest = hashlib.sha1()
+    for chunkPath in chunkPaths:
+        status = os.stat(chunkPath)
+        digest.update(f"{os.path.basename(chunkPath)}:{status.st_size}:{status.st_mtime_ns};".encode())
+    return digest.hexdigest()[:16]
+
+
+def _readManifest(cacheDirectory, stamp):
+    """
+    (cached columns, whether these are all columns of the dataset), nothing is cached when the stamp is outdated
+    """
+    try:
+        with open(os.path.join(cacheDirectory, MANIFEST)) as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return [], False
+    if manifest.get('stamp') != stamp: return [], False
+    return manifest['columns'], manifest['complete']
+
+
+def _concatenateChunks(chunkPaths, columns):
+    chunks = [_readChunk(chunkPath, columns) for chunkPath in chunkPaths]
+    names = columns if columns is not None else list(dict.fromkeys(name for _, chunk in chunks for name in chunk))
+    data = {}
+    for name in names:
+        parts = [chunk[name] if name in chunk else np.full(nRows, np.nan) for nRows, chunk in chunks]
+        data[name] = np.concatenate(parts) if parts else np.empty(0)
+    return data
+
+
+def loadPeriodDataset(path, columns = None, mmap = True):
+    """
+    Load a dataset written by PeriodDatasetWriter
+
+    Parameters
+    ----------
+    columns : list[str], optional
+        Columns to read, all by default
+    mmap : bool
+        Return memory-mapped arrays. The columns are decompressed once into per-column .npy files next to the chunks,
+        listed in a manifest with a stamp of the chunks, and reused until chunks are added or rewritten.
+
+    Returns
+    -------
+    dict {column: np.ndarray}, nan where a chunk does not have a column
+    """
+    chunkPaths = _chunkPaths(path)
+    if not mmap:
+        return _concatenateChunks(chunkPaths, columns)
+    cacheDirectory = os.path.join(path, COLUMN_CACHE)
+    stamp = _datasetStamp(chunkPaths)
+    cachedColumns, complete = _readManifest(cacheDirectory, stamp)
+    if columns is None and complete:
+        columns = cachedColumns
+    missing = None if columns is None else [column for column in columns if column not in cachedColumns]
+    if missing is None or missing: #decompress what is not cached yet
+        data = _concatenateChunks(chunkPaths, missing)
+        os.makedirs(cacheDirectory, exist_ok=True)
+        for cachePath in glob.glob(os.path.join(cacheDirectory, '*.npy')):
+            if not cachePath.endswith(f".{stamp}.npy"): os.remove(cachePath) #outdated
+        for name, values in data.items():
+            if name not in cachedColumns: #cached files may be memory-mapped, they are not overwritten
+                np.save(os.path.join(cacheDirectory, f"{name}.{stamp}.npy"), values)
+        if columns is None:
+            columns, complete = list(data), True
+            cachedColumns = columns
+        else:
+            cachedColumns = cachedColumns + missing
+        with open(os.path.join(cacheDirectory, MANIFEST), 'w') as file:
+            json.dump({'stamp': stamp, 'columns': cachedColumns, 'complete': complete}, file)
+    return {name: np.load(os.path.join(cacheDirectory, f"{name}.{stamp}.npy"), mmap_mode='r') for name in columns}
@@ -1,11 +1,22 @@
-from sortedcontainers import SortedKeyList
+import heapq
+import pickle
+import random
+import time
 import warnings
+from numbers import Number
+
+import numpy as np
 
 from sim.Event import Event
+from sim.EventQueue import makeEventQueue
+from sim.Log import LogColumn, PeriodMetric, TimeWeightedMetric, CHUNK_SIZE
+from sim.Request import RequestPool
+from sim.RandomStreams import RandomStreams
+from sim.Instrumentation import Instrumentation, printProgress
 
 
 class Environment:
-    def __init__(self, stopTime, usePrio = True):
+    def __init__(self, stopTime, usePrio = True, queue = "heap", logMode = "full", recycleRequests = False, seed = None, antithetic = False, **queueKwargs):
         """
         Parameters
         ----------
@@ -13,17 +24,60 @@ class Environment:
             Time the simulation should be stopped
         usePrio: bool
             Set to false for higher performance but not taking into account priority of events
+        queue: str or event queue instance
+            Event queue backend, one of 'heap' (binary heap), 'calendar' (bucket queue for dense timestamps) or 'sorted'
+            (SortedKeyList). All backends pop events in (time, prio) order with a FIFO tie-break.
+        logMode: str
+            'full' stores every logged value in env.log, 'metrics' only keeps the streaming period aggregates of
+            env.metrics (see registerMetric) so memory stays flat regardless of the simulated horizon
+        recycleRequests: bool
+            Reuse finished Request objects through a free-list (see RequestPool), only enable this when no references to
+            requests are kept after they are processed or cancelled
+        seed: int, optional
+            Root seed of the random streams of the components (env.random), fresh entropy is used when None
+        antithetic: bool
+            Use antithetic random streams, to be paired with a run with the same seed and antithetic=False
+        queueKwargs:
+            Passed to the event queue backend, e.g. bucketWidth for the calendar queue
         """
         self.stopTime = stopTime
         self.currentTime = 0
-        if usePrio:
-            self.eventQueue: SortedKeyList = SortedKeyList(key=lambda e: e.key)
-        else:
-            self.eventQueue: SortedKeyList = SortedKeyList(key=lambda e: e.time)
+        self.eventQueue = makeEventQueue(queue, usePrio=usePrio, **queueKwargs)
         self.debug = 0
-        self.log = {} #dictionary for storage of arbitary statistics
-        self.logTime = {} #store timestamps of logs
+        self.log = {} #dictionary for storage of arbitary statistics, {key: LogColumn}
+        self.logTime = {} #store timestamps of logs, {key: LogColumn}
         self.logPeriodIndex = {} # keep track for each key in the log, what is the index that the period started?
+        if logMode not in ("full", "metrics"):
+            raise ValueError(f"Unknown logMode '{logMode}', choose from 'full' or 'metrics'")
+        self.logMode = logMode
+        self.metrics = {} #streaming period aggregates, {key: PeriodMetric}
+        self.periodIndex = 0
+        self.periodStartTime = 0
+        self.levels = {} #time averaged levels, {key: TimeWeightedMetric}, see changeLevel
+        self.periodListeners = [] #called with the environment at the end of every period, see addPeriodListener
+        self.lastRequestId = 0
+        self.lastServerId = -1
+        self.requestPool = RequestPool() if recycleRequests else None
+        self.random = RandomStreams(seed, antithetic) #per component random streams, see RandomStreams.stream
+        self.streams = {} #{streamId: [iterator, handler, version]}, see addStream
+        self.streamHeads = [] #heap of the next item of every stream (time, seq, streamId, version, payload)
+        self.streamSeq = 0
+        self.lastStreamId = -1
+        self.handledEvents = 0 #events and stream items handled by run
+
+    def newRequestId(self):
+        """
+        Get the next unique integer request id
+        """
+        self.lastRequestId += 1
+        return self.lastRequestId
+
+    def newServerId(self):
+        """
+        Get the next unique integer server id
+        """
+        self.lastServerId += 1
+        return self.lastServerId
 
     def scheduleEvent(self, e: Event):
         """Add event to eventqueue
@@ -33,9 +87,84 @@ class Environment:
         e : Event
             The event that needs to be scheduled
         """
-        self.eventQueue.add(e)
+        self.eventQueue.push(e)
         if self.debug: print(f"{self.currentTime} | Planned event for time {e.time} with name {e.name}")
     
+    def cancelEvent(self, e: Event):
+        """Cancel a scheduled event, it will not be executed. Cancelling an event that was already executed or
+        cancelled does nothing.
+
+        Parameters
+        ----------
+        e : Event
+            The event that needs to be cancelled, must have been scheduled in this environment
+        """
+        if e.isTriggered or e.isCancelled: return
+        self.eventQueue.cancel(e)
+        if self.debug: print(f"{self.currentTime} | Cancelled event for time {e.time} with name {e.name}")
+
+    def addStream(self, stream, handler):
+        """Merge a stream of timed items into the simulation, without putting them in the event queue. The run loop
+        keeps the next item of every stream and handles it when its time comes, items of the same time as an event are
+        handled after the event.
+
+        The next item is taken from the stream after the handler of the previous item returned, so a stream can depend
+        on the state of the simulation. A stream can yield None when it has no item for now, it is then asked again
+        when refreshStream is called.
+
+        Parameters
+        ----------
+        stream : iterable
+            Yields (time, payload) tuples in time order. To snapshot or fork the simulation the stream and handler must
+            be picklable: use an object like ArrivalStream, not a generator.
+        handler : callable
+            Called as handler(payload) at the time of each item
+
+        Returns
+        -------
+        int, the stream id
+        """
+        self.lastStreamId += 1
+        self.streams[self.lastStreamId] = [iter(stream), handler, 0]
+        self._pullStream(self.lastStreamId)
+        return self.lastStreamId
+
+    def refreshStream(self, streamId):
+        """
+        Discard the next item of the stream and take a new one, for streams whose next item changes with the state
+        """
+        entry = self.streams.get(streamId)
+        if entry is None: return
+        entry[2] += 1 #the head in the heap is outdated now
+        self._pullStream(streamId)
+
+    def removeStream(self, streamId):
+        self.streams.pop(streamId, None)
+
+    def _pullStream(self, streamId):
+        entry = self.streams.get(streamId)
+        if entry is None: return
+        try:
+            item = next(entry[0])
+        except StopIteration:
+            del self.streams[streamId]
+            return
+        if item is None: return #nothing for now, wait for refreshStream
+        time, payload = item
+        if time < self.currentTime:
+            raise ValueError(f"Stream {streamId} yielded time {time} before the current time {self.currentTime}")
+        self.streamSeq += 1
+        heapq.heappush(self.streamHeads, (time, self.streamSeq, streamId, entry[2], payload))
+
+    def _handleStreamHead(self):
+        time, _, streamId, version, payload = heapq.heappop(self.streamHeads)
+        entry = self.streams.get(streamId)
+        if entry is None or entry[2] != version: return #removed or refreshed
+        self.currentTime = time
+        entry[1](payload)
+        if entry[2] == version: self._pullStream(streamId) #not refreshed by the handler
+        if self.debug: print(f"{self.currentTime} | Handled item of stream {streamId}")
+
     def _handleEvent(self, e:Event):
         """Handle event to eventqueue (private method)
         
@@ -48,15 +177,104 @@ class Environment:
         e.execute()
         if self.debug: print(f"{self.currentTime} | Handled event at time {e.time} with name {e.name}")
 
+    def addPeriodListener(self, listener):
+        """
+        Call listener(environment) in resetPeriod, before the new period starts, so the period metrics are still those
+        of the period that ends (e.g. PeriodDatasetWriter)
+        """
+        self.periodListeners.append(listener)
+
     def resetPeriod(self):
-        self.logPeriodIndex = self.logPeriodIndex = {k: len(vals) for k, vals in self.log.items()}  #set the start point of the period
+        for listener in self.periodListeners:
+            listener(self)
+        self.periodIndex += 1 #the metrics roll over lazily when they are updated in the new period
+        self.periodStartTime = self.currentTime
+        if self.logMode == "full":
+            self.logPeriodIndex = {k: len(vals) for k, vals in self.log.items()}  #set the start point of the period
+
+    def registerMetric(self, key, aggregation = 'sum'):
+        """Maintain a streaming aggregate of a log key over the current period
+        
+        Parameters
+        ----------
+        key : str
+            Log key to aggregate
+        aggregation: str
+            One of 'count', 'sum', 'mean', 'min' or 'max'
+        """
+        metric = self.metrics.get(key)
+        if metric is None:
+            self.metrics[key] = PeriodMetric(aggregation, self.periodIndex)
+        else:
+            metric.aggregation = PeriodMetric(aggregation).aggregation #validate
+
+    def getPeriodMetrics(self, keys = None):
+        """
+        Get the aggregated values of the registered metrics for the current period {key: value}, O(1) per key. For
+        levels (see changeLevel) this is the time average over the period so far.
+        """
+        keys = list(self.metrics.keys()) + [key for key in self.levels if key not in self.metrics] if keys is None else keys
+        return {key: self._periodMetric(key) for key in keys}
+
+    def _periodMetric(self, key):
+        level = self.levels.get(key)
+        if level is not None:
+            return level.value(self.currentTime, self.periodIndex, self.periodStartTime)
+        return self.metrics[key].value(self.periodIndex) if key in self.metrics else 0
+
+    def hasPeriodMetric(self, key):
+        """
+        Is the period value of key maintained as a registered metric or a level?
+        """
+        return key in self.metrics or key in self.levels
+
+    def changeLevel(self, key, delta):
+        """
+        Change a level, like the number of requests in the queues, by delta at the current time. Instead of logging
+        every change only the time average of the level over the current period is kept (see getPeriodMetrics).
+        """
+        level = self.levels.get(key)
+        if level is None:
+            level = self.levels[key] = TimeWeightedMetric(0, self.currentTime, self.periodIndex)
+        time = self.currentTime
+        if level.period != self.periodIndex: level._rollOver(self.periodIndex, self.periodStartTime)
+        level.area += level.last*(time - level.lastChangeTime) #TimeWeightedMetric.update inlined, this is called on every queue change
+        level.lastChangeTime = time
+        level.last += delta
+
+    def setLevel(self, key, value):
+        """
+        Set a level to value at the current time, see changeLevel
+        """
+        level = self.levels.get(key)
+        if level is None:
+            level = self.levels[key] = TimeWeightedMetric(value, self.currentTime, self.periodIndex)
+        level.update(value, self.currentTime, self.periodIndex, self.periodStartTime)
+
+    def lastLogValue(self, key, default = None):
+        """
+        Get the last value logged to a key (or the current value of a level), works in both log modes
+        """
+        level = self.levels.get(key)
+        if level is not None:
+            return level.last
+        metric = self.metrics.get(key)
+        if metric is not None and metric.last is not None:
+            return metric.last
+        column = self.log.get(key)
+        return column[-1] if column is not None and len(column) > 0 else default
     
     def getPeriodLog(self):
-        return {k:vals[self.logPeriodIndex[k]:] for k, vals in self.log.items()}
+        """
+        Get the values logged since the last resetPeriod as zero-copy NumPy views {key: values}
+        """
+        return {k:vals.values[self.logPeriodIndex[k]:] for k, vals in self.log.items()}
     
     def resetLog(self):
-        self.log = {key: [] for key in self.log.keys()}
-        self.logTime = {key: [] for key in self.log.keys()}
+        self.log = {key: LogColumn() for key in self.log.keys()}
+        self.logTime = {key: LogColumn() for key in self.log.keys()}
+        self.logPeriodIndex = {key: 0 for key in self.log.keys()}
+        self.metrics = {key: PeriodMetric(metric.aggregation, self.periodIndex) for key, metric in self.metrics.items()}
 
     def logData(self, key, data=1):
         """Log arbitrary data to the environment
@@ -68,34 +286,152 @@ class Environment:
         data: any
             Data to log to the stream 
         """
-
-        if key not in self.log.keys():
-            self.log[key] = [data]
-            self.logTime[key] = [self.currentTime]
+        metric = self.metrics.get(key)
+        if metric is not None:
+            metric.update(data, self.periodIndex)
+        if self.logMode == "metrics":
+            if metric is None: #unregistered keys are summed, or counted when the data is not numeric
+                metric = self.metrics[key] = PeriodMetric('sum' if isinstance(data, Number) else 'count', self.periodIndex)
+                metric.update(data, self.periodIndex)
+            return
+        column = self.log.get(key)
+        if column is None:
+            column = self.log[key] = LogColumn()
+            self.logTime[key] = LogColumn()
             self.logPeriodIndex[key] = 0
-        else:
-            self.log[key].append(data)
-            self.logTime[key].append(self.currentTime)
+        timeColumn = self.logTime[key]
+        pending = column.pending #appending to the pending lists directly avoids two method calls on the hot path
+        pending.append(data)
+        timeColumn.pending.append(self.currentTime)
+        if len(pending) >= CHUNK_SIZE:
+            column.flush()
+            timeColumn.flush()
 
-    def run(self, debug=True, showProgress = False):
+    def run(self, debug=True, showProgress = False, until = None, instrumentation: Instrumentation = None):
         """Run environment untill the stopTime is reached or untill the eventQueue is empty
         
         Parameters
         ----------
         debug : bool
             Print debugging messages?
+        showProgress : bool
+            Print a progress bar, at most once per second (see printProgress)
+        until : float, optional
+            Pause after the events at time until (if before stopTime), run again to continue, e.g. after a snapshot
+        instrumentation : Instrumentation, optional
+            Count, time and sample the handled events, see Instrumentation
         """
-        
-        while len(self.eventQueue) > 0:   
-            self.debug = debug
-            nextEvent = self.eventQueue.pop(index=0)
-            nextEventTime = nextEvent.time
-            if nextEventTime > self.stopTime: break
-            self._handleEvent(nextEvent)
-            if showProgress:
-                print(f"{int(self.currentTime)} | {int(self.currentTime/self.stopTime*10)*'=' + '>'}", end='\r')
-
-        if len(self.eventQueue) == 0: warnings.warn("Event queueu is empty before stopTime was reached")
+        self.debug = debug
+        stopTime = self.stopTime if until is None else min(until, self.stopTime)
+        if showProgress and instrumentation is None:
+            instrumentation = Instrumentation(progress=printProgress)
+        if debug or instrumentation is not None:
+            handled = self._runInstrumented(stopTime, instrumentation or Instrumentation())
+        else: #the hot loop, nothing but handling events and stream items
+            popUntil = self.eventQueue.popUntil
+            heads = self.streamHeads
+            handled = 0
+            while True:
+                limit = heads[0][0] if heads and heads[0][0] < stopTime else stopTime #events up to the next stream item
+                nextEvent = popUntil(limit) #events after stopTime stay in the queue so the run can be continued
+                if nextEvent is not None:
+                    self.currentTime = nextEvent.time
+                    nextEvent.execute()
+                elif heads and heads[0][0] <= stopTime:
+                    self._handleStreamHead()
+                else:
+                    break
+                handled += 1
+
+        self.handledEvents += handled
+        if self.currentTime < stopTime < float('inf'): self.currentTime = stopTime #the clock runs up to the pause or stop time
+        if len(self.eventQueue) == 0 and not self.streamHeads: warnings.warn("Event queueu is empty before stopTime was reached")
         return self
+
+    def _runInstrumented(self, stopTime, instrumentation: Instrumentation):
+        """
+        The run loop with debug messages and instrumentation, returns the number of handled events
+        """
+        popUntil = self.eventQueue.popUntil
+        heads, streams = self.streamHeads, self.streams
+        counts = instrumentation.counts
+        timingEvery, depthEvery, progress = instrumentation.timingEvery, instrumentation.depthEvery, instrumentation.progress
+        handledBefore, handled = instrumentation.handledEvents, 0
+        while True:
+            limit = heads[0][0] if heads and heads[0][0] < stopTime else stopTime
+            nextEvent = popUntil(limit)
+            if nextEvent is not None:
+                name = nextEvent.name
+                handle, argument = self._handleEvent, nextEvent
+            elif heads and heads[0][0] <= stopTime:
+                entry = streams.get(heads[0][2])
+                name = getattr(entry[1], '__qualname__', 'stream') if entry is not None else 'stream'
+                handle, argument = self._handleStreamHead, None
+            else:
+                break
+            handled += 1
+            counts[name] = counts.get(name, 0) + 1
+            if timingEvery and handled % timingEvery == 0:
+                startTime = time.perf_counter_ns()
+                handle() if argument is None else handle(argument)
+                instrumentation.recordTiming(name, time.perf_counter_ns() - startTime)
+            else:
+                handle() if argument is None else handle(argument)
+            if depthEvery and handled % depthEvery == 0:
+                instrumentation.recordDepth(self.currentTime, len(self.eventQueue))
+            if progress is not None and handled & 255 == 0: #reading the clock every event would cost more than the check
+                instrumentation.handledEvents = handledBefore + handled
+                instrumentation.checkProgress(self)
+        instrumentation.handledEvents = handledBefore + handled
+        if progress is not None: progress(self, instrumentation)
+        return handled
+
+    def snapshot(self, *objects):
+        """
+        Capture the state of the simulation as bytes: the event queue and everything reachable from it (sources, load
+        balancer, servers, waiting and in service requests), the streams, the logs and the random state, including the
+        global random and numpy.random state used by some schedules. Take it between events, e.g. after run(until=...)
+        or in onPeriodEnd. Everything captured must be picklable, so no lambdas in scheduled events and no generator
+        streams (see addStream).
+
+        Parameters
+        ----------
+        objects :
+            Extra objects to capture along with the environment, like the load balancer and source, so their copies
+            can be used after restore
+
+        Returns
+        -------
+        bytes
+        """
+        try:
+            return pickle.dumps((self, objects, random.getstate(), np.random.get_state()), protocol=pickle.HIGHEST_PROTOCOL)
+        except (TypeError, AttributeError, pickle.PicklingError) as error:
+            for streamId, (stream, handler, _) in self.streams.items(): #name the stream when one is the cause
+                try:
+                    pickle.dumps((stream, handler))
+                except (TypeError, AttributeError, pickle.PicklingError):
+                    raise TypeError(f"Stream {streamId} ({type(stream).__name__}) can not be pickled for a snapshot, use a picklable stream object like ArrivalStream instead of a generator") from error
+            raise
+
+    @staticmethod
+    def restore(snapshot):
+        """
+        Recreate a simulation from a snapshot and reset the global random state to the state at the snapshot
+
+        Returns
+        -------
+        The environment, or (environment, *objects) when objects were passed to snapshot
+        """
+        environment, objects, randomState, numpyState = pickle.loads(snapshot)
+        random.setstate(randomState)
+        np.random.set_state(numpyState)
+        return (environment, *objects) if objects else environment
+
+    def fork(self, *objects):
+        """
+        Independent copy of the simulation that continues from the current state, see snapshot
+        """
+        return Environment.restore(self.snapshot(*objects))
         
     
\ No newline at end of file
@@ -3,6 +3,8 @@ class EventKey:
     """
     Key used in determining event order
     """
+    __slots__ = ('time', 'prio')
+
     def __init__(self, time, prio):
         self.time, self.prio = time, prio
     
@@ -12,10 +14,15 @@ class EventKey:
         else:
             return  self.time < other.time
 
+    def __eq__(self, other):
+        return self.time == other.time and self.prio == other.prio
+
     def __repr__(self):
         return f"{self.time}-{self.prio}"
 
 class Event:
+    __slots__ = ('time', 'executionMethod', 'name', 'prio', 'isTriggered', 'isCancelled')
+
     def __init__(self, time: float, executionMethod: callable, name: str = 'unnamed', prio: int = 9):
         """
         Parameters
@@ -26,13 +33,23 @@ class Event:
             This function will get called when the event is triggered
         name : str, optional
             Option to provide name to event for debugging purposes
+        prio : int, optional
+            Events with equal time are executed in order of increasing prio
         """
 
         self.time = time
         self.executionMethod = executionMethod
         self.name = name
+        self.prio = prio
         self.isTriggered = False
-        self.key: EventKey = EventKey(time, prio)
+        self.isCancelled = False
+
+    @property
+    def key(self) -> EventKey:
+        """
+        Sort key, only used by the sorted event queue so it is created on demand
+        """
+        return EventKey(self.time, self.prio)
 
     def execute(self):
         """
@@ -41,6 +58,8 @@ class Event:
 
         if self.isTriggered:
             return Exception("Event has already been triggered")
+        if self.isCancelled:
+            return
 
         self.isTriggered = True
         self.executionMethod()
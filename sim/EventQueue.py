@@ -0,0 +1,221 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from sortedcontainers import SortedKeyList
+from heapq import heappush, heappop, heapify
+import math
+
+COMPACT_MIN_CANCELLED = 1024 #never compact while fewer events than this are cancelled
+
+if TYPE_CHECKING: #only for typechecking
+    from sim.Event import Event
+
+
+def _eventKey(e):
+    return e.key
+
+def _eventTime(e):
+    return e.time
+
+
+class SortedEventQueue:
+    """
+    Event queue backed by a SortedKeyList (the original implementation). Equal keys are popped in insertion order.
+    """
+    def __init__(self, usePrio = True):
+        self.queue: SortedKeyList = SortedKeyList(key=_eventKey if usePrio else _eventTime)
+
+    def push(self, e: Event):
+        self.queue.add(e)
+
+    def pop(self) -> Event:
+        return self.queue.pop(index=0)
+
+    def peek(self) -> Event:
+        return self.queue[0]
+
+    def popUntil(self, stopTime) -> Event:
+        """
+        Pop the next event if it is due at or before stopTime, otherwise leave it in the queue and return None
+        """
+        if not self.queue or self.queue[0].time > stopTime: return None
+        return self.queue.pop(index=0)
+
+    def cancel(self, e: Event):
+        """
+        Remove a pending event, the sorted list supports removal in O(log n) so no lazy invalidation is needed
+        """
+        e.isCancelled = True
+        self.queue.remove(e)
+
+    def __len__(self):
+        return len(self.queue)
+
+
+class HeapEventQueue:
+    """
+    Binary heap of (time, prio, seq, event) tuples. The sequence number gives a FIFO tie-break for equal (time, prio)
+    and guarantees that the event objects themselves are never compared.
+    Cancelled events are invalidated lazily: they stay in the heap and are discarded when they reach the top, the heap
+    is compacted when the cancelled events outnumber the pending ones.
+    """
+    def __init__(self, usePrio = True):
+        self.usePrio = usePrio
+        self.heap = []
+        self.seq = 0 #a plain int, so the queue pickles for snapshots
+        self.nCancelled = 0
+
+    def push(self, e: Event):
+        self.seq += 1
+        heappush(self.heap, (e.time, e.prio if self.usePrio else 0, self.seq, e))
+
+    def _discardCancelled(self):
+        heap = self.heap
+        while heap and heap[0][3].isCancelled:
+            heappop(heap)
+            self.nCancelled -= 1
+
+    def pop(self) -> Event:
+        if self.nCancelled: self._discardCancelled()
+        return heappop(self.heap)[3]
+
+    def peek(self) -> Event:
+        if self.nCancelled: self._discardCancelled()
+        return self.heap[0][3]
+
+    def popUntil(self, stopTime) -> Event:
+        """
+        Pop the next event if it is due at or before stopTime, otherwise leave it in the queue and return None
+        """
+        heap = self.heap
+        while heap:
+            entry = heap[0]
+            if entry[3].isCancelled:
+                heappop(heap)
+                self.nCancelled -= 1
+            elif entry[0] > stopTime:
+                return None
+            else:
+                return heappop(heap)[3]
+        return None
+
+    def cancel(self, e: Event):
+        e.isCancelled = True
+        self.nCancelled += 1
+        if self.nCancelled > COMPACT_MIN_CANCELLED and 2*self.nCancelled > len(self.heap):
+            self.compact()
+
+    def compact(self):
+        """
+        Drop all cancelled events from the heap
+        """
+        self.heap = [entry for entry in self.heap if not entry[3].isCancelled]
+        heapify(self.heap)
+        self.nCancelled = 0
+
+    def __len__(self):
+        return len(self.heap) - self.nCancelled
+
+
+class CalendarEventQueue:
+    """
+    Calendar (bucket) queue for dense timestamps. Events are hashed into buckets of width bucketWidth, every bucket is a
+    small heap ordered like HeapEventQueue and a heap of bucket indices is used to find the first non-empty bucket.
+    When many events share few buckets the per-operation cost only depends on the bucket size.
+    Cancelled events are invalidated lazily, like in HeapEventQueue.
+    """
+    def __init__(self, usePrio = True, bucketWidth = 1.0):
+        if bucketWidth <= 0:
+            raise ValueError("bucketWidth must be positive")
+        self.usePrio = usePrio
+        self.bucketWidth = bucketWidth
+        self.buckets = {} #bucket index -> heap of entries
+        self.bucketIndices = [] #heap of indices of the non-empty buckets
+        self.seq = 0 #a plain int, so the queue pickles for snapshots
+        self.size = 0 #number of entries, including cancelled events
+        self.nCancelled = 0
+
+    def push(self, e: Event):
+        index = math.floor(e.time / self.bucketWidth)
+        bucket = self.buckets.get(index)
+        if bucket is None:
+            bucket = self.buckets[index] = []
+            heappush(self.bucketIndices, index)
+        self.seq += 1
+        heappush(bucket, (e.time, e.prio if self.usePrio else 0, self.seq, e))
+        self.size += 1
+
+    def _popEntry(self):
+        index = self.bucketIndices[0]
+        bucket = self.buckets[index]
+        entry = heappop(bucket)
+        if not bucket:
+            del self.buckets[index]
+            heappop(self.bucketIndices)
+        self.size -= 1
+        return entry
+
+    def _discardCancelled(self):
+        while self.size and self.buckets[self.bucketIndices[0]][0][3].isCancelled:
+            self._popEntry()
+            self.nCancelled -= 1
+
+    def pop(self) -> Event:
+        if self.nCancelled: self._discardCancelled()
+        return self._popEntry()[3]
+
+    def peek(self) -> Event:
+        if self.nCancelled: self._discardCancelled()
+        return self.buckets[self.bucketIndices[0]][0][3]
+
+    def popUntil(self, stopTime) -> Event:
+        """
+        Pop the next event if it is due at or before stopTime, otherwise leave it in the queue and return None
+        """
+        while self.size:
+            entry = self.buckets[self.bucketIndices[0]][0]
+            if entry[3].isCancelled:
+                self._popEntry()
+                self.nCancelled -= 1
+            elif entry[0] > stopTime:
+                return None
+            else:
+                return self._popEntry()[3]
+        return None
+
+    def cancel(self, e: Event):
+        e.isCancelled = True
+        self.nCancelled += 1
+        if self.nCancelled > COMPACT_MIN_CANCELLED and 2*self.nCancelled > self.size:
+            self.compact()
+
+    def compact(self):
+        """
+        Drop all cancelled events from the buckets
+        """
+        buckets = {}
+        for index, bucket in self.buckets.items():
+            bucket = [entry for entry in bucket if not entry[3].isCancelled]
+            if bucket:
+                heapify(bucket)
+                buckets[index] = bucket
+        self.buckets = buckets
+        self.bucketIndices = list(buckets.keys())
+        heapify(self.bucketIndices)
+        self.size -= self.nCancelled
+        self.nCancelled = 0
+
+    def __len__(self):
+        return self.size - self.nCancelled
+
+
+EVENT_QUEUES = {'sorted': SortedEventQueue, 'heap': HeapEventQueue, 'calendar': CalendarEventQueue}
+
+def makeEventQueue(queue, usePrio = True, **kwargs):
+    """
+    Create the event queue backend with the given name (see EVENT_QUEUES), or return queue if it already is a backend instance
+    """
+    if not isinstance(queue, str):
+        return queue
+    if queue not in EVENT_QUEUES:
+        raise ValueError(f"Unknown event queue '{queue}', choose from {list(EVENT_QUEUES.keys())}")
+    return EVENT_QUEUES[queue](usePrio=usePrio, **kwargs)
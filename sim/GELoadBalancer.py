@@ -1,28 +1,135 @@
 from sim.LoadBalancer import LoadBalancer
 from sim.Source import ArrivalSchedule, Source
 from sim.Environment import Environment
+from sim.Models import TrainingBuffer
 import numpy as np
-import random
 import math
 
+AGGREGATION_NAMES = {np.mean: 'mean', np.sum: 'sum', np.min: 'min', np.max: 'max', len: 'count'} #aggregations that can be streamed by the environment
+
+def registerPeriodAggregations(environment, agg):
+    """
+    Register the aggregations in agg {key: function} as streaming period metrics of the environment where possible
+    """
+    for key, aggFunction in agg.items():
+        if aggFunction in AGGREGATION_NAMES:
+            environment.registerMetric(key, AGGREGATION_NAMES[aggFunction])
+
+def aggregatePeriodContext(environment, agg):
+    """
+    Aggregate the log of the current period to scalars {key: value} for every key in agg, missing and nan values become 0.
+    Streamed metrics are read in O(1), other keys are aggregated from the raw period log.
+    """
+    periodContext = environment.getPeriodMetrics([key for key in agg.keys() if environment.hasPeriodMetric(key)])
+    rawKeys = [key for key in agg.keys() if key not in periodContext]
+    if rawKeys:
+        previousPeriodData = environment.getPeriodLog() #returns {key: values}
+        periodContext.update({key: agg[key](previousPeriodData[key]) for key in rawKeys if key in previousPeriodData})
+    return {key: periodContext[key] if key in periodContext and not np.isnan(periodContext[key]) else 0 for key in agg.keys()}
+
+MAX_CANDIDATES = 4096 #larger server ranges are searched coarse to fine
+
+def rewardPolynomial(model, x):
+    """
+    Coefficients (c0, c1, ...) of the predicted reward c0 + c1*n + c2*n^2 + ... as a polynomial in the number of servers n,
+    for the features np.append(x, n). Known for linear models (sklearn style coef_ and intercept_) and for models with a
+    method polynomialInN(x), None for other models.
+    """
+    if hasattr(model, 'polynomialInN'):
+        return model.polynomialInN(x)
+    coef, intercept = getattr(model, 'coef_', None), getattr(model, 'intercept_', None)
+    if coef is None or intercept is None or np.size(coef) != len(x) + 1:
+        return None
+    coef = np.ravel(coef)
+    return (float(np.ravel(intercept)[0] + coef[:-1] @ x), float(coef[-1]))
+
+def polynomialArgmax(coefficients, low, high):
+    """
+    First integer n in [low, high) maximizing a polynomial of degree at most 2
+    """
+    c = list(coefficients) + [0.0]*(3 - len(coefficients))
+    candidates = [low, high - 1]
+    if c[2] < 0: #concave: the optimum is next to the vertex
+        vertex = -c[1]/(2*c[2])
+        candidates += [min(max(n, low), high - 1) for n in (math.floor(vertex), math.ceil(vertex))]
+    candidates = np.array(sorted(set(candidates)))
+    return int(candidates[np.argmax(c[0] + c[1]*candidates + c[2]*candidates**2)])
+
+def predictArgmax(model, x, candidates):
+    """
+    Candidate with the highest predicted reward, predicted with one call on the matrix of all candidates
+    """
+    X = np.empty((len(candidates), len(x) + 1))
+    X[:, :-1] = x
+    X[:, -1] = candidates
+    rewardHat = np.ravel(model.predict(X))
+    return int(candidates[np.argmax(rewardHat)])
+
+def modelOptimum(model, x, nServerRange):
+    """
+    Number of servers n in range(*nServerRange) with the highest predicted reward for the features np.append(x, n),
+    the first one on ties. Linear and quadratic models are maximized in closed form, other models with one vectorized
+    predict over the candidates (coarse to fine for very large ranges).
+    """
+    low, high = nServerRange[0], nServerRange[1]
+    x = np.asarray(x, dtype=float)
+    coefficients = rewardPolynomial(model, x)
+    if coefficients is not None and len(coefficients) <= 3:
+        return polynomialArgmax(coefficients, low, high)
+    step = 1
+    while (high - low)/step > MAX_CANDIDATES: step *= 2
+    best = predictArgmax(model, x, np.arange(low, high, step))
+    while step > 1: #refine around the best point of the coarser grid
+        step //= 2
+        best = predictArgmax(model, x, np.arange(max(low, best - 2*step), min(high, best + 2*step + 1), step))
+    return best
+
+def fitTrainingBuffer(model, trainingBuffer: TrainingBuffer, usePartialFit = False):
+    """
+    Update the model with the training data. Online models (with a method update(x, y)) and partial fits only see the
+    newest training pair, other models are refitted on the buffer, weighted with its forgetting factor.
+    """
+    X, y, sampleWeight = trainingBuffer.trainingData()
+    if hasattr(model, 'update'):
+        return model.update(X[-1], y[-1])
+    if usePartialFit:
+        return model.partial_fit(X[-1:], y[-1:])
+    model = model.fit(X, y[:,None]) if sampleWeight is None else model.fit(X, y[:,None], sample_weight=sampleWeight)
+    print(model.score(X, y[:,None]))
+    return model
+
 
 class GreedyEpsilonLoadBalancer(LoadBalancer):
-    def __init__(self, nServers, environment, model, processReward=1, cancelReward=-10, serverReward=-300, eta=0.15, nServerRange = (1,40), usePartialFit=False, periodLength =1*60*60):
+    def __init__(self, nServers, environment, model, processReward=1, cancelReward=-10, serverReward=-300, eta=0.15, nServerRange = (1,40), usePartialFit=False, periodLength =1*60*60, window=None, forgetting=1.0):
         """
             model: obj with methods predict, fit, fit_partial etc.
             eta: float or callable(periodIndex: int -> float)
+            window: int, keep only the last window periods as training data
+            forgetting: float in (0, 1], weight of the training data per period of age when the model is refitted
         """
+        self.agg = {'totalInQueue': np.mean,'requestStartWaiting':np.sum,'arrivalEvent':np.sum,'requestWaitingTime': np.mean,'requestProcessed':np.sum,'totalTimeInSystem':np.mean,'requestCancelled':np.sum}
+        registerPeriodAggregations(environment, self.agg) #before the first values are logged
         super().__init__(nServers, environment)
         self.model = model # a model that takes (N_t, X_t) and predicts the reward of the next time period
-        self.agg = {'totalInQueue': np.mean,'requestStartWaiting':np.sum,'arrivalEvent':np.sum,'requestWaitingTime': np.mean,'requestProcessed':np.sum,'totalTimeInSystem':np.mean,'requestCancelled':np.sum}
+        self.explorationStream = environment.random.stream('exploration')
         self.currentPeriod = 0
         self.processReward, self.cancelReward, self.serverReward = processReward, cancelReward, serverReward
         self.eta = eta
         self.nServerRange = nServerRange #the range for the bernoulli to sample from
         self.usePartialFit = usePartialFit
         self.periodLength = periodLength
-        self.X = None #store the complete feature dataset here
-        self.y = None #store the complete target dataset here s
+        self.trainingBuffer = TrainingBuffer(window=window, forgetting=forgetting) #features and rewards of the periods
+
+    @property
+    def X(self):
+        """
+        Features of all periods in the training window, the last row belongs to the current period
+        """
+        return self.trainingBuffer.X
+
+    @property
+    def y(self):
+        return self.trainingBuffer.y[:,None]
 
     def getEta(self):
         if callable(self.eta):
@@ -34,12 +141,7 @@ class GreedyEpsilonLoadBalancer(LoadBalancer):
         """
         Get the context from the period that just ended (potentially add lags here from previous periods)
         """
-        previousPeriodData = self.environment.getPeriodLog() #returns {key: values}
-        previousPeriodContext = {key: self.agg[key](vals) for key,vals in previousPeriodData.items() if key in self.agg.keys()} #apply aggregation: go from lists to scalars
-        previousPeriodContext ={key:val if not np.isnan(val) else 0 for key,val in previousPeriodContext.items()}
-        previousPeriodContext ={key:previousPeriodContext[key] if key in previousPeriodContext.keys() else 0 for key in self.agg.keys()}
-
-        return previousPeriodContext
+        return aggregatePeriodContext(self.environment, self.agg) #apply aggregation: go from lists to scalars
 
     def getPreviousPeriodReward(self, context: dict):
         """
@@ -53,27 +155,20 @@ class GreedyEpsilonLoadBalancer(LoadBalancer):
         return reward
 
     def findModelOptimum(self, context):
-        max = -math.inf
-        maxArg = 0
-        for n in range(self.nServerRange[0], self.nServerRange[1]): #implement better optimization here
-            X =  np.append(np.array(list(context.values())), n)
-            rewardHat = self.model.predict(X[None,:])[0]
-            if rewardHat > max:
-                maxArg = n
-                max = rewardHat
-        print("Max reward for", rewardHat, maxArg)
+        maxArg = modelOptimum(self.model, np.array(list(context.values())), self.nServerRange)
+        print("Max reward for", maxArg)
         return maxArg
 
     def getNextPeriodNumberOfServers(self, context):
         #take random action or input the context into the model and maximizy the output w.r.t N
-        draw = random.random()
+        draw = self.explorationStream.random()
         eta = self.getEta()
         self.environment.logData('eta', eta)
         nServers = None
         if draw < eta or self.currentPeriod <= 1: #on first iteration the model is not fitted
             #Take random action
             self.environment.logData("greedyEpsilonActionType", 0)
-            nServers = random.randint(self.nServerRange[0], self.nServerRange[1])
+            nServers = self.explorationStream.randint(self.nServerRange[0], self.nServerRange[1])
         else:
             self.environment.logData("greedyEpsilonActionType", 1)
             nServers = self.findModelOptimum(context) 
@@ -83,19 +178,12 @@ class GreedyEpsilonLoadBalancer(LoadBalancer):
     def updateModel(self, context, reward):
         #update the model using the context, nServers and observed reward
         if self.currentPeriod > 0:
-            newY = np.array([reward])
-            self.y = np.append(self.y, newY[None,:], axis=0) if self.y is not None else newY[None,:]
-            if not self.usePartialFit:
-                #print(self.X.shape,self.y.shape)
-                self.model = self.model.fit(self.X, self.y) #make sure the hat the last period x is ignored
-                print(self.model.score(self.X, self.y))
-            else:
-                self.model = self.model.partial_fit(self.X, self.y) #make sure the hat the last period x is ignored
-                print(self.model.score(self.X, self.y))
+            self.trainingBuffer.addTarget(reward)
+            self.model = fitTrainingBuffer(self.model, self.trainingBuffer, self.usePartialFit)
 
     def updateX(self, context, nOptimal):
         newX = np.array(list(context.values()) + [nOptimal]) #+ [reward] #add the current nServers to X
-        self.X = np.append(self.X, newX[None,:], axis=0) if self.X is not None else newX[None,:] #update the data 
+        self.trainingBuffer.addFeatures(newX) #the reward is added at the end of the period
 
     def onPeriodEnd(self):
         #Get the reward of the current period
@@ -118,22 +206,25 @@ class GreedyEpsilonLoadBalancerContextSampling(LoadBalancer):
     """
     context sampled from dist, see experiments/quadraticarrivalprocess.ipynb
     """
-    def __init__(self, nServers, environment, model, processReward=1, cancelReward=-10, serverReward=-300, eta=0.15, nServerRange = (1,40), usePartialFit=False, periodLength =1*60*60, linear=True):
+    def __init__(self, nServers, environment, model, processReward=1, cancelReward=-10, serverReward=-300, eta=0.15, nServerRange = (1,40), usePartialFit=False, periodLength =1*60*60, linear=True, window=None, forgetting=1.0):
         """
             model: obj with methods predict, fit, fit_partial etc.
             eta: float or callable(periodIndex: int -> float)
+            window: int, keep only the last window periods as training data
+            forgetting: float in (0, 1], weight of the training data per period of age when the model is refitted
         """
+        self.agg = {'totalInQueue': np.mean,'requestStartWaiting':np.sum,'arrivalEvent':np.sum,'requestWaitingTime': np.mean,'requestProcessed':np.sum,'totalTimeInSystem':np.mean,'requestCancelled':np.sum}
+        registerPeriodAggregations(environment, self.agg) #before the first values are logged
         super().__init__(nServers, environment)
         self.model = model # a model that takes (N_t, X_t) and predicts the reward of the next time period
-        self.agg = {'totalInQueue': np.mean,'requestStartWaiting':np.sum,'arrivalEvent':np.sum,'requestWaitingTime': np.mean,'requestProcessed':np.sum,'totalTimeInSystem':np.mean,'requestCancelled':np.sum}
+        self.explorationStream = environment.random.stream('exploration')
         self.currentPeriod = 0
         self.processReward, self.cancelReward, self.serverReward = processReward, cancelReward, serverReward
         self.eta = eta
         self.nServerRange = nServerRange #the range for the bernoulli to sample from
         self.usePartialFit = usePartialFit
         self.periodLength = periodLength
-        self.X = None #store the complete feature dataset here
-        self.y = None #store the complete target dataset here s
+        self.trainingBuffer = TrainingBuffer(window=window, forgetting=forgetting) #features and rewards of the periods
         self.linear = linear
         if not linear:
             self.A = np.random.uniform(0,0.5,(6,6))
@@ -144,6 +235,17 @@ class GreedyEpsilonLoadBalancerContextSampling(LoadBalancer):
         self.mu = np.array([0]) #for mv normal
         self.cov = np.diag([1]) #for mv normal
 
+    @property
+    def X(self):
+        """
+        Features of all periods in the training window, the last row belongs to the current period
+        """
+        return self.trainingBuffer.X
+
+    @property
+    def y(self):
+        return self.trainingBuffer.y[:,None]
+
     def getEta(self):
         if callable(self.eta):
             return self.eta(self.currentPeriod)
@@ -155,12 +257,7 @@ class GreedyEpsilonLoadBalancerContextSampling(LoadBalancer):
         """
         !!! This only used for the computation of the reward not for the model!
         """
-        previousPeriodData = self.environment.getPeriodLog() #returns {key: values}
-        previousPeriodContext = {key: self.agg[key](vals) for key,vals in previousPeriodData.items() if key in self.agg.keys()} #apply aggregation: go from lists to scalars
-        previousPeriodContext ={key:val if not np.isnan(val) else 0 for key,val in previousPeriodContext.items()}
-        previousPeriodContext ={key:previousPeriodContext[key] if key in previousPeriodContext.keys() else 0 for key in self.agg.keys()}
-
-        return previousPeriodContext
+        return aggregatePeriodContext(self.environment, self.agg) #apply aggregation: go from lists to scalars
 
     def getPreviousPeriodReward(self):
         """
@@ -175,27 +272,20 @@ class GreedyEpsilonLoadBalancerContextSampling(LoadBalancer):
         return reward
 
     def findModelOptimum(self, context):
-        max = -math.inf
-        maxArg = 0
-        for n in range(self.nServerRange[0], self.nServerRange[1]): #implement better optimization here
-            X =  np.append(context, n)
-            rewardHat = self.model.predict(X[None,:])[0]
-            if rewardHat > max:
-                maxArg = n
-                max = rewardHat
-        print("Max reward for", rewardHat, maxArg)
+        maxArg = modelOptimum(self.model, context, self.nServerRange)
+        print("Max reward for", maxArg)
         return maxArg
 
     def getNextPeriodNumberOfServers(self, context):
         #take random action or input the context into the model and maximizy the output w.r.t N
-        draw = random.random()
+        draw = self.explorationStream.random()
         eta = self.getEta()
         self.environment.logData('eta', eta)
         nServers = None
         if draw < eta or self.currentPeriod <= 1: #on first iteration the model is not fitted
             #Take random action
             self.environment.logData("greedyEpsilonActionType", 0)
-            nServers = random.randint(self.nServerRange[0], self.nServerRange[1])
+            nServers = self.explorationStream.randint(self.nServerRange[0], self.nServerRange[1])
         else:
             self.environment.logData("greedyEpsilonActionType", 1)
             nServers = self.findModelOptimum(context) 
@@ -205,19 +295,12 @@ class GreedyEpsilonLoadBalancerContextSampling(LoadBalancer):
     def updateModel(self, reward):
         #update the model using the context, nServers and observed reward
         if self.currentPeriod > 0:
-            newY = np.array([reward])
-            self.y = np.append(self.y, newY[None,:], axis=0) if self.y is not None else newY[None,:]
-            if not self.usePartialFit:
-                #print(self.X.shape,self.y.shape)
-                self.model = self.model.fit(self.X, self.y) #make sure the hat the last period x is ignored
-                print(self.model.score(self.X, self.y))
-            else:
-                self.model = self.model.partial_fit(self.X, self.y) #make sure the hat the last period x is ignored
-                print(self.model.score(self.X, self.y))
+            self.trainingBuffer.addTarget(reward)
+            self.model = fitTrainingBuffer(self.model, self.trainingBuffer, self.usePartialFit)
 
     def updateX(self, context, nOptimal):
         newX = np.append(context, nOptimal) #+ [reward] #add the current nServers to X
-        self.X = np.append(self.X, newX[None,:], axis=0) if self.X is not None else newX[None,:] #update the data 
+        self.trainingBuffer.addFeatures(newX) #the reward is added at the end of the period
 
     def onPeriodEnd(self, previousPeriodContext):
         previousPeriodReward = self.getPreviousPeriodReward()
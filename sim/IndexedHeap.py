@@ -0,0 +1,87 @@
+class IndexedMinHeap:
+    """
+    Binary min-heap over the items 0, 1, ..., n-1 with an integer key per item that can be changed in O(log n).
+    Equal keys are ordered by item, so the minimum is the first item with the smallest key (like min() over a list).
+    Items are added and removed at the end, like servers in the server list of a load balancer.
+    """
+    def __init__(self, keys = ()):
+        self.keys = list(keys) #key per item
+        self.heap = list(range(len(self.keys))) #items in heap order
+        self.position = list(range(len(self.keys))) #index in the heap per item
+        for i in reversed(range(len(self.heap)//2)):
+            self._siftDown(i)
+
+    def _less(self, a, b):
+        keyA, keyB = self.keys[a], self.keys[b]
+        return keyA < keyB or (keyA == keyB and a < b)
+
+    def _siftUp(self, i):
+        heap, position = self.heap, self.position
+        item = heap[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if not self._less(item, heap[parent]): break
+            heap[i] = heap[parent]
+            position[heap[i]] = i
+            i = parent
+        heap[i] = item
+        position[item] = i
+
+    def _siftDown(self, i):
+        heap, position = self.heap, self.position
+        n = len(heap)
+        item = heap[i]
+        while True:
+            child = 2*i + 1
+            if child >= n: break
+            if child + 1 < n and self._less(heap[child + 1], heap[child]): child += 1
+            if not self._less(heap[child], item): break
+            heap[i] = heap[child]
+            position[heap[i]] = i
+            i = child
+        heap[i] = item
+        position[item] = i
+
+    def min(self):
+        """
+        Item with the smallest key
+        """
+        return self.heap[0]
+
+    def update(self, item, key):
+        oldKey = self.keys[item]
+        if key == oldKey: return
+        self.keys[item] = key
+        if key < oldKey:
+            self._siftUp(self.position[item])
+        else:
+            self._siftDown(self.position[item])
+
+    def append(self, key):
+        """
+        Add the item len(self) with the given key
+        """
+        item = len(self.keys)
+        self.keys.append(key)
+        self.heap.append(item)
+        self.position.append(item)
+        self._siftUp(item)
+        return item
+
+    def pop(self):
+        """
+        Remove the last item
+        """
+        item = len(self.keys) - 1
+        i = self.position[item]
+        last = self.heap.pop()
+        if last != item: #move the last heap element into the hole
+            self.heap[i] = last
+            self.position[last] = i
+            self._siftUp(i)
+            self._siftDown(self.position[last])
+        self.keys.pop()
+        self.position.pop()
+
+    def __len__(self):
+        return len(self.keys)
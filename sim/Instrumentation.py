@@ -0,0 +1,107 @@
+from bisect import bisect_right
+import time
+
+import numpy as np
+
+TIMING_BIN_EDGES = [10**(exponent/4) for exponent in range(8, 41)] #nanoseconds, 4 bins per decade from 100ns to 10s
+
+
+def printProgress(environment, instrumentation):
+    """
+    Default progress callback: a progress bar with the simulated time and the events handled per wall-clock second
+    """
+    fraction = min(1.0, environment.currentTime/environment.stopTime) if environment.stopTime else 1.0
+    rate = instrumentation.handledEvents/max(time.perf_counter() - instrumentation.startTime, 1e-9)
+    print(f"{int(environment.currentTime)} | {int(fraction*10)*'=' + '>':11} {rate:,.0f} events/s", end='\r')
+
+
+class Instrumentation:
+    """
+    Measurements of a run, pass it to Environment.run. Counts the handled events per event name (stream items per
+    handler), times a sample of the callbacks, samples the length of the event queue and calls a progress callback
+    throttled by wall-clock time. Without an instrumentation Environment.run uses a loop without any of these checks.
+    """
+    def __init__(self, timingEvery = 0, depthEvery = 0, progress = None, progressInterval = 1.0):
+        """
+        Parameters
+        ----------
+        timingEvery : int
+            Time the callback of every timingEvery-th event, 0 for no timing. Timing every event slows the run down by
+            the cost of two clock reads per event.
+        depthEvery : int
+            Record (simulated time, events in the queue) every depthEvery-th event, 0 for no sampling
+        progress : callable, optional
+            Called as progress(environment, instrumentation), at most once per progressInterval wall-clock seconds,
+            e.g. printProgress
+        progressInterval : float
+            Minimal wall-clock seconds between progress calls
+        """
+        self.timingEvery = timingEvery
+        self.depthEvery = depthEvery
+        self.progress = progress
+        self.progressInterval = progressInterval
+        self.counts = {} #{name: handled events}
+        self.timings = {} #{name: [histogram counts per TIMING_BIN_EDGES bin, number of samples, total sampled ns]}
+        self.depthTimes, self.depths = [], []
+        self.handledEvents = 0
+        self.startTime = time.perf_counter()
+        self.lastProgressTime = self.startTime
+
+    def recordTiming(self, name, nanoseconds):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = [[0]*(len(TIMING_BIN_EDGES) + 1), 0, 0]
+        timing[0][bisect_right(TIMING_BIN_EDGES, nanoseconds)] += 1
+        timing[1] += 1
+        timing[2] += nanoseconds
+
+    def recordDepth(self, time, depth):
+        self.depthTimes.append(time)
+        self.depths.append(depth)
+
+    def checkProgress(self, environment):
+        now = time.perf_counter()
+        if now - self.lastProgressTime >= self.progressInterval:
+            self.lastProgressTime = now
+            self.progress(environment, self)
+
+    def queueDepths(self):
+        """
+        Sampled event queue lengths, as arrays (simulated times, lengths)
+        """
+        return np.array(self.depthTimes), np.array(self.depths)
+
+    def percentile(self, name, q):
+        """
+        Upper edge of the histogram bin of the q-th percentile (0-100) of the sampled callback times of name, in seconds
+        """
+        histogram, nSamples, _ = self.timings[name]
+        index = int(np.searchsorted(np.cumsum(histogram), q/100*nSamples))
+        return (TIMING_BIN_EDGES[index] if index < len(TIMING_BIN_EDGES) else np.inf)/1e9
+
+    def summary(self):
+        """
+        Per name: handled events, sampled callback time statistics and the total time estimated from the samples,
+        sorted by the estimated time (or by count without timing)
+
+        Returns
+        -------
+        list[dict]
+        """
+        rows = []
+        for name, count in self.counts.items():
+            row = {'name': name, 'count': count}
+            timing = self.timings.get(name)
+            if timing is not None:
+                meanTime = timing[2]/timing[1]/1e9
+                row.update(samples=timing[1], meanTime=meanTime, p50=self.percentile(name, 50), p99=self.percentile(name, 99), estimatedTotalTime=meanTime*count)
+            rows.append(row)
+        return sorted(rows, key=lambda row: (row.get('estimatedTotalTime', 0), row['count']), reverse=True)
+
+    def printSummary(self):
+        print(f"{'name':40} {'count':>10} {'mean us':>9} {'p50 us':>9} {'p99 us':>9} {'total s':>9}")
+        for row in self.summary():
+            if 'meanTime' in row:
+                print(f"{row['name']:40} {row['count']:>10} {row['meanTime']*1e6:>9.2f} {row['p50']*1e6:>9.2f} {row['p99']*1e6:>9.2f} {row['estimatedTotalTime']:>9.3f}")
+            else:
+                print(f"{row['name']:40} {row['count']:>10}")
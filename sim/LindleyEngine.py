@@ -0,0 +1,247 @@
+"""
+Event-free engine for servers that are independent FIFO queues with reneging.
+
+Processing times are known at arrival and every request type has a fixed deadline, so under round-robin or random
+assignment the fate of a request only depends on the requests assigned to the same server before it. Per server the
+time at which the server becomes free follows a Lindley-type recursion with truncation at the deadline:
+
+    start_i = max(free_{i-1}, arrival_i)
+    free_i  = min(start_i + processingTime_i, deadline_i)   if start_i <= deadline_i (the request is served)
+    free_i  = free_{i-1}                                    otherwise (the request left the queue)
+
+Without deadline misses this is the plain Lindley recursion free_i = max(free_{i-1}, arrival_i) + processingTime_i, which
+is evaluated for whole blocks with cumulative sums and maxima. Requests that miss their deadline are handled one by one.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import numpy as np
+
+if TYPE_CHECKING: #only for typechecking
+    from sim.Environment import Environment
+
+MIN_BLOCK = 64 #block sizes of the vectorized recursion
+MAX_BLOCK = 8192
+SCALAR_STRETCH = 32 #number of requests handled one by one when deadline misses are frequent
+
+
+def generateArrivals(arrivalsPerSecond, requestTypes, startTime, duration, rng: np.random.Generator):
+    """
+    Sample the requests of a Poisson arrival process in [startTime, startTime + duration) like ExponentialSource does
+
+    Returns
+    -------
+    (arrivalTimes, types, processingTimes, timeRequirements) arrays, ordered by arrival time
+    """
+    nArrivals = rng.poisson(arrivalsPerSecond*duration)
+    arrivalTimes = np.sort(startTime + duration*rng.random(nArrivals))
+    typeProbs = np.array([requestType[0] for requestType in requestTypes])
+    types = np.searchsorted(np.cumsum(typeProbs), rng.random(nArrivals)*typeProbs.sum(), side='right')
+    types = np.minimum(types, len(requestTypes) - 1)
+    means, stds, timeLimits = (np.array([requestType[i] for requestType in requestTypes]) for i in (1, 2, 3))
+    processingTimes = np.maximum(rng.normal(means[types], stds[types]), 0) #Request does not accept negative processing times
+    return arrivalTimes, types, processingTimes, timeLimits[types]
+
+
+def serveFIFO(arrivalTimes, processingTimes, deadlines, freeTime=0.0):
+    """
+    Evaluate one FIFO server with reneging
+
+    Parameters
+    ----------
+    arrivalTimes, processingTimes, deadlines : np.ndarray
+        The requests assigned to the server in arrival order, deadlines are absolute times
+    freeTime : float
+        Time the server becomes free from earlier requests
+
+    Returns
+    -------
+    (startTimes, endTimes, processed, freeTime): startTimes is nan for requests that left the queue, endTimes is the
+    finish time of processed requests and the deadline of cancelled requests
+    """
+    n = len(arrivalTimes)
+    startTimes = np.full(n, np.nan)
+    endTimes = np.empty(n)
+    processed = np.zeros(n, dtype=bool)
+    i = 0
+    block = MIN_BLOCK
+    while i < n:
+        j = min(n, i + block)
+        a, p, d = arrivalTimes[i:j], processingTimes[i:j], deadlines[i:j]
+        cumulative = np.cumsum(p)
+        completion = cumulative + np.maximum(freeTime, np.maximum.accumulate(a - (cumulative - p))) #Lindley recursion
+        missed = completion > d #finishing exactly at the deadline still counts as processed
+        k = int(np.argmax(missed)) if missed.any() else j - i
+        startTimes[i:i+k] = completion[:k] - p[:k]
+        endTimes[i:i+k] = completion[:k]
+        processed[i:i+k] = True
+        if k > 0: freeTime = completion[k-1]
+        i += k
+        if i == j:
+            block = min(2*block, MAX_BLOCK)
+            continue
+        #deadline misses: handle the next requests one by one
+        stretchEnd = min(n, i + (SCALAR_STRETCH if k < MIN_BLOCK else 1))
+        while i < stretchEnd:
+            start = max(freeTime, arrivalTimes[i])
+            if start <= deadlines[i]:
+                startTimes[i] = start
+                end = start + processingTimes[i]
+                if end <= deadlines[i]:
+                    processed[i] = True
+                else:
+                    end = deadlines[i] #service is aborted at the deadline
+                endTimes[i] = freeTime = end
+            else:
+                endTimes[i] = deadlines[i] #left the queue
+            i += 1
+        block = MIN_BLOCK
+    return startTimes, endTimes, processed, freeTime
+
+
+class LindleyEngine:
+    """
+    Computes the statistics that Environment.run logs for servers with independent FIFO queues, without creating a
+    Request or Event per arrival. The server state and the outcomes that fall after the stopTime of a call are carried
+    over, so consecutive periods can be simulated with consecutive calls.
+    """
+    def __init__(self, nServers, assignment = 'roundRobin', rng: np.random.Generator = None):
+        """
+        Parameters
+        ----------
+        nServers : int
+            Number of servers
+        assignment : str
+            'roundRobin' (like LoadBalancer) or 'random' (like LoadBalancerRandom)
+        rng : np.random.Generator
+            Used for random assignment and to generate arrivals
+        """
+        if assignment not in ('roundRobin', 'random'):
+            raise ValueError(f"Unknown assignment '{assignment}', choose from 'roundRobin' or 'random'")
+        self.nServers = nServers
+        self.assignment = assignment
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.serverFreeTime = np.zeros(nServers)
+        self.nextServer = 0
+        self.pending = {key: (np.empty(0), np.empty(0)) for key in ('requestWaitingTime', 'requestProcessed', 'requestCancelled')} #{key: (times, values)} of outcomes after stopTime
+
+    def assign(self, nArrivals):
+        """
+        Server index for each of the next nArrivals requests
+        """
+        if self.assignment == 'random':
+            return self.rng.integers(0, self.nServers, nArrivals)
+        servers = (self.nextServer + np.arange(nArrivals)) % self.nServers
+        self.nextServer = (self.nextServer + nArrivals) % self.nServers
+        return servers
+
+    def simulate(self, arrivalTimes, processingTimes, timeRequirements, stopTime = np.inf, servers = None, returnSamples = False):
+        """
+        Serve the given requests and aggregate the outcomes that happen at or before stopTime
+
+        Parameters
+        ----------
+        arrivalTimes, processingTimes, timeRequirements : np.ndarray
+            The arriving requests, ordered by arrival time and later than the requests of earlier calls
+        stopTime : float
+            Outcomes after stopTime are carried over to the next call
+        servers : np.ndarray, optional
+            Server index per request, by default the assignment policy of the engine is used
+        returnSamples : bool
+            Also return the individual waiting times and times in system
+
+        Returns
+        -------
+        dict with the keys arrivalEvent, requestWaitingTime (mean), requestProcessed, requestCancelled and
+        totalTimeInSystem (mean), named like the log keys of the event simulation
+        """
+        arrivalTimes = np.asarray(arrivalTimes, dtype=float)
+        processingTimes = np.asarray(processingTimes, dtype=float)
+        deadlines = arrivalTimes + np.asarray(timeRequirements, dtype=float)
+        servers = self.assign(len(arrivalTimes)) if servers is None else np.asarray(servers)
+        startTimes, endTimes = np.empty(len(arrivalTimes)), np.empty(len(arrivalTimes))
+        processed = np.empty(len(arrivalTimes), dtype=bool)
+
+        order = np.argsort(servers, kind='stable') #group the requests per server, keeping the arrival order
+        bounds = np.searchsorted(servers[order], np.arange(self.nServers + 1))
+        for server in range(self.nServers):
+            idx = order[bounds[server]:bounds[server+1]]
+            if len(idx) == 0: continue
+            startTimes[idx], endTimes[idx], processed[idx], self.serverFreeTime[server] = serveFIFO(arrivalTimes[idx], processingTimes[idx], deadlines[idx], self.serverFreeTime[server])
+
+        started = ~np.isnan(startTimes)
+        outcomes = {
+            'requestWaitingTime': (startTimes[started], startTimes[started] - arrivalTimes[started]),
+            'requestProcessed': (endTimes[processed], endTimes[processed] - arrivalTimes[processed]), #value is the time in system
+            'requestCancelled': (endTimes[~processed], np.zeros(int((~processed).sum()))),
+        }
+        samples = {}
+        for key, (times, values) in outcomes.items():
+            times = np.concatenate([self.pending[key][0], times])
+            values = np.concatenate([self.pending[key][1], values])
+            due = times <= stopTime
+            samples[key] = values[due]
+            self.pending[key] = (times[~due], values[~due])
+
+        summary = {
+            'arrivalEvent': int(np.sum(arrivalTimes <= stopTime)),
+            'requestWaitingTime': np.mean(samples['requestWaitingTime']) if len(samples['requestWaitingTime']) else np.nan,
+            'requestProcessed': len(samples['requestProcessed']),
+            'totalTimeInSystem': np.mean(samples['requestProcessed']) if len(samples['requestProcessed']) else np.nan,
+            'requestCancelled': len(samples['requestCancelled']),
+        }
+        if returnSamples:
+            summary['requestWaitingTimes'] = samples['requestWaitingTime']
+            summary['totalTimesInSystem'] = samples['requestProcessed']
+        return summary
+
+    def simulatePeriod(self, arrivalsPerSecond, requestTypes, startTime, periodLength, returnSamples = False):
+        """
+        Generate Poisson arrivals for the period [startTime, startTime + periodLength) and simulate them
+        """
+        arrivalTimes, _, processingTimes, timeRequirements = generateArrivals(arrivalsPerSecond, requestTypes, startTime, periodLength, self.rng)
+        return self.simulate(arrivalTimes, processingTimes, timeRequirements, stopTime=startTime + periodLength, returnSamples=returnSamples)
+
+
+def summarizeLog(environment: Environment):
+    """
+    Aggregate the log of an event simulation like LindleyEngine.simulate
+    """
+    log = environment.log
+    def mean(key):
+        return np.mean(log[key]) if key in log and len(log[key]) else np.nan
+    return {
+        'arrivalEvent': len(log['arrivalEvent']) if 'arrivalEvent' in log else 0,
+        'requestWaitingTime': mean('requestWaitingTime'),
+        'requestProcessed': len(log['requestProcessed']) if 'requestProcessed' in log else 0,
+        'totalTimeInSystem': mean('totalTimeInSystem'),
+        'requestCancelled': len(log['requestCancelled']) if 'requestCancelled' in log else 0,
+    }
+
+
+def crossCheck(arrivalTimes, types, processingTimes, timeRequirements, nServers, stopTime, assignment = 'roundRobin', rng: np.random.Generator = None):
+    """
+    Replay the same requests through Environment.run and through a LindleyEngine, with the same server assignment.
+    Both engines should agree up to ties between event times.
+
+    Returns
+    -------
+    (engineSummary, eventSummary)
+    """
+    from sim.Environment import Environment
+    from sim.Event import Event
+    from sim.Request import Request
+    from sim.Server import Server
+
+    engine = LindleyEngine(nServers, assignment=assignment, rng=rng)
+    servers = engine.assign(len(arrivalTimes))
+    engineSummary = engine.simulate(arrivalTimes, processingTimes, timeRequirements, stopTime=stopTime, servers=servers)
+
+    env = Environment(stopTime=stopTime)
+    serverList = [Server(environment=env, id=i) for i in range(nServers)]
+    def arrival(i):
+        env.logData("arrivalEvent")
+        serverList[servers[i]].assignRequest(Request(type=int(types[i]), processingTime=float(processingTimes[i]), timeRequirement=float(timeRequirements[i]), environment=env))
+    for i, arrivalTime in enumerate(arrivalTimes):
+        env.scheduleEvent(Event(float(arrivalTime), lambda i=i: arrival(i), "arrival"))
+    env.run(debug=False)
+    return engineSummary, summarizeLog(env)
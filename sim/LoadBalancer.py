@@ -6,38 +6,93 @@ if TYPE_CHECKING: #only for typechecking
     from sim.Request import Request
 
 from sim.Server import Server
+from sim.IndexedHeap import IndexedMinHeap
+
+DRAIN_MODES = ('drain', 'reroute')
 
 class LoadBalancer:
     """
     Default loadbalancer using the Round-Robin assignment algorithm
     """
-    def __init__(self, nServers, environment: Environment):
+    def __init__(self, nServers, environment: Environment, drainMode = 'drain'):
+        """
+        Parameters
+        ----------
+        drainMode : str
+            What happens to a server that is removed when scaling down, it is no longer routed to and
+            'drain': finishes the request in process and the requests in its queue,
+            'reroute': finishes the request in process, the requests in its queue are routed to the remaining servers.
+            Servers without requests are parked in a pool and reused when scaling up.
+        """
+        if drainMode not in DRAIN_MODES:
+            raise ValueError(f"Unknown drain mode '{drainMode}', choose from {DRAIN_MODES}")
         self.nServers = nServers 
         self.environment = environment
-        self.environment.logData("totalInQueue", 0)
-        self.serverList = [Server(environment=environment, id=i) for i in range(nServers)]
+        self.drainMode = drainMode
+        self.serverList = [Server(environment=environment) for i in range(nServers)]
+        self.environment.setLevel("numberOfServers", nServers) #time averaged over the period
+        self.drainingServers = [] #removed servers that still have requests
+        self.serverPool = [] #idle removed servers
         self.currentServer = 0
 
     def _setNumberOfServers(self, newNumber):
         self.environment.logData("numberOfServers", self.nServers) #log before
+        self._parkDrainedServers()
 
+        rerouted = []
         if newNumber > self.nServers:
             diff = newNumber - self.nServers
-            newServers = [Server(environment=self.environment, id=i) for i in range(diff)]
+            newServers = [self._acquireServer() for i in range(diff)]
             self.serverList = self.serverList + newServers
             self.currentServer = newNumber - 1
         elif newNumber < self.nServers:
+            removedServers = self.serverList[newNumber:]
             self.serverList = self.serverList[:newNumber]
+            for server in removedServers:
+                if self.drainMode == 'reroute': rerouted += server.queue.pullAll()
+                (self.drainingServers if server.load else self.serverPool).append(server)
         
         self.nServers = newNumber
+        self.environment.setLevel("numberOfServers", newNumber)
+        self._onServerListChange()
+        for request in rerouted:
+            self.routeRequest(request)
         #print(newNumber)
         self.environment.logData("numberOfServers", self.nServers) # log after
 
+    def _acquireServer(self) -> Server:
+        """
+        Server to add to the server list: a draining server (it is busy already), a parked server or a new server
+        """
+        if self.drainingServers: return self.drainingServers.pop()
+        if self.serverPool: return self.serverPool.pop()
+        return Server(environment=self.environment)
+
+    def _parkDrainedServers(self):
+        if self.drainingServers:
+            self.serverPool += [server for server in self.drainingServers if not server.load]
+            self.drainingServers = [server for server in self.drainingServers if server.load]
+
+    def _onServerListChange(self):
+        """
+        Called after servers are added to or removed from the server list, before requests are rerouted
+        """
+        return
+
+    def getBusyTime(self):
+        """
+        Total processing time of all servers of the load balancer, including the draining and parked servers
+        """
+        return sum(server.getBusyTime() for server in self.serverList + self.drainingServers + self.serverPool)
+
     def handleRequestArrival(self, request: Request):
+        self.environment.logData("arrivalEvent")
+        self.routeRequest(request)
+
+    def routeRequest(self, request: Request):
         """
         Round robin assignment
         """
-        self.environment.logData("arrivalEvent")
         if self.currentServer >= self.nServers: self.currentServer = 0
         self.serverList[self.currentServer].assignRequest(request=request)
         self.currentServer += 1
@@ -51,18 +106,43 @@ class LoadBalancer:
 
 class LoadBalancerShortestQueue(LoadBalancer):
     """
-    Loadbalancer assigning to servers random
+    Loadbalancer assigning to the server with the fewest requests (waiting or being processed), the first such server
+    in the server list on ties. The servers are kept in an indexed heap on their load, which the servers update when
+    their load changes, so an assignment takes O(log nServers) instead of a scan over all servers.
     """
-    def __init__(self, nServers, environment: Environment):
-        super().__init__(nServers=nServers,environment=environment)
+    def __init__(self, nServers, environment: Environment, drainMode = 'drain'):
+        super().__init__(nServers=nServers,environment=environment,drainMode=drainMode)
+        self.loadIndex = IndexedMinHeap()
+        self.indexedServers = [] #servers in the load index, item i is indexedServers[i]
+        self.serverPosition = {} #server -> item in the load index (= index in serverList)
+        self._indexServers()
+
+    def _indexServers(self):
+        """
+        Bring the load index in line with the server list, servers are only added or removed at the end
+        """
+        indexed = self.indexedServers
+        while len(indexed) > len(self.serverList) or (indexed and indexed[-1] is not self.serverList[len(indexed) - 1]):
+            server = indexed.pop()
+            server.onLoadChange = None #a removed server finishes its requests without being indexed
+            del self.serverPosition[server]
+            self.loadIndex.pop()
+        for server in self.serverList[len(indexed):]:
+            self.serverPosition[server] = self.loadIndex.append(server.load)
+            indexed.append(server)
+            server.onLoadChange = self._onLoadChange
+
+    def _onLoadChange(self, server: Server):
+        self.loadIndex.update(self.serverPosition[server], server.load)
+
+    def _onServerListChange(self):
+        self._indexServers()
     
-    def handleRequestArrival(self, request: Request):
+    def routeRequest(self, request: Request):
         """
         Assign to shortest queue
         """
-        self.environment.logData("arrivalEvent")
-        shortest = min(self.serverList, key=lambda server: len(server.queue.queue))
-        shortest.assignRequest(request=request)        
+        self.serverList[self.loadIndex.min()].assignRequest(request=request)
     
     def onPeriodEnd(self):
         """
@@ -70,7 +150,3 @@ class LoadBalancerShortestQueue(LoadBalancer):
         """
         return
         #raise NotImplementedError
-
-
-
-    
\ No newline at end of file
@@ -1,5 +1,4 @@
 from __future__ import annotations
-import random
 from typing import TYPE_CHECKING
 from sim.LoadBalancer import LoadBalancer
 
@@ -13,17 +12,15 @@ class LoadBalancerRandom(LoadBalancer):
     """
     Loadbalancer assigning to servers random
     """
-    def __init__(self, nServers, environment: Environment):
-        super().__init__(nServers=nServers,environment=environment)
-        self.currentServer = random.randint(0,nServers-1)
+    def __init__(self, nServers, environment: Environment, drainMode = 'drain'):
+        super().__init__(nServers=nServers,environment=environment,drainMode=drainMode)
+        self.routingStream = environment.random.stream('routing')
     
-    def handleRequestArrival(self, request: Request):
+    def routeRequest(self, request: Request):
         """
-        Round robin assignment
+        Random assignment
         """
-        self.environment.logData("arrivalEvent")
-        self.serverList[self.currentServer].assignRequest(request=request)
-        self.currentServer = random.randint(0,self.nServers-1)
+        self.serverList[self.routingStream.randint(0,self.nServers-1)].assignRequest(request=request)
     
     
     def onPeriodEnd(self):
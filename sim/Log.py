@@ -0,0 +1,168 @@
+import numpy as np
+import math
+
+INITIAL_CAPACITY = 256
+CHUNK_SIZE = 1024 #number of appended values that are buffered before they are moved into the typed buffer
+
+def _allInts(values):
+    return all(type(value) is int or isinstance(value, np.integer) for value in values)
+
+
+class LogColumn:
+    """
+    Growable typed buffer holding one stream of logged values. Values are stored in a NumPy array that doubles in size
+    when full (amortized O(1) appends): int64 while only ints are logged, float64 once a float is logged (None is then
+    stored as nan) and an object array when non-numeric data is logged.
+    Appended values are first collected in a small list (appending to a list is much cheaper than writing single values
+    into an array) and moved into the buffer in chunks of CHUNK_SIZE or whenever the values are read.
+    Behaves like a read-only list: supports len, indexing, slicing, iteration and conversion with np.asarray.
+    """
+    def __init__(self, capacity = INITIAL_CAPACITY):
+        self.buffer: np.ndarray = np.empty(capacity, dtype=np.float64)
+        self.size = 0 #number of values in the buffer
+        self.pending = [] #values that are not yet in the buffer
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        Zero-copy view on the logged values
+        """
+        if self.pending: self.flush()
+        return self.buffer[:self.size]
+
+    def append(self, value):
+        self.pending.append(value)
+        if len(self.pending) >= CHUNK_SIZE: self.flush()
+
+    def flush(self):
+        """
+        Move the pending values into the typed buffer
+        """
+        pending = self.pending
+        newSize = self.size + len(pending)
+        dtype = self.buffer.dtype
+        if dtype == np.int64 and not _allInts(pending):
+            self.buffer = self.buffer.astype(np.float64)
+        elif self.size == 0 and dtype == np.float64 and _allInts(pending): #e.g. counts or actions, keep them ints
+            self.buffer = np.empty(len(self.buffer), dtype=np.int64)
+        if newSize > len(self.buffer):
+            self._grow(newSize)
+        try:
+            self.buffer[self.size:newSize] = pending
+        except (TypeError, ValueError, OverflowError):
+            self.buffer = self.buffer.astype(object)
+            self.buffer[self.size:newSize] = np.array(pending + [None], dtype=object)[:-1] #keep sequences as single elements
+        self.size = newSize
+        self.pending = []
+
+    def _grow(self, minCapacity):
+        capacity = len(self.buffer)
+        while capacity < minCapacity: capacity *= 2
+        newBuffer = np.empty(capacity, dtype=self.buffer.dtype)
+        newBuffer[:self.size] = self.buffer[:self.size]
+        self.buffer = newBuffer
+
+    def tolist(self):
+        return self.values.tolist()
+
+    def __getitem__(self, index):
+        if type(index) is int and index == -1 and self.pending: #fast path, used for reading the last value
+            return self.pending[-1]
+        return self.values[index]
+
+    def __len__(self):
+        return self.size + len(self.pending)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __array__(self, dtype=None):
+        return self.values if dtype is None else self.values.astype(dtype)
+
+    def __repr__(self):
+        return f"LogColumn({self.values!r})"
+
+
+AGGREGATIONS = ('count', 'sum', 'mean', 'min', 'max')
+
+class PeriodMetric:
+    """
+    Streaming aggregate of one log key over the current period, updated in O(1) per logged value.
+    The accumulator belongs to a period index, when a value of a newer period is logged the accumulator is rolled over
+    first, so starting a new period does not need to touch the metrics.
+    """
+    def __init__(self, aggregation = 'sum', period = 0):
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation '{aggregation}', choose from {AGGREGATIONS}")
+        self.aggregation = aggregation
+        self.period = period
+        self.last = None #last logged value, kept over periods
+        self.reset(period)
+
+    def reset(self, period):
+        self.period = period
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, value, period):
+        if period != self.period: self.reset(period)
+        self.count += 1
+        self.last = value
+        if self.aggregation == 'count': return #value does not have to be numeric
+        self.sum += value
+        if value < self.min: self.min = value
+        if value > self.max: self.max = value
+
+    def value(self, period):
+        """
+        Aggregated value for the given period, nan for the mean, min and max of an empty period (like np.mean)
+        """
+        if period != self.period or self.count == 0:
+            return 0 if self.aggregation in ('count', 'sum') else math.nan
+        if self.aggregation == 'count': return self.count
+        if self.aggregation == 'sum': return self.sum
+        if self.aggregation == 'mean': return self.sum/self.count
+        if self.aggregation == 'min': return self.min
+        return self.max
+
+
+class TimeWeightedMetric:
+    """
+    Exact time average over the current period of a level that changes at discrete times (queue length, number of
+    busy servers, ...). Only the current level, the time of the last change and the area under the level since the
+    period start are kept. Like PeriodMetric it rolls over to a new period lazily, the level is constant since the
+    last change so the area of the new period up to now is known.
+    """
+    __slots__ = ('last', 'lastChangeTime', 'area', 'period')
+
+    def __init__(self, level = 0, time = 0, period = 0):
+        self.last = level #the current level, named like PeriodMetric.last for lastLogValue
+        self.lastChangeTime = time
+        self.area = 0.0
+        self.period = period
+
+    def _rollOver(self, period, periodStartTime):
+        self.period = period
+        self.area = 0.0
+        self.lastChangeTime = max(self.lastChangeTime, periodStartTime)
+
+    def update(self, level, time, period, periodStartTime):
+        """
+        Change the level at the given time
+        """
+        if period != self.period: self._rollOver(period, periodStartTime)
+        self.area += self.last*(time - self.lastChangeTime)
+        self.lastChangeTime = time
+        self.last = level
+
+    def value(self, time, period, periodStartTime):
+        """
+        Time average of the level from periodStartTime up to time, the current level for a period without duration
+        """
+        if period != self.period:
+            return self.last #constant since before the period start
+        duration = time - periodStartTime
+        if duration <= 0: return self.last
+        return (self.area + self.last*(time - self.lastChangeTime))/duration
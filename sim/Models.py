@@ -0,0 +1,277 @@
+import numpy as np
+
+
+class TrainingBuffer:
+    """
+    Training data of a model that is refitted every period: a feature row is added when a decision is made and its
+    target when the outcome is known, so the features can be one row ahead of the targets. Rows are stored in
+    preallocated arrays that double in size when full (amortized O(1) appends).
+    With a window only the last window training pairs are kept, the arrays are then compacted in place instead of grown.
+    With a forgetting factor f < 1 the pair of age k (0 for the newest pair) gets the sample weight f**k.
+    """
+    def __init__(self, window = None, forgetting = 1.0, capacity = 256):
+        if window is not None and window < 1:
+            raise ValueError("window must be at least 1")
+        if not 0 < forgetting <= 1:
+            raise ValueError("forgetting must be in (0, 1]")
+        self.window = window
+        self.forgetting = forgetting
+        self.features: np.ndarray = None #allocated on the first row, when the number of features is known
+        self.targets = np.empty(capacity)
+        self.start = 0 #first row in the buffer
+        self.featureEnd = 0 #end of the feature rows
+        self.targetEnd = 0 #end of the target values
+
+    def addFeatures(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self.features is None:
+            self.features = np.empty((len(self.targets), len(x)))
+        if self.featureEnd == len(self.targets):
+            self._makeRoom()
+        self.features[self.featureEnd] = x
+        self.featureEnd += 1
+
+    def addTarget(self, y):
+        """
+        Set the target of the oldest feature row without a target
+        """
+        if self.targetEnd == self.featureEnd:
+            raise IndexError("No feature row without a target")
+        self.targets[self.targetEnd] = y
+        self.targetEnd += 1
+        if self.window is not None and self.targetEnd - self.start > self.window:
+            self.start += 1
+
+    def _makeRoom(self):
+        nRows = self.featureEnd - self.start
+        if 2*nRows > len(self.targets): #more than half full: grow
+            capacity = 2*len(self.targets)
+            features, targets = np.empty((capacity, self.features.shape[1])), np.empty(capacity)
+        else: #the window dropped at least half of the rows: compact
+            features, targets = self.features, self.targets
+        features[:nRows] = self.features[self.start:self.featureEnd]
+        targets[:self.targetEnd - self.start] = self.targets[self.start:self.targetEnd]
+        self.features, self.targets = features, targets
+        self.featureEnd -= self.start
+        self.targetEnd -= self.start
+        self.start = 0
+
+    @property
+    def X(self) -> np.ndarray:
+        """
+        View on all feature rows, including the rows without a target yet
+        """
+        if self.features is None: return np.empty((0, 0))
+        return self.features[self.start:self.featureEnd]
+
+    @property
+    def y(self) -> np.ndarray:
+        """
+        View on the targets, y[i] belongs to X[i]
+        """
+        return self.targets[self.start:self.targetEnd]
+
+    @property
+    def sampleWeight(self):
+        """
+        Weights of the training pairs for the forgetting factor, None without forgetting
+        """
+        if self.forgetting == 1: return None
+        return self.forgetting**np.arange(self.targetEnd - self.start - 1, -1, -1, dtype=np.float64)
+
+    def trainingData(self):
+        """
+        (X, y, sampleWeight) of the rows that have a target
+        """
+        return self.X[:self.targetEnd - self.start], self.y, self.sampleWeight
+
+    def __len__(self):
+        return self.targetEnd - self.start
+
+
+class RecursiveLeastSquares:
+    """
+    Linear regression with an intercept that is updated with every new observation in O(d^2) (Sherman-Morrison update
+    of the inverse Gram matrix), instead of a refit on the whole history. Follows the sklearn regressor interface
+    (fit, partial_fit, predict, score, coef_, intercept_) so it can be used as the model of the greedy-epsilon load balancers.
+    """
+    def __init__(self, forgetting = 1.0, delta = 1e6):
+        """
+        Parameters
+        ----------
+        forgetting : float
+            Forgetting factor in (0, 1], an observation of age k has weight forgetting**k
+        delta : float
+            Initial scale of the inverse Gram matrix, large values mean a weak prior around zero coefficients
+        """
+        if not 0 < forgetting <= 1:
+            raise ValueError("forgetting must be in (0, 1]")
+        self.forgetting = forgetting
+        self.delta = delta
+        self.weights = None #[intercept, coefficients...]
+        self.P = None #inverse of the (regularized, weighted) Gram matrix
+
+    def _reset(self, nFeatures):
+        self.weights = np.zeros(nFeatures + 1)
+        self.P = self.delta*np.eye(nFeatures + 1)
+
+    def update(self, x, y):
+        """
+        Add one observation
+        """
+        if self.weights is None: self._reset(len(x))
+        z = np.empty(len(x) + 1)
+        z[0] = 1.0
+        z[1:] = x
+        Pz = self.P @ z
+        gain = Pz/(self.forgetting + z @ Pz)
+        self.weights += gain*(y - z @ self.weights)
+        self.P -= np.outer(gain, Pz)
+        if self.forgetting != 1: self.P /= self.forgetting
+        return self
+
+    def partial_fit(self, X, y):
+        """
+        Add the observations in the rows of X in order
+        """
+        X, y = np.atleast_2d(np.asarray(X, dtype=np.float64)), np.ravel(y)
+        for x, target in zip(X, y):
+            self.update(x, target)
+        return self
+
+    def fit(self, X, y):
+        """
+        Fit on X, y from scratch
+        """
+        self.weights = None
+        return self.partial_fit(X, y)
+
+    def predict(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        if self.weights is None: return np.zeros(len(X))
+        return self.weights[0] + X @ self.weights[1:]
+
+    def score(self, X, y):
+        """
+        Coefficient of determination R^2 of the prediction
+        """
+        y = np.ravel(y)
+        residual = np.sum((y - self.predict(X))**2)
+        total = np.sum((y - y.mean())**2)
+        return 1 - residual/total if total > 0 else 0.0
+
+    @property
+    def coef_(self):
+        return None if self.weights is None else self.weights[1:]
+
+    @property
+    def intercept_(self):
+        return None if self.weights is None else self.weights[:1]
+
+
+
+class BayesianLinearReward:
+    """
+    Bayesian linear model of the reward of a period, for the features x = [context..., n] of the greedy-epsilon load
+    balancers. The reward is linear in
+        phi(x) = [1, c, n/nMax, l*h(n/l)]
+    with c the context divided by its first observed value, h a piecewise-linear (hat function) basis and l the load
+    feature (e.g. the number of arrivals) relative to its first value, or 1 without a load feature. The reward can be
+    any piecewise-linear function of n, like the steep drop below the stable number of servers, and with a load feature
+    that function scales with the load, so the optimal n moves along with the load.
+    The weights have a Gaussian prior and the noise is Gaussian, so the posterior is Gaussian and is updated per
+    observation in O(d^2) with the Sherman-Morrison formula. Rewards are divided by rewardScale so the prior and noise
+    are in units of about one.
+    """
+    def __init__(self, nServerRange, nKnots = 10, loadIndex = None, rewardScale = 1.0, priorStd = 10.0, noiseStd = 0.05):
+        """
+        Parameters
+        ----------
+        nServerRange : tuple
+            (low, high), the server counts range(low, high) the basis covers
+        nKnots : int
+            Number of knots of the basis in n
+        loadIndex : int, optional
+            Index of the load feature in the context
+        rewardScale : float
+            Typical magnitude of the reward
+        priorStd, noiseStd : float
+            Standard deviation of the zero mean prior of the weights and of the noise, relative to rewardScale
+        """
+        self.nMax = nServerRange[1]
+        self.knots = np.linspace(nServerRange[0], nServerRange[1] - 1, max(2, min(nKnots, nServerRange[1] - nServerRange[0])))
+        self.knotSpacing = self.knots[1] - self.knots[0]
+        self.loadIndex = loadIndex
+        self.rewardScale = rewardScale
+        self.priorStd = priorStd
+        self.noiseVariance = noiseStd**2
+        self.contextScale = None #fixed on the first observed context, so the features keep their meaning
+        self.mean = None
+        self.cov = None
+
+    def initialize(self, nContext):
+        """
+        Set the prior for nContext context features, otherwise done on the first use
+        """
+        d = 2 + nContext + len(self.knots)
+        self.mean = np.zeros(d)
+        self.cov = self.priorStd**2*np.eye(d)
+
+    def features(self, X):
+        """
+        phi for the rows [context..., n] of X
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        if self.contextScale is None:
+            self.contextScale = np.maximum(np.abs(X[0, :-1]), 1.0)
+        if self.mean is None: self.initialize(X.shape[1] - 1)
+        context = X[:, :-1]/self.contextScale
+        n = X[:, -1:]
+        load = np.ones((len(X), 1)) if self.loadIndex is None else np.maximum(context[:, self.loadIndex:self.loadIndex+1], 1e-3)
+        scaledN = np.clip(n/load, self.knots[0], self.knots[-1])
+        basis = load*np.maximum(0, 1 - np.abs(scaledN - self.knots)/self.knotSpacing)
+        return np.hstack([np.ones((len(X), 1)), context, n/self.nMax, basis])
+
+    def update(self, x, y):
+        """
+        Add the observed reward y of the features x
+        """
+        phi = self.features(x)[0]
+        covPhi = self.cov @ phi
+        denominator = self.noiseVariance + phi @ covPhi
+        self.mean = self.mean + covPhi*(y/self.rewardScale - phi @ self.mean)/denominator
+        self.cov = self.cov - np.outer(covPhi, covPhi)/denominator
+        self.cov = (self.cov + self.cov.T)/2 #keep it symmetric under rounding
+        return self
+
+    def partial_fit(self, X, y):
+        for x, target in zip(np.atleast_2d(X), np.ravel(y)):
+            self.update(x, target)
+        return self
+
+    def fit(self, X, y):
+        self.mean = self.cov = None
+        return self.partial_fit(X, y)
+
+    def predict(self, X, weights = None):
+        """
+        Reward for the rows of X with the posterior mean weights, or with the given weights
+        """
+        return self.rewardScale*(self.features(X) @ (self.mean if weights is None else weights))
+
+    def predictiveStd(self, X):
+        """
+        Posterior standard deviation of the expected reward for the rows of X
+        """
+        phi = self.features(X)
+        return self.rewardScale*np.sqrt(np.einsum('ij,jk,ik->i', phi, self.cov, phi))
+
+    def sampleWeights(self, generator: np.random.Generator):
+        """
+        Draw weights from the posterior (Thompson sampling)
+        """
+        try:
+            root = np.linalg.cholesky(self.cov)
+        except np.linalg.LinAlgError:
+            root = np.linalg.cholesky(self.cov + 1e-9*np.trace(self.cov)*np.eye(len(self.cov)))
+        return self.mean + root @ generator.standard_normal(len(self.mean))
@@ -0,0 +1,124 @@
+from bisect import bisect_right
+from zlib import crc32
+import math
+
+import numpy as np
+
+BUFFER_SIZE = 4096 #number of variates drawn at once
+MAX_UNIFORM = np.nextafter(1.0, 0.0) #keeps antithetic uniforms in [0, 1)
+
+
+class RandomStream:
+    """
+    Independent stream of random numbers for one component (arrivals, types, service times, routing, exploration).
+    Scalar variates are drawn from a numpy Generator in vectorized blocks and handed out one by one.
+    An antithetic stream returns 1-u for every uniform u and -z for every standard normal z of the regular stream with
+    the same seed, every other variate is derived from those so it is antithetic as well.
+    """
+    def __init__(self, seedSequence: np.random.SeedSequence, antithetic = False, bufferSize = BUFFER_SIZE):
+        self.generator = np.random.Generator(np.random.PCG64(seedSequence))
+        self.antithetic = antithetic
+        self.bufferSize = bufferSize
+        self.uniforms, self.uniformIndex = [], 0
+        self.normals, self.normalIndex = [], 0
+
+    def reseed(self, seedSequence: np.random.SeedSequence):
+        """
+        Continue with fresh variates from seedSequence, the buffered variates are dropped
+        """
+        self.generator = np.random.Generator(np.random.PCG64(seedSequence))
+        self.uniforms, self.uniformIndex = [], 0
+        self.normals, self.normalIndex = [], 0
+
+    def random(self, size = None):
+        """
+        Uniform variate(s) in [0, 1)
+        """
+        if size is not None:
+            u = self.generator.random(size)
+            return np.minimum(1 - u, MAX_UNIFORM) if self.antithetic else u
+        if self.uniformIndex == len(self.uniforms):
+            self.uniforms, self.uniformIndex = self.random(self.bufferSize).tolist(), 0
+        self.uniformIndex += 1
+        return self.uniforms[self.uniformIndex - 1]
+
+    def standardNormal(self, size = None):
+        if size is not None:
+            z = self.generator.standard_normal(size)
+            return -z if self.antithetic else z
+        if self.normalIndex == len(self.normals):
+            self.normals, self.normalIndex = self.standardNormal(self.bufferSize).tolist(), 0
+        self.normalIndex += 1
+        return self.normals[self.normalIndex - 1]
+
+    def normal(self, mu, sigma, size = None):
+        return mu + sigma*self.standardNormal(size)
+
+    def exponential(self, rate):
+        """
+        Exponential variate with the given rate (like random.expovariate)
+        """
+        return -math.log(1.0 - self.random())/rate
+
+    def geometric(self, p):
+        """
+        Number of Bernoulli(p) trials up to and including the first success
+        """
+        if p >= 1: return 1
+        return max(1, math.ceil(math.log(1.0 - self.random())/math.log(1.0 - p)))
+
+    def integers(self, low, high):
+        """
+        Uniform integer in [low, high)
+        """
+        return low + min(int(self.random()*(high - low)), high - low - 1)
+
+    def randint(self, a, b):
+        """
+        Uniform integer in [a, b] (like random.randint)
+        """
+        return self.integers(a, b + 1)
+
+    def choice(self, cumulativeWeights):
+        """
+        Index sampled with the probabilities given by the cumulative weights (like random.choices)
+        """
+        return min(bisect_right(cumulativeWeights, self.random()*cumulativeWeights[-1]), len(cumulativeWeights) - 1)
+
+
+class RandomStreams:
+    """
+    Named random streams derived from one seed. Every name gets its own stream, independent of the order in which the
+    streams are created, so two simulations with the same seed share e.g. their arrival stream even if they draw a
+    different number of routing variates (common random numbers).
+    """
+    def __init__(self, seed = None, antithetic = False):
+        """
+        Parameters
+        ----------
+        seed : int, optional
+            Root seed, fresh entropy is used when None
+        antithetic : bool
+            Create antithetic streams, pair a run with antithetic=True with a run with the same seed and antithetic=False
+        """
+        self.seedSequence = np.random.SeedSequence(seed)
+        self.antithetic = antithetic
+        self.streams = {}
+
+    def _seedSequence(self, name):
+        return np.random.SeedSequence(self.seedSequence.entropy, spawn_key=(crc32(name.encode()),))
+
+    def stream(self, name) -> RandomStream:
+        stream = self.streams.get(name)
+        if stream is None:
+            stream = self.streams[name] = RandomStream(self._seedSequence(name), self.antithetic)
+        return stream
+
+    def reseed(self, seed = None):
+        """
+        Switch to a new root seed, the existing streams are reseeded in place so the components keep using them. Used to
+        give a fork of a simulation its own future (see Environment.fork).
+        """
+        self.seedSequence = np.random.SeedSequence(seed)
+        for name, stream in self.streams.items():
+            stream.reseed(self._seedSequence(name))
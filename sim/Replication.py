@@ -0,0 +1,193 @@
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from sim.Environment import Environment
+from sim.LoadBalancer import LoadBalancer
+from sim.Source import ExponentialSource
+
+DEFAULT_REQUEST_TYPES = [(0.5,1,0.1,10), (0.5,2,0.2,10)] #(prob, mu, sigma, cancelTime)
+
+
+def computeReward(nProcessed, nCancelled, nServers, duration, processReward = 1, cancelReward = -10, serverReward = -300):
+    """
+    Reward (negative cost) of running nServers servers for duration seconds
+    """
+    return nProcessed * processReward + nCancelled * cancelReward + duration/60/60*nServers*serverReward
+
+
+class Scenario:
+    """
+    Specification of one simulation run, must be picklable so it can be sent to a worker process
+    """
+    def __init__(self, arrivalsPerSecond, nServers, requestTypes = DEFAULT_REQUEST_TYPES, loadBalancer = LoadBalancer, source = ExponentialSource,
+                 seed = None, stopTime = 3*60*60, processCost = 1, cancelCost = -10, serverCost = -300, antithetic = False):
+        """
+        Parameters
+        ----------
+        arrivalsPerSecond : float
+            Arrival rate of the source
+        nServers : int
+            Number of servers of the load balancer
+        requestTypes : list[tuple]
+            Request types like the sources expect, [(typeProb, typeMean, typeStd, timeLimit),...]
+        loadBalancer : type
+            LoadBalancer class, constructed as loadBalancer(nServers=nServers, environment=env)
+        source : type
+            Source class, constructed as source(arrivalsPerSecond, requestTypes, loadBalancer, env)
+        seed : int, optional
+            Root seed of the random streams of the environment, a fresh seed is drawn when None. Scenarios with the same
+            seed share their arrival, type and service time streams (common random numbers).
+        stopTime : float
+            Simulated duration in seconds
+        antithetic : bool
+            Use the antithetic streams of the seed
+        """
+        self.arrivalsPerSecond = arrivalsPerSecond
+        self.nServers = nServers
+        self.requestTypes = requestTypes
+        self.loadBalancer = loadBalancer
+        self.source = source
+        self.seed = seed
+        self.stopTime = stopTime
+        self.processCost, self.cancelCost, self.serverCost = processCost, cancelCost, serverCost
+        self.antithetic = antithetic
+
+    def __repr__(self):
+        return f"Scenario(arrivalsPerSecond={self.arrivalsPerSecond}, nServers={self.nServers}, loadBalancer={self.loadBalancer.__name__}, seed={self.seed}, stopTime={self.stopTime})"
+
+
+def runScenario(scenario: Scenario):
+    """
+    Run one scenario and return a compact summary dict. Only the streaming metrics of the environment are kept, the
+    totals are over the whole run as long as the load balancer does not start new periods.
+    """
+    startTime = time.perf_counter()
+    env = Environment(stopTime=scenario.stopTime, logMode="metrics", seed=scenario.seed, antithetic=scenario.antithetic)
+    env.registerMetric("requestWaitingTime", "mean")
+    env.registerMetric("totalTimeInSystem", "mean")
+    loadBalancer = scenario.loadBalancer(nServers=scenario.nServers, environment=env)
+    scenario.source(scenario.arrivalsPerSecond, scenario.requestTypes, loadBalancer, env)
+    env.run(debug=False)
+
+    metrics = env.getPeriodMetrics(["arrivalEvent", "requestProcessed", "requestCancelled", "requestWaitingTime", "totalTimeInSystem"])
+    return {
+        'arrivalsPerSecond': scenario.arrivalsPerSecond,
+        'nServers': scenario.nServers,
+        'seed': scenario.seed,
+        'arrivals': int(metrics['arrivalEvent']),
+        'processed': int(metrics['requestProcessed']),
+        'cancelled': int(metrics['requestCancelled']),
+        'meanWaitingTime': metrics['requestWaitingTime'],
+        'meanTimeInSystem': metrics['totalTimeInSystem'],
+        'cost': computeReward(metrics['requestProcessed'], metrics['requestCancelled'], scenario.nServers, scenario.stopTime, scenario.processCost, scenario.cancelCost, scenario.serverCost),
+        'wallTime': time.perf_counter() - startTime,
+    }
+
+
+def runReplications(scenarios, nWorkers = None, chunksize = 1, executor = None):
+    """
+    Run the scenarios on a pool of worker processes
+
+    Parameters
+    ----------
+    scenarios : list[Scenario]
+        The scenarios to run
+    nWorkers : int, optional
+        Number of worker processes, all cores by default. With one worker the scenarios run in this process.
+    chunksize : int
+        Number of scenarios sent to a worker at once, increase for many short scenarios
+    executor : concurrent.futures.Executor, optional
+        Reuse an existing executor instead of starting a new pool
+
+    Returns
+    -------
+    list of summary dicts (see runScenario), in the order of the scenarios
+    """
+    scenarios = list(scenarios)
+    if executor is not None:
+        return list(executor.map(runScenario, scenarios, chunksize=chunksize))
+    nWorkers = min(nWorkers or os.cpu_count() or 1, len(scenarios))
+    if nWorkers <= 1:
+        return [runScenario(scenario) for scenario in scenarios]
+    with ProcessPoolExecutor(max_workers=nWorkers) as pool:
+        return list(pool.map(runScenario, scenarios, chunksize=chunksize))
+
+
+def comparePaired(scenarioA: Scenario, scenarioB: Scenario, nReplications, seed = 0, antithetic = True, nWorkers = None):
+    """
+    Estimate the mean cost difference between two scenarios with common random numbers: replication r of both scenarios
+    uses seed + r. With antithetic=True every replication is the average of a regular and an antithetic run.
+
+    Returns
+    -------
+    (mean of cost A - cost B, standard error of the mean)
+    """
+    runs = []
+    for r in range(nReplications):
+        for isAntithetic in ((False, True) if antithetic else (False,)):
+            for scenario in (scenarioA, scenarioB):
+                run = copy.copy(scenario)
+                run.seed, run.antithetic = seed + r, isAntithetic
+                runs.append(run)
+    costs = np.array([result['cost'] for result in runReplications(runs, nWorkers=nWorkers)])
+    differences = (costs[0::2] - costs[1::2]).reshape(nReplications, -1).mean(axis=1) #average the antithetic pair
+    standardError = differences.std(ddof=1)/np.sqrt(nReplications) if nReplications > 1 else np.nan
+    return differences.mean(), standardError
+
+
+_forkPrefix = None #(environment, objects) the forked workers of runForks continue from
+
+
+def _runForkedContinuation(continuation):
+    environment, objects = _forkPrefix #this process is a copy-on-write fork of the prefix, it can be changed freely
+    return continuation(environment, *objects)
+
+
+def _runRestoredContinuation(snapshot, continuation):
+    restored = Environment.restore(snapshot)
+    return continuation(*(restored if isinstance(restored, tuple) else (restored,)))
+
+
+def runForks(environment: Environment, continuations, objects = (), nWorkers = None):
+    """
+    Run what-if continuations from the current state of a simulation, e.g. one per candidate number of servers after
+    a shared warm-up prefix. Where os.fork is available every continuation runs in a freshly forked process that
+    shares the memory of the prefix copy-on-write, so nothing is copied up front. Otherwise the prefix is sent to the
+    workers as a snapshot (see Environment.snapshot).
+
+    Parameters
+    ----------
+    environment : Environment
+        The prefix, paused between events (e.g. with run(until=...))
+    continuations : list[callable]
+        Picklable callables continuation(environment, *objects) that change and run their copy and return a result
+    objects : tuple
+        Objects of the simulation the continuations need, like the load balancer and source
+    nWorkers : int, optional
+        Number of processes, all cores by default. With one worker the continuations run in this process on forks.
+
+    Returns
+    -------
+    list of the results of the continuations, in order
+    """
+    global _forkPrefix
+    continuations = list(continuations)
+    nWorkers = min(nWorkers or os.cpu_count() or 1, len(continuations))
+    if nWorkers <= 1:
+        snapshot = environment.snapshot(*objects)
+        return [_runRestoredContinuation(snapshot, continuation) for continuation in continuations]
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _forkPrefix = (environment, tuple(objects))
+        try: #one task per child, so every continuation starts from an untouched fork of the prefix
+            with multiprocessing.get_context('fork').Pool(nWorkers, maxtasksperchild=1) as pool:
+                return pool.map(_runForkedContinuation, continuations, chunksize=1)
+        finally:
+            _forkPrefix = None
+    snapshot = environment.snapshot(*objects)
+    with ProcessPoolExecutor(max_workers=nWorkers) as pool:
+        return list(pool.map(_runRestoredContinuation, [snapshot]*len(continuations), continuations))
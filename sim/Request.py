@@ -1,20 +1,35 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
-from uuid import uuid4
 
 if TYPE_CHECKING: #only for typechecking
     from sim.Server import Server 
+    from sim.Environment import Environment
 
-from sim.Environment import Environment
 from sim.Event import Event
 
 class Request:
+    __slots__ = ('type', 'processingTime', 'timeRequirement', 'environment', 'isWaiting', 'isBeingProcessed', 'isProcessed',
+                 'isCancelled', 'id', 'waitingStartTime', 'processingStartTime', 'waitingTime', 'totalTimeInSystem',
+                 'assignedServer', 'deadlineEvent', 'finishEvent')
 
     def __init__(self, type, processingTime, timeRequirement, environment: Environment, id=None):
         '''
         type: type of the request
         processingTime: the processing time of the request, sampled from Gaussian distribution
+        id: unique integer id, taken from the environment counter if not provided
         '''
+        self._initialize(type, processingTime, timeRequirement, environment, id)
+
+    @classmethod
+    def create(cls, type, processingTime, timeRequirement, environment: Environment, id=None) -> Request:
+        '''
+        Create a request, reusing a finished request object if the environment recycles requests
+        '''
+        if environment.requestPool is not None:
+            return environment.requestPool.acquire(type, processingTime, timeRequirement, environment, id)
+        return cls(type, processingTime, timeRequirement, environment, id)
+
+    def _initialize(self, type, processingTime, timeRequirement, environment: Environment, id=None):
         self.type, self.processingTime = type, processingTime
         self.timeRequirement = timeRequirement
         self.environment = environment
@@ -22,7 +37,7 @@ class Request:
         self.isBeingProcessed = False
         self.isProcessed = False
         self.isCancelled = False
-        self.id = uuid4() if id is None else id
+        self.id = environment.newRequestId() if id is None else id
 
         self.waitingStartTime = None
         self.processingStartTime = None
@@ -31,22 +46,35 @@ class Request:
         self.totalTimeInSystem = 0
 
         self.assignedServer = None
+        self.deadlineEvent: Event = None #pending cancelRequest event
+        self.finishEvent: Event = None #pending finishProcessing event
 
         if self.processingTime < 0:
             raise ValueError("Request was provided a negative processingtime")
 
         self.startWaiting() #request starts waiting when created
 
+    def _release(self):
+        '''
+        Hand the request back to the pool once it is finished, no events or servers refer to it anymore
+        '''
+        if self.environment.requestPool is not None:
+            self.assignedServer = None
+            self.deadlineEvent = self.finishEvent = None
+            self.environment.requestPool.release(self)
+
     def assignToServer(self, server: Server):
         self.assignedServer = server
 
     def cancelRequest(self):
         if self.isProcessed or self.isCancelled:
             return #if processed the request cannot be cancelled anymore
+        self.environment.cancelEvent(self.deadlineEvent) #no-op when the deadline itself triggered the cancellation
         if self.assignedServer is not None:    
             self.assignedServer.cancelRequest(self)
         self.isCancelled = True
         self.environment.logData("requestCancelled")
+        self._release()
         
     def startWaiting(self):
         '''
@@ -55,9 +83,9 @@ class Request:
         self.waitingStartTime = self.environment.currentTime
         self.isWaiting = True
         requestCancelTime = self.environment.currentTime + self.timeRequirement
-        requestCancelledEvent = Event(requestCancelTime, self.cancelRequest, "cancelRequest")
+        self.deadlineEvent = Event(requestCancelTime, self.cancelRequest, "cancelRequest")
         self.environment.logData("requestStartWaiting")
-        self.environment.scheduleEvent(requestCancelledEvent)
+        self.environment.scheduleEvent(self.deadlineEvent)
     
     def endWaiting(self):
         '''
@@ -73,13 +101,39 @@ class Request:
         self.endWaiting()
         self.isBeingProcessed = True
         requestProcessingEndTime = self.environment.currentTime + self.processingTime
-        self.environment.scheduleEvent(Event(requestProcessingEndTime, self.finishProcessing, 'requestFinishProcessing', prio=2))
+        self.finishEvent = Event(requestProcessingEndTime, self.finishProcessing, 'requestFinishProcessing', prio=2)
+        self.environment.scheduleEvent(self.finishEvent)
 
     def finishProcessing(self):
+        self.environment.cancelEvent(self.deadlineEvent) #the deadline can no longer be missed
         self.assignedServer.currentRequestFinished()
         self.isBeingProcessed = False
         self.isProcessed = True
         self.totalTimeInSystem = self.environment.currentTime - self.waitingStartTime
         self.environment.logData("requestProcessed")
         self.environment.logData("totalTimeInSystem", self.totalTimeInSystem)
-        
+        self._release()
+
+
+class RequestPool:
+    """
+    Free-list of finished Request objects, reusing them avoids an allocation (and the garbage collection) per request.
+    Only use this when no code keeps references to requests after they are processed or cancelled.
+    """
+    def __init__(self, maxSize = 100000):
+        self.maxSize = maxSize
+        self.free = []
+
+    def acquire(self, type, processingTime, timeRequirement, environment: Environment, id=None) -> Request:
+        if self.free:
+            request = self.free.pop()
+            request._initialize(type, processingTime, timeRequirement, environment, id)
+            return request
+        return Request(type, processingTime, timeRequirement, environment, id)
+
+    def release(self, request: Request):
+        if len(self.free) < self.maxSize:
+            self.free.append(request)
+
+    def __len__(self):
+        return len(self.free)
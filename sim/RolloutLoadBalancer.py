@@ -0,0 +1,114 @@
+from sim.LoadBalancer import LoadBalancer
+from sim.GELoadBalancer import registerPeriodAggregations, aggregatePeriodContext
+from sim.Replication import computeReward, runForks
+import functools
+import os
+import time
+import numpy as np
+
+ROLLOUT_STEPS = 20 #the wall-clock budget is checked this many times per rollout
+
+
+def rollout(nServers, seed, horizon, deadline, rewards, environment, loadBalancer):
+    """
+    Continuation for runForks: run a fork of the simulation with nServers servers for horizon seconds, in ROLLOUT_STEPS
+    steps, until the wall-clock time (time.time()) passes deadline
+
+    Returns
+    -------
+    list of (simulated duration, requests processed, requests cancelled) after every finished step
+    """
+    environment.random.reseed(seed) #a future of its own instead of the one the real simulation will see
+    loadBalancer.isRollout = True
+    loadBalancer._setNumberOfServers(nServers)
+    startTime = environment.currentTime
+    steps = []
+    while len(steps) < ROLLOUT_STEPS and time.time() < deadline:
+        duration = horizon*(len(steps) + 1)/ROLLOUT_STEPS #the same step ends for every candidate
+        environment.run(debug=False, until=startTime + duration)
+        metrics = environment.getPeriodMetrics(['requestProcessed', 'requestCancelled'])
+        steps.append((duration, metrics['requestProcessed'], metrics['requestCancelled']))
+    return steps
+
+
+def compareRollouts(candidates, results, rewards):
+    """
+    Rewards of the candidates over the simulated duration every rollout reached. Rollouts the wall-clock budget stopped
+    early are cut to the same length, so no candidate is judged on the transient after the fork alone while another is
+    judged on the full horizon. Candidates without a finished step are left out.
+
+    Returns
+    -------
+    (list of (reward, nServers), common duration), ([], 0) when no rollout finished a step
+    """
+    finished = [(n, steps) for n, steps in zip(candidates, results) if steps]
+    if not finished: return [], 0
+    nSteps = min(len(steps) for _, steps in finished)
+    duration = finished[0][1][nSteps - 1][0]
+    return [(computeReward(steps[nSteps - 1][1], steps[nSteps - 1][2], n, duration, *rewards), n) for n, steps in finished], duration
+
+
+class RolloutLoadBalancer(LoadBalancer):
+    """
+    Lookahead load balancer: at the end of every period the simulation is forked once per candidate number of servers
+    (see runForks) and every fork is run ahead for horizon seconds. The candidate with the best simulated reward is
+    used for the next period. Decisions need no training periods, their quality is bought with compute: the number of
+    candidates grows with the number of worker processes and the rollouts stop at a fixed wall-clock budget.
+    The forks are reseeded, all with the same seed per decision so the candidates are compared on common random
+    numbers. Arrivals a source sampled ahead (BatchedSource, NHPPSource) are kept by the forks.
+    Plugs into ArrivalSchedule or DecisionSchedule like the other load balancers.
+    """
+    def __init__(self, nServers, environment, processReward=1, cancelReward=-10, serverReward=-300, nServerRange = (1,40), periodLength =1*60*60, horizon = None, timeBudget = 10.0, nWorkers = None, candidatesPerWorker = 2, drainMode = 'drain'):
+        """
+            nServerRange: the candidates are taken from range(*nServerRange), nearest to the current number of servers
+            horizon: simulated seconds per rollout, periodLength by default
+            timeBudget: wall-clock seconds all rollouts of one decision may take together
+            nWorkers: number of processes for the rollouts, all cores by default
+            candidatesPerWorker: number of candidates per worker process
+        """
+        self.agg = {'arrivalEvent': np.sum, 'requestProcessed': np.sum, 'requestCancelled': np.sum}
+        registerPeriodAggregations(environment, self.agg) #before the first values are logged
+        super().__init__(nServers, environment, drainMode=drainMode)
+        self.rewards = (processReward, cancelReward, serverReward)
+        self.nServerRange = nServerRange
+        self.periodLength = periodLength
+        self.horizon = periodLength if horizon is None else horizon
+        self.timeBudget = timeBudget
+        self.nWorkers = nWorkers or os.cpu_count() or 1
+        self.candidatesPerWorker = candidatesPerWorker
+        self.rolloutStream = environment.random.stream('rollout')
+        self.currentPeriod = 0
+        self.isRollout = False #set on the forks, they keep their number of servers
+
+    def getCandidates(self):
+        """
+        The nWorkers*candidatesPerWorker server counts in nServerRange that are nearest to the current number of servers
+        """
+        nCandidates = self.nWorkers*self.candidatesPerWorker
+        candidates = sorted(range(*self.nServerRange), key=lambda n: (abs(n - self.nServers), n))[:nCandidates]
+        return sorted(candidates)
+
+    def getNextPeriodNumberOfServers(self):
+        horizon = min(self.horizon, self.environment.stopTime - self.environment.currentTime)
+        if horizon <= 0: return self.nServers
+        candidates = self.getCandidates()
+        seed = self.rolloutStream.integers(0, 2**31)
+        deadline = time.time() + self.timeBudget
+        continuations = [functools.partial(rollout, n, seed, horizon, deadline, self.rewards) for n in candidates]
+        results = runForks(self.environment, continuations, (self,), nWorkers=self.nWorkers)
+        candidateRewards, duration = compareRollouts(candidates, results, self.rewards)
+        if not candidateRewards: return self.nServers #no rollout got any time
+        reward, nServers = max(candidateRewards)
+        self.environment.logData("rolloutReward", reward*horizon/duration) #extrapolated to the horizon
+        self.environment.logData("rolloutAction", nServers)
+        return nServers
+
+    def onPeriodEnd(self):
+        if self.isRollout: return
+        context = aggregatePeriodContext(self.environment, self.agg)
+        self.environment.resetPeriod()
+        reward = computeReward(context['requestProcessed'], context['requestCancelled'], self.nServers, self.periodLength, *self.rewards)
+        self.environment.logData("reward", reward)
+        self._setNumberOfServers(self.getNextPeriodNumberOfServers())
+        self.currentPeriod += 1
+        return context
@@ -1,6 +1,5 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
-from uuid import uuid1
 from collections import OrderedDict
 
 if TYPE_CHECKING: #only for typechecking
@@ -10,6 +9,7 @@ from sim.Environment import Environment
 import math
 
 class Queue:
+    __slots__ = ('id', 'length', 'size', 'queue', 'environment')
 
     def __init__(self, environment: Environment, length=math.inf, id=0):
         '''
@@ -21,9 +21,6 @@ class Queue:
         self.queue: OrderedDict = OrderedDict()
         self.environment = environment
 
-        if 'totalInQueue' not in self.environment.log.keys():
-            self.environment.logData("totalInQueue", 0)
-
     
     def remove(self, id: str):
         if id in self.queue.keys():
@@ -32,8 +29,7 @@ class Queue:
         else:
             return ValueError(f"Key {id} not in queue")
         
-        currentTotalInQueue = self.environment.log["totalInQueue"][-1]
-        self.environment.logData('totalInQueue', currentTotalInQueue-1)
+        self.environment.changeLevel('totalInQueue', -1) #time averaged over the period, see Environment.changeLevel
 
     def push(self, request: Request):
         if request.isCancelled: return
@@ -41,12 +37,20 @@ class Queue:
             self.size += 1
             self.queue[request.id] = request
 
-            currentTotalInQueue = self.environment.log["totalInQueue"][-1]
-            self.environment.logData('totalInQueue', currentTotalInQueue+1)
+            self.environment.changeLevel('totalInQueue', 1)
         else:
             request.cancelRequest()
         self.logSize(self.size)
 
+    def pullAll(self) -> list:
+        """
+        Retrieve all waiting requests, in queue order
+        """
+        requests = []
+        while self.size > 0:
+            requests.append(self.pull())
+        return requests
+
     def pull(self) -> Request:
         """
         Retrieve next request
@@ -58,8 +62,7 @@ class Queue:
         self.size -= 1
         self.logSize(self.size)
 
-        currentTotalInQueue = self.environment.log["totalInQueue"][-1]
-        self.environment.logData('totalInQueue', currentTotalInQueue-1)
+        self.environment.changeLevel('totalInQueue', -1)
         return nextRequest
 
     def logSize(self, size):
@@ -72,14 +75,34 @@ class Queue:
         return self.size
 
 class Server:
+    __slots__ = ('id', 'queue', 'environment', 'nowServing', 'onLoadChange', 'busyTime', 'busySince')
+
     def __init__(self, environment: Environment, id=None):
         '''
         environment: the simulation environment
+        id: integer id, taken from the environment counter if not provided
         '''
-        self.id = id if id is not None else uuid1()
+        self.id = id if id is not None else environment.newServerId()
         self.queue: Queue = Queue(environment, id=self.id)
         self.environment: Environment = environment
         self.nowServing: Request = None
+        self.onLoadChange = None #called with the server when its load changes, used by load balancers that index the servers by load
+        self.busyTime = 0.0 #total time spent processing requests, up to busySince
+        self.busySince = None #start of the current busy stretch, None when idle
+
+    @property
+    def load(self):
+        """
+        Number of requests at the server, waiting or being processed
+        """
+        return self.queue.size + (self.nowServing is not None)
+
+    def getBusyTime(self):
+        """
+        Total time spent processing requests up to the current time
+        """
+        if self.busySince is None: return self.busyTime
+        return self.busyTime + self.environment.currentTime - self.busySince
         
 
     def assignRequest(self, request: Request):
@@ -90,16 +113,22 @@ class Server:
         if self.nowServing is None:
             request.startProcessing()
             self.nowServing = request
+            self.busySince = self.environment.currentTime
+            self.environment.changeLevel('numberBusy', 1)
         else:
             self.queue.push(request)
+        if self.onLoadChange is not None: self.onLoadChange(self)
 
     def cancelRequest(self, request: Request):
         """
-        removes the request from the queue
+        removes the request from the queue, or stops processing it if it is being served
         """
-        self.queue.remove(request.id)
         if self.nowServing is not None and self.nowServing.id == request.id:
+            self.environment.cancelEvent(request.finishEvent) #the request will not finish anymore
             self.currentRequestFinished()
+        else:
+            self.queue.remove(request.id)
+            if self.onLoadChange is not None: self.onLoadChange(self)
 
     def currentRequestFinished(self):
         """
@@ -107,6 +136,11 @@ class Server:
         """
         self.nowServing = None
         self.startServingNext()
+        if self.nowServing is None and self.busySince is not None: #idle
+            self.busyTime += self.environment.currentTime - self.busySince
+            self.busySince = None
+            self.environment.changeLevel('numberBusy', -1)
+        if self.onLoadChange is not None: self.onLoadChange(self)
 
     def startServingNext(self):
         '''
@@ -7,6 +7,8 @@ from sim.Environment import Environment
 from sim.Event import Event 
 from sim.Request import Request
 import random
+import itertools
+import math
         
 import numpy as np
 
@@ -30,17 +32,32 @@ class EventClock:
         self._scheduleNext() #initialize
     
     def _onEventCall(self):
+        self._scheduleNext() #before the method, so a snapshot taken in the method contains the next tick
         self.method()
-        self._scheduleNext()  
     
     def _scheduleNext(self):
         nextTime = self.environment.currentTime + self.interval
         nextEvent = Event(nextTime, self._onEventCall, "EventClock")
         self.environment.scheduleEvent(nextEvent)   
 
+
+class ArrivalStream:
+    """
+    Stream of the arrivals of a source for Environment.addStream, every next() asks the source for its next arrival
+    (time, payload) given its current state, or None when it has none for now
+    """
+    def __init__(self, nextArrival):
+        self.nextArrival = nextArrival
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.nextArrival()
+
     
 class Source():
-    def __init__(self, arrivalsPerSecond: float, requestTypes, loadBalancer: LoadBalancer, environment: Environment, requestProb = DEFAULT_REQUEST_PROB): #requestTypes: list[tuple]
+    def __init__(self, arrivalsPerSecond: float, requestTypes, loadBalancer: LoadBalancer, environment: Environment, requestProb = DEFAULT_REQUEST_PROB, geometricSkip = False, useStream = False): #requestTypes: list[tuple]
         """
         Parameters
         ----------
@@ -54,38 +71,92 @@ class Source():
             The LoadBalancer instance that this source is connected to.
         environment: Environment
             The Environment instance that this source is connected to.
+        geometricSkip: bool
+            Instead of a clock event every samplingInterval with an arrival with probability requestProb, draw the
+            geometric number of ticks until the next arrival and only schedule the arrivals. The arrival times have
+            the same distribution, with about requestProb times as many events.
+        useStream: bool
+            Generate the arrivals as a stream of the environment (see Environment.addStream) instead of events, implies
+            geometricSkip
         """
         self.requestProb = requestProb
         assert self.requestProb <= 1.0, "Requestprob > 1"
         self.requestTypes = requestTypes
         self.loadBalancer = loadBalancer
         self.environment = environment
+        self.arrivalStream = environment.random.stream('arrivals')
+        self.typeStream = environment.random.stream('types')
+        self.serviceStream = environment.random.stream('service')
+        self.geometricSkip = geometricSkip or useStream
         self.samplingInterval = self.requestProb/arrivalsPerSecond
-        self.clock = EventClock(interval = self.samplingInterval, method=self._onSampleEvent, environment=environment)
+        self.clock = None if self.geometricSkip else EventClock(interval = self.samplingInterval, method=self._onSampleEvent, environment=environment)
+        self.lastTickTime = environment.currentTime #geometric skip: the tick lattice continues from here
+        self.nextArrivalEvent = None #geometric skip: the scheduled arrival
+        self.streamId = None #geometric skip: the arrival stream in the environment
         self.setArrivalsPerSecond(arrivalsPerSecond=arrivalsPerSecond)
         self.requestTypeProbs = [requestType[0] for requestType in self.requestTypes]
         self.requestTypeIndices = list(range(0,len(self.requestTypes)))
+        self.cumulativeTypeProbs = list(itertools.accumulate(self.requestTypeProbs))
         self.requestId = 0
         assert sum([requestType[0] for requestType in self.requestTypes]) == 1.0, "typeProbs of provides requestTypes must sum to 1"
+        if useStream:
+            self.streamId = environment.addStream(ArrivalStream(self._nextArrival), self._onStreamArrival)
+        elif geometricSkip:
+            self._scheduleNextArrival()
 
     def _getReqId(self):
-        self.requestId +=1
-        return self.requestId
+        self.requestId +=1 #number of requests generated by this source
+        return self.environment.newRequestId() #ids are unique over all sources
 
     def setArrivalsPerSecond(self, arrivalsPerSecond):
         self.environment.logData('arrivalsPerSecond', arrivalsPerSecond)
         self.arrivalsPerSecond = arrivalsPerSecond
-        self.samplingInterval = self.requestProb/arrivalsPerSecond
-        self.clock.interval = self.samplingInterval
+        newInterval = self.requestProb/arrivalsPerSecond
+        if self.clock is not None:
+            self.samplingInterval = newInterval
+            self.clock.interval = self.samplingInterval
+        elif self.nextArrivalEvent is not None or self.streamId is not None:
+            #the clock would keep its next tick, which was planned with the old interval, and use the new interval from there.
+            #The ticks up to now had no arrival, and as the ticks are independent the pending arrival is redrawn from the next tick on
+            if self.nextArrivalEvent is not None: self.environment.cancelEvent(self.nextArrivalEvent)
+            nextTickTime = self.lastTickTime + (math.floor((self.environment.currentTime - self.lastTickTime)/self.samplingInterval) + 1)*self.samplingInterval
+            self.samplingInterval = newInterval
+            self.lastTickTime = nextTickTime - self.samplingInterval
+            if self.streamId is not None:
+                self.environment.refreshStream(self.streamId)
+            else:
+                self._scheduleNextArrival()
+        else:
+            self.samplingInterval = newInterval
+
+    def _nextArrivalTime(self):
+        nTicks = self.arrivalStream.geometric(self.requestProb) #ticks until and including the next arrival
+        return self.lastTickTime + nTicks*self.samplingInterval
+
+    def _scheduleNextArrival(self):
+        self.nextArrivalEvent = Event(self._nextArrivalTime(), self._onArrivalEvent, "Geometric arrival event")
+        self.environment.scheduleEvent(self.nextArrivalEvent)
+
+    def _onArrivalEvent(self):
+        self.lastTickTime = self.nextArrivalEvent.time
+        self.loadBalancer.handleRequestArrival(self._generateRequest())
+        self._scheduleNextArrival()
+
+    def _nextArrival(self):
+        return (self._nextArrivalTime(), None)
+
+    def _onStreamArrival(self, payload):
+        self.lastTickTime = self.environment.currentTime
+        self.loadBalancer.handleRequestArrival(self._generateRequest())
 
     def _generateRequest(self):
         """
         Sample the request type from the provided request types and create the Request object.
         """
-        sampledRequestIndice = random.choices(self.requestTypeIndices, weights = self.requestTypeProbs)[0]
+        sampledRequestIndice = self.typeStream.choice(self.cumulativeTypeProbs)
         _, typeMean, typeStd, typeTimeLimit = self.requestTypes[sampledRequestIndice]
-        requestProcessingTime = random.gauss(mu=typeMean, sigma=typeStd)
-        request = Request(type=sampledRequestIndice, processingTime = requestProcessingTime, timeRequirement=typeTimeLimit, environment = self.environment, id = self._getReqId())
+        requestProcessingTime = self.serviceStream.normal(typeMean, typeStd)
+        request = Request.create(type=sampledRequestIndice, processingTime = requestProcessingTime, timeRequirement=typeTimeLimit, environment = self.environment, id = self._getReqId())
         self.environment.logData("requestType", sampledRequestIndice)
         return request
 
@@ -95,7 +166,7 @@ class Source():
         This method is invoked when the sample event is executed and samples whether a request arrives and 
         creates the Request object and sends it to the loadbalancer.
         """
-        invokeArrival = (random.uniform(0,1) < self.requestProb)
+        invokeArrival = (self.arrivalStream.random() < self.requestProb)
         if self.environment.debug: self.environment.logData("sampleEvent")
         if invokeArrival: 
             request = self._generateRequest()
@@ -105,7 +176,7 @@ class ExponentialSource():
     """
     Use exonential interarrival time 
     """
-    def __init__(self, arrivalsPerSecond: float, requestTypes, loadBalancer: LoadBalancer, environment: Environment, requestProb = DEFAULT_REQUEST_PROB): #requestTypes: list[tuple]
+    def __init__(self, arrivalsPerSecond: float, requestTypes, loadBalancer: LoadBalancer, environment: Environment, requestProb = DEFAULT_REQUEST_PROB, useStream = False): #requestTypes: list[tuple]
         """
         Parameters
         ----------
@@ -119,21 +190,31 @@ class ExponentialSource():
             The LoadBalancer instance that this source is connected to.
         environment: Environment
             The Environment instance that this source is connected to.
+        useStream: bool
+            Generate the arrivals as a stream of the environment (see Environment.addStream) instead of events
         """
         self.requestTypes = requestTypes
         self.loadBalancer = loadBalancer
         self.environment = environment
+        self.arrivalStream = environment.random.stream('arrivals')
+        self.typeStream = environment.random.stream('types')
+        self.serviceStream = environment.random.stream('service')
         self.setArrivalsPerSecond(arrivalsPerSecond=arrivalsPerSecond)
         self.requestTypeProbs = [requestType[0] for requestType in self.requestTypes]
         self.requestTypeIndices = list(range(0,len(self.requestTypes)))
+        self.cumulativeTypeProbs = list(itertools.accumulate(self.requestTypeProbs))
         self.requestId = 0
         assert sum(self.requestTypeProbs) == 1.0, "typeProbs of provides requestTypes must sum to 1"
 
-        self._onSampleEvent() #initialize
+        if useStream:
+            self.lastArrivalTime = None #the first arrival is at the current time
+            self.streamId = environment.addStream(ArrivalStream(self._nextArrival), self._onStreamArrival)
+        else:
+            self._onSampleEvent() #initialize
 
     def _getReqId(self):
-        self.requestId +=1
-        return self.requestId
+        self.requestId +=1 #number of requests generated by this source
+        return self.environment.newRequestId() #ids are unique over all sources
 
     def setArrivalsPerSecond(self, arrivalsPerSecond):
         self.arrivalsPerSecond = arrivalsPerSecond
@@ -143,10 +224,10 @@ class ExponentialSource():
         """
         Sample the request type from the provided request types and create the Request object.
         """
-        sampledRequestIndice = random.choices(self.requestTypeIndices, weights = self.requestTypeProbs)[0]
+        sampledRequestIndice = self.typeStream.choice(self.cumulativeTypeProbs)
         _, typeMean, typeStd, typeTimeLimit = self.requestTypes[sampledRequestIndice]
-        requestProcessingTime = random.gauss(mu=typeMean, sigma=typeStd)
-        request = Request(type=sampledRequestIndice, processingTime = requestProcessingTime, timeRequirement=typeTimeLimit, environment = self.environment, id = self._getReqId())
+        requestProcessingTime = self.serviceStream.normal(typeMean, typeStd)
+        request = Request.create(type=sampledRequestIndice, processingTime = requestProcessingTime, timeRequirement=typeTimeLimit, environment = self.environment, id = self._getReqId())
         self.environment.logData("requestType", sampledRequestIndice)
         return request
     
@@ -158,30 +239,52 @@ class ExponentialSource():
         request = self._generateRequest()
         self.loadBalancer.handleRequestArrival(request)
 
-        nextInterArrival = random.expovariate(self.arrivalsPerSecond)
+        nextInterArrival = self.arrivalStream.exponential(self.arrivalsPerSecond)
 
         nextSampleEvent =  Event(self.environment.currentTime + nextInterArrival, self._onSampleEvent, "Exponential sample event")
         self.environment.scheduleEvent(nextSampleEvent)
 
+    def _nextArrival(self):
+        if self.lastArrivalTime is None: return (self.environment.currentTime, None)
+        return (self.lastArrivalTime + self.arrivalStream.exponential(self.arrivalsPerSecond), None)
+
+    def _onStreamArrival(self, payload):
+        self.lastArrivalTime = self.environment.currentTime
+        if self.environment.debug: self.environment.logData("sampleEvent")
+        self.loadBalancer.handleRequestArrival(self._generateRequest())
+
 class BatchedSource():
     """
-    Generate all requests for a period in a vectorized way
+    Generate all requests for a period in a vectorized way. The arrivals of a period are kept in arrays and only the next
+    arrival is in the event queue, so the queue does not grow with the number of arrivals per period.
     """
-    def __init__(self, arrivalsPerSecond: float, requestTypes, loadBalancer: LoadBalancer, environment: Environment, periodLength: float, requestProb = DEFAULT_REQUEST_PROB):
+    def __init__(self, arrivalsPerSecond: float, requestTypes, loadBalancer: LoadBalancer, environment: Environment, periodLength: float, requestProb = DEFAULT_REQUEST_PROB, useStream = False):
+        """
+        useStream: bool
+            Feed the arrivals to the environment as a stream (see Environment.addStream) instead of events
+        """
         self.requestProb = requestProb
         assert self.requestProb <= 1.0, "Requestprob > 1"
         self.requestTypes = requestTypes
         self.loadBalancer = loadBalancer
         self.environment = environment
         self.periodLength = periodLength
+        self.arrivalStream = environment.random.stream('arrivals')
+        self.typeStream = environment.random.stream('types')
+        self.serviceStream = environment.random.stream('service')
         self.clock = EventClock(interval = self.periodLength, method=self._onSampleEvent, environment=environment)
         self.requestTypeProbs = [requestType[0] for requestType in self.requestTypes]
         self.requestTypeIndices = list(range(0,len(self.requestTypes)))
+        self.cumulativeTypeProbs = np.cumsum(self.requestTypeProbs)
+        self.typeMeans, self.typeStds, self.typeTimeLimits = (np.array([requestType[i] for requestType in self.requestTypes], dtype=float) for i in (1, 2, 3))
         self.setArrivalsPerSecond(arrivalsPerSecond=arrivalsPerSecond)
         self.requestId = 0
+        self.arrivalTimes, self.types, self.processingTimes, self.timeLimits = np.empty(0), np.empty(0, dtype=np.int64), np.empty(0), np.empty(0) #arrivals of the current period
+        self.nextArrival = 0 #index of the next arrival in the arrays
 
-        assert len(requestTypes) == 2, "This source only works with two requesttypes"
-        assert sum([requestType[0] for requestType in self.requestTypes]) == 1.0, "typeProbs of provides requestTypes must sum to 1"
+        assert abs(sum(self.requestTypeProbs) - 1.0) < 1e-9, "typeProbs of provides requestTypes must sum to 1"
+        self.streamId = environment.addStream(ArrivalStream(self._nextArrival), self._onStreamArrival) if useStream else None
+        self._onSampleEvent() #first period
 
     def setArrivalsPerSecond(self, arrivalsPerSecond):
         self.arrivalsPerSecond = arrivalsPerSecond
@@ -189,26 +292,224 @@ class BatchedSource():
         self.nSamplesPerPeriod = round(self.periodLength/self.samplingInterval)
 
     def _getReqId(self):
-        self.requestId +=1
-        return self.requestId
+        self.requestId +=1 #number of requests generated by this source
+        return self.environment.newRequestId() #ids are unique over all sources
 
-    def _generateRequests(self, requestTypeIndex, requestTimes):
-        _, typeMean, typeStd, typeTimeLimit = self.requestTypes[requestTypeIndex]
-        requestProcessingTimes = np.random.normal(typeMean, typeStd, len(requestTimes))
-        for t, requestProcessingTime in zip(requestTimes,requestProcessingTimes) :
-            e = Event(t, lambda: self.loadBalancer.handleRequestArrival(Request(type=requestTypeIndex, processingTime = requestProcessingTime, timeRequirement=typeTimeLimit, environment = self.environment, id = self._getReqId())))
-            self.environment.scheduleEvent(e)
+    def _generateRequests(self, startTime):
+        """
+        Sample the arrival times, types, processing times and time limits of the requests of the period starting at startTime
+        """
+        samplingTimes = startTime + np.arange(0,self.periodLength, self.samplingInterval)
+        samples = self.arrivalStream.random(len(samplingTimes))
+        requestTimes = samplingTimes[samples < self.requestProb]
+        requestTypes = np.searchsorted(self.cumulativeTypeProbs, self.typeStream.random(len(requestTimes))*self.cumulativeTypeProbs[-1], side='right')
+        requestTypes = np.minimum(requestTypes, len(self.requestTypes) - 1)
+        processingTimes = self.typeMeans[requestTypes] + self.typeStds[requestTypes]*self.serviceStream.standardNormal(len(requestTimes))
+        return requestTimes, requestTypes, processingTimes, self.typeTimeLimits[requestTypes]
+
+    def _scheduleNextArrival(self):
+        if self.nextArrival < len(self.arrivalTimes):
+            self.environment.scheduleEvent(Event(self.arrivalTimes.item(self.nextArrival), self._onArrivalEvent, "Batched arrival event"))
+
+    def _onArrivalEvent(self):
+        i = self.nextArrival
+        self.nextArrival += 1
+        self._scheduleNextArrival()
+        request = Request.create(type=self.types.item(i), processingTime=self.processingTimes.item(i), timeRequirement=self.timeLimits.item(i), environment=self.environment, id=self._getReqId())
+        self.loadBalancer.handleRequestArrival(request)
+
+    def _nextArrival(self):
+        return (self.arrivalTimes.item(self.nextArrival), None) if self.nextArrival < len(self.arrivalTimes) else None
+
+    def _onStreamArrival(self, payload):
+        i = self.nextArrival
+        self.nextArrival += 1
+        request = Request.create(type=self.types.item(i), processingTime=self.processingTimes.item(i), timeRequirement=self.timeLimits.item(i), environment=self.environment, id=self._getReqId())
+        self.loadBalancer.handleRequestArrival(request)
 
     def _onSampleEvent(self):
-        samplingTimes = self.environment.currentTime + np.arange(0,self.periodLength, self.samplingInterval)
-        samples = np.random.rand(self.nSamplesPerPeriod)
-        requestTimes = samplingTimes[samples < self.requestProb]
-        typeOneProb = self.requestTypeProbs[0]
-        requestTypes = (np.random.rand(len(requestTimes)) < typeOneProb).astype(int)
-        requestTypeOneTimes = requestTimes[requestTypes == 0]
-        self._generateRequests(0, requestTypeOneTimes)
-        requestTypeTwoTimes = requestTimes[requestTypes == 1] 
-        self._generateRequests(1, requestTypeTwoTimes)
+        hasPending = self.nextArrival < len(self.arrivalTimes) #arrivals of the previous period are still to come
+        columns = self._generateRequests(self.environment.currentTime)
+        if hasPending: #only the pending tail is copied, the arrays stay unboxed
+            columns = [np.concatenate((previous[self.nextArrival:], column)) for previous, column in zip((self.arrivalTimes, self.types, self.processingTimes, self.timeLimits), columns)]
+        self.arrivalTimes, self.types, self.processingTimes, self.timeLimits = columns
+        self.nextArrival = 0
+        if self.streamId is not None:
+            self.environment.refreshStream(self.streamId)
+        elif not hasPending:
+            self._scheduleNextArrival()
+
+class PiecewiseLinearRate:
+    """
+    Arrival rate function lambda(t) that is linear between knots, optionally repeating with a period (e.g. a day)
+    """
+    def __init__(self, times, rates, period = None):
+        """
+        Parameters
+        ----------
+        times, rates : list[float]
+            Knots of the rate function, times increasing. Outside the knots the rate is constant.
+        period : float, optional
+            Repeat the rate function with this period, the knots should lie in [0, period)
+        """
+        self.times = np.asarray(times, dtype=float)
+        self.rates = np.asarray(rates, dtype=float)
+        assert np.all(np.diff(self.times) >= 0), "times must be increasing"
+        assert np.all(self.rates >= 0), "rates must be non-negative"
+        self.period = period
+        if period is not None: #continue the knots periodically so the interpolation wraps around
+            self.times = np.concatenate([self.times[-1:] - period, self.times, self.times[:1] + period])
+            self.rates = np.concatenate([self.rates[-1:], self.rates, self.rates[:1]])
+
+    @classmethod
+    def fromSchedule(cls, arrivalSchedule: list, periodLength, interpolate = 'linear', repeat = True):
+        """
+        Rate function for the arrivalSchedule lists of ArrivalSchedule, with arrivalSchedule[i] the rate of period i
+
+        Parameters
+        ----------
+        interpolate : str
+            'linear' connects the rates at the midpoints of the periods, 'step' keeps the rate constant per period like
+            ArrivalSchedule
+        repeat : bool
+            Repeat the schedule, like ArrivalSchedule does at its end
+        """
+        rates = np.asarray(arrivalSchedule, dtype=float)
+        starts = np.arange(len(rates))*periodLength
+        if interpolate == 'linear':
+            times = starts + periodLength/2
+        elif interpolate == 'step':
+            times, rates = np.stack([starts, starts + periodLength]).T.ravel(), np.repeat(rates, 2)
+            times[1::2] = np.nextafter(times[1::2], -np.inf) #the rate jumps at the period start
+        else:
+            raise ValueError(f"Unknown interpolation '{interpolate}', choose from 'linear' or 'step'")
+        return cls(times, rates, period=len(rates)*periodLength if repeat else None)
+
+    def endTime(self):
+        """
+        Time from which the rate stays 0, inf when it does not
+        """
+        positive = np.flatnonzero(self.rates > 0)
+        if len(positive) == 0: return -np.inf
+        if self.period is not None or positive[-1] == len(self.rates) - 1: return np.inf
+        return float(self.times[positive[-1] + 1])
+
+    def _wrap(self, t):
+        if self.period is None: return t
+        return np.mod(t, self.period)
+
+    def __call__(self, t):
+        return np.interp(self._wrap(t), self.times, self.rates)
+
+    def maxRate(self, startTime, endTime):
+        """
+        Maximum of the rate over [startTime, endTime]
+        """
+        if self.period is not None and endTime - startTime >= self.period:
+            return float(self.rates.max())
+        start, end = self._wrap(startTime), self._wrap(startTime) + (endTime - startTime)
+        times = self.times if self.period is None else np.concatenate([self.times, self.times + self.period])
+        rates = self.rates if self.period is None else np.concatenate([self.rates, self.rates])
+        inside = rates[(times > start) & (times < end)]
+        return float(max(np.interp(start, times, rates), np.interp(end, times, rates), inside.max() if len(inside) else 0))
+
+
+class NHPPSource():
+    """
+    Non-homogeneous Poisson arrivals with rate function lambda(t), generated by thinning in blocks of blockLength
+    seconds: a homogeneous Poisson process with the maximal rate of the block is sampled with vectorized exponential
+    gaps and every arrival at time t is kept with probability lambda(t)/maxRate. The arrivals of a block are fed to the
+    environment as a stream (see Environment.addStream), so the rate can change smoothly without extra events.
+    """
+    def __init__(self, rateFunction, requestTypes, loadBalancer: LoadBalancer, environment: Environment, blockLength = 60.0):
+        """
+        Parameters
+        ----------
+        rateFunction: callable
+            Arrivals per second at time t, vectorized over arrays of times. For thinning it needs a method
+            maxRate(startTime, endTime), like PiecewiseLinearRate. An optional method endTime() gives the time from
+            which the rate stays 0, no blocks are generated after it.
+        requestTypes: list[tuple]
+            Request types, structured like [(typeProb, typeMean, typeStd, timeLimit),...]
+        blockLength: float
+            Length of the blocks in which the arrivals are generated
+        """
+        self.rateFunction = rateFunction
+        self.requestTypes = requestTypes
+        self.loadBalancer = loadBalancer
+        self.environment = environment
+        self.blockLength = blockLength
+        self.arrivalStream = environment.random.stream('arrivals')
+        self.typeStream = environment.random.stream('types')
+        self.serviceStream = environment.random.stream('service')
+        self.requestTypeProbs = [requestType[0] for requestType in self.requestTypes]
+        self.cumulativeTypeProbs = np.cumsum(self.requestTypeProbs)
+        self.typeMeans, self.typeStds, self.typeTimeLimits = (np.array([requestType[i] for requestType in self.requestTypes], dtype=float) for i in (1, 2, 3))
+        assert abs(sum(self.requestTypeProbs) - 1.0) < 1e-9, "typeProbs of provides requestTypes must sum to 1"
+        self.requestId = 0
+        self.blockStart = environment.currentTime
+        self.endTime = rateFunction.endTime() if hasattr(rateFunction, 'endTime') else np.inf
+        self.arrivalTimes, self.types, self.processingTimes, self.timeLimits = np.empty(0), np.empty(0, dtype=np.int64), np.empty(0), np.empty(0) #arrivals of the current block
+        self.nextArrival = 0
+        self.streamId = environment.addStream(ArrivalStream(self._nextArrival), self._onStreamArrival)
+
+    def _getReqId(self):
+        self.requestId +=1 #number of requests generated by this source
+        return self.environment.newRequestId() #ids are unique over all sources
+
+    def _sampleBlock(self, startTime, endTime):
+        """
+        Arrival times in [startTime, endTime) by thinning
+        """
+        maxRate = self.rateFunction.maxRate(startTime, endTime)
+        if maxRate <= 0: return np.empty(0)
+        expected = maxRate*(endTime - startTime)
+        times = [np.empty(0)]
+        lastTime = startTime
+        while lastTime < endTime: #candidates of the homogeneous process with rate maxRate
+            gaps = -np.log(1.0 - self.arrivalStream.random(int(expected + 5*np.sqrt(expected) + 10)))/maxRate
+            candidates = lastTime + np.cumsum(gaps)
+            times.append(candidates[candidates < endTime])
+            lastTime = candidates[-1]
+        times = np.concatenate(times)
+        keep = self.arrivalStream.random(len(times))*maxRate < self.rateFunction(times)
+        return times[keep]
+
+    def _generateBlock(self):
+        startTime, endTime = self.blockStart, self.blockStart + self.blockLength
+        self.blockStart = endTime
+        requestTimes = self._sampleBlock(startTime, endTime)
+        requestTypes = np.searchsorted(self.cumulativeTypeProbs, self.typeStream.random(len(requestTimes))*self.cumulativeTypeProbs[-1], side='right')
+        requestTypes = np.minimum(requestTypes, len(self.requestTypes) - 1)
+        processingTimes = self.typeMeans[requestTypes] + self.typeStds[requestTypes]*self.serviceStream.standardNormal(len(requestTimes))
+        self.arrivalTimes, self.types, self.processingTimes, self.timeLimits = requestTimes, requestTypes, processingTimes, self.typeTimeLimits[requestTypes]
+        self.nextArrival = 0
+
+    def _nextArrival(self):
+        while self.nextArrival >= len(self.arrivalTimes): #blocks without arrivals are skipped
+            if self.blockStart >= min(self.endTime, self.environment.stopTime): raise StopIteration #no arrivals left
+            self._generateBlock()
+        return (self.arrivalTimes.item(self.nextArrival), None)
+
+    def _onStreamArrival(self, payload):
+        i = self.nextArrival
+        self.nextArrival += 1
+        request = Request.create(type=self.types.item(i), processingTime=self.processingTimes.item(i), timeRequirement=self.timeLimits.item(i), environment=self.environment, id=self._getReqId())
+        self.loadBalancer.handleRequestArrival(request)
+
+
+class DecisionSchedule:
+    """
+    Notifies the loadBalancer that a new period has started every periodLength seconds, without changing the arrival
+    rate (use with a source that has its own rate function, like NHPPSource)
+    """
+    def __init__(self, periodLength, environment, loadBalancer):
+        self.loadBalancer = loadBalancer
+        self.clock = EventClock(periodLength, self.nextPeriod, environment)
+
+    def nextPeriod(self):
+        self.loadBalancer.onPeriodEnd()
+
 
 class ArrivalSchedule:
     """
@@ -0,0 +1,144 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+if TYPE_CHECKING: #only for typechecking
+    from sim.LoadBalancer import LoadBalancer
+
+from sim.Environment import Environment
+from sim.Request import Request
+from sim.Source import ArrivalStream
+import itertools
+import os
+
+import numpy as np
+
+#one record per request, timeLimit is relative to the arrival time like the timeLimit of the requestTypes
+TRACE_DTYPE = np.dtype([('time', '<f8'), ('type', '<i4'), ('processingTime', '<f8'), ('timeLimit', '<f8')])
+
+
+def openTrace(path):
+    """
+    Memory-map a trace file (a .npy file of TRACE_DTYPE records), nothing is read until the records are used
+    """
+    trace = np.load(path, mmap_mode='r')
+    if trace.dtype != TRACE_DTYPE:
+        raise ValueError(f"{path} is not a trace, its dtype is {trace.dtype}")
+    return trace
+
+
+def convertCsv(csvPath, tracePath, columns = None, delimiter = ',', chunkSize = 1_000_000):
+    """
+    Convert a csv file with a header line to a trace file, in chunks of chunkSize lines so the csv does not have to
+    fit in memory. The rows must be sorted by arrival time.
+
+    Parameters
+    ----------
+    columns : dict, optional
+        Csv column name per trace field, e.g. {'time': 'timestamp', 'timeLimit': 'deadline'}, by default the field names
+    delimiter : str
+        Column separator of the csv
+
+    Returns
+    -------
+    int
+        The number of requests in the trace
+    """
+    columns = {**{name: name for name in TRACE_DTYPE.names}, **(columns or {})}
+    with open(csvPath) as file:
+        header = [name.strip() for name in file.readline().split(delimiter)]
+        missing = [columns[name] for name in TRACE_DTYPE.names if columns[name] not in header]
+        if missing:
+            raise ValueError(f"Columns {missing} not found in {csvPath}")
+        usecols = [header.index(columns[name]) for name in TRACE_DTYPE.names]
+        nRequests = sum(1 for line in file if line.strip())
+    trace = np.lib.format.open_memmap(tracePath, mode='w+', dtype=TRACE_DTYPE, shape=(nRequests,))
+    with open(csvPath) as file:
+        file.readline()
+        lines = (line for line in file if line.strip())
+        start, lastTime = 0, -np.inf
+        while start < nRequests:
+            chunk = list(itertools.islice(lines, chunkSize))
+            values = np.loadtxt(chunk, delimiter=delimiter, usecols=usecols, ndmin=2)
+            if values[0, 0] < lastTime or np.any(np.diff(values[:, 0]) < 0):
+                del trace
+                os.remove(tracePath)
+                raise ValueError(f"{csvPath} is not sorted by arrival time")
+            for i, name in enumerate(TRACE_DTYPE.names):
+                trace[name][start:start + len(chunk)] = values[:, i]
+            start += len(chunk)
+            lastTime = values[-1, 0]
+    trace.flush()
+    return nRequests
+
+
+class TraceSource():
+    """
+    Replays the requests of a trace file. The file is memory-mapped and read in chunks of chunkSize records, which are
+    fed to the environment as a stream (see Environment.addStream), so traces much larger than memory replay without
+    an event per arrival. Pickles as the trace path and the position in the trace.
+    """
+    def __init__(self, tracePath, loadBalancer: LoadBalancer, environment: Environment, timeScale = 1.0, startTime = None, endTime = None, chunkSize = 65536):
+        """
+        Parameters
+        ----------
+        tracePath : str
+            Trace file, see convertCsv
+        timeScale : float
+            Simulation seconds per trace second, e.g. 0.5 replays the arrivals twice as fast. Processing times and
+            time limits are not scaled.
+        startTime, endTime : float, optional
+            Only replay the requests with startTime <= time < endTime (trace time), the request at startTime arrives
+            at the current time of the environment
+        chunkSize : int
+            Number of records read from the trace at once
+        """
+        self.tracePath = tracePath
+        self.loadBalancer = loadBalancer
+        self.environment = environment
+        self.timeScale = timeScale
+        self.chunkSize = chunkSize
+        self.trace = openTrace(tracePath)
+        times = self.trace['time']
+        self.start = 0 if startTime is None else int(np.searchsorted(times, startTime, side='left'))
+        self.end = len(self.trace) if endTime is None else int(np.searchsorted(times, endTime, side='left'))
+        self.traceStartTime = (times[self.start] if self.start < self.end else 0.0) if startTime is None else startTime
+        self.simulationStartTime = environment.currentTime
+        self.requestId = 0
+        self.cursor = self.start #trace index of the first record of the current chunk
+        self.nextArrival = self.start #trace index of the next request
+        self._readChunk()
+        self.streamId = environment.addStream(ArrivalStream(self._nextArrival), self._onStreamArrival)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('trace', 'arrivalTimes', 'types', 'processingTimes', 'timeLimits'): #reread from the trace on unpickling
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.trace = openTrace(self.tracePath)
+        self._readChunk()
+
+    def _getReqId(self):
+        self.requestId +=1 #number of requests generated by this source
+        return self.environment.newRequestId() #ids are unique over all sources
+
+    def _readChunk(self):
+        chunk = self.trace[self.cursor:min(self.cursor + self.chunkSize, self.end)]
+        self.arrivalTimes = (self.simulationStartTime + (chunk['time'] - self.traceStartTime)*self.timeScale).tolist()
+        self.types, self.processingTimes, self.timeLimits = chunk['type'].tolist(), chunk['processingTime'].tolist(), chunk['timeLimit'].tolist()
+
+    def _nextArrival(self):
+        i = self.nextArrival - self.cursor
+        if i >= len(self.arrivalTimes):
+            if self.nextArrival >= self.end: raise StopIteration
+            self.cursor = self.nextArrival
+            self._readChunk()
+            i = 0
+        return (self.arrivalTimes[i], None)
+
+    def _onStreamArrival(self, payload):
+        i = self.nextArrival - self.cursor
+        self.nextArrival += 1
+        request = Request.create(type=self.types[i], processingTime=self.processingTimes[i], timeRequirement=self.timeLimits[i], environment=self.environment, id=self._getReqId())
+        self.loadBalancer.handleRequestArrival(request)